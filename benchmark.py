@@ -0,0 +1,264 @@
+# benchmark.py
+"""
+Medições de desempenho do SimuladoMD (saída em JSON, para comparar execuções).
+
+    python benchmark.py startup [--repeticoes 5] [--saida startup.json]
+    python benchmark.py suite [--capitulos 200 --arquivos 10 --linhas-csv 100000] [--saida suite.json]
+
+A suíte monta uma árvore sintética num diretório temporário e troca a API por
+fake_api_server.py (latência configurável): roda sem display, sem rede e sem chave.
+"""
+import os, sys, csv, json, time, shutil, argparse, tempfile, statistics, subprocess
+from datetime import datetime, timedelta
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# roda num processo novo: mede import do main.py e a primeira janela (se houver display)
+_STARTUP_PROBE = r"""
+import json, time
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+window = None
+try:
+    import tkinter as tk
+    root = tk.Tk()
+    main.QuizApp(root)
+    root.update()
+    window = time.perf_counter() - t0
+    root.destroy()
+except Exception:
+    pass
+print(json.dumps({"import_main_s": t1 - t0, "first_window_s": window}))
+"""
+
+def _summary(values):
+    values = [v for v in values if v is not None]
+    if not values:
+        return None
+    return {"mediana": statistics.median(values), "min": min(values), "max": max(values), "n": len(values)}
+
+def bench_startup(repeticoes: int):
+    """Tempo até a primeira janela, medido em processos novos (sem cache de import em memória)."""
+    runs = []
+    for _ in range(repeticoes):
+        t0 = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", _STARTUP_PROBE], cwd=ROOT_DIR,
+                             capture_output=True, text=True, check=True)
+        total = time.perf_counter() - t0
+        probe = json.loads(out.stdout.strip().splitlines()[-1])
+        probe["processo_s"] = total
+        runs.append(probe)
+    return {
+        "import_main_s": _summary([r["import_main_s"] for r in runs]),
+        "primeira_janela_s": _summary([r["first_window_s"] for r in runs]),
+        "processo_s": _summary([r["processo_s"] for r in runs]),
+        "display": any(r["first_window_s"] is not None for r in runs),
+    }
+
+# ---------------- suíte: árvore sintética + API falsa ----------------
+_WORDS = ("dados", "nuvem", "azure", "tabela", "consulta", "armazenamento", "segurança", "identidade", "rede",
+          "análise", "relatório", "servidor", "banco", "índice", "partição", "chave", "esquema", "cluster",
+          "latência", "réplica", "backup", "política", "conformidade", "acesso", "usuário", "evento", "fluxo",
+          "lote", "modelo", "pipeline", "custo", "região", "disponibilidade", "escala", "transação", "log",
+          "métrica", "alerta", "função", "contêiner", "arquivo", "blob", "fila", "mensagem", "token", "chave-valor")
+
+def _sentence(rng, n_words):
+    words = [rng.choice(_WORDS) for _ in range(n_words)]
+    return " ".join(words).capitalize() + "."
+
+def make_markdown(rng, title: str, paragraphs: int) -> str:
+    """Um .md com cara de material de estudo: títulos, parágrafos, imagem, link e tabela."""
+    lines = [f"# {title}", "", _sentence(rng, 14), ""]
+    for k in range(paragraphs):
+        if k % 3 == 0:
+            lines += [f"## Seção {k // 3 + 1}", ""]
+        lines += [" ".join(_sentence(rng, rng.randint(8, 20)) for _ in range(rng.randint(2, 5))), ""]
+        if k % 4 == 1:
+            lines += [f"![diagrama {k}](https://exemplo.com/img/{k}.png)", "",
+                      f"Veja [a documentação](https://learn.exemplo.com/{k}) para detalhes.", ""]
+        if k % 5 == 2:
+            lines += ["| Recurso | Descrição |", "|---|---|"]
+            lines += [f"| {rng.choice(_WORDS)} | {_sentence(rng, 6)} |" for _ in range(3)] + [""]
+    return "\n".join(lines)
+
+def build_tree(root: str, simulados: int, capitulos: int, arquivos: int, paragrafos: int, linhas_csv: int, rng):
+    """simulados × capítulos × arquivos .md (layout novo: ./<simulado>/<capítulo>/) e um results.csv grande."""
+    names = {}
+    for s in range(simulados):
+        sim = f"bench{s}"
+        sim_dir = os.path.join(root, sim)
+        names[sim] = []
+        for c in range(1, capitulos + 1):
+            ch_dir = os.path.join(sim_dir, str(c))
+            os.makedirs(ch_dir)
+            for k in range(1, arquivos + 1):
+                name = f"{c}.{k} Tópico {rng.choice(_WORDS)} {k}.md"
+                names[sim].append(name)
+                with open(os.path.join(ch_dir, name), "w", encoding="utf-8") as f:
+                    f.write(make_markdown(rng, name[:-3], paragrafos))
+        os.makedirs(os.path.join(sim_dir, "logs"))
+        start = datetime(2024, 1, 1)
+        with open(os.path.join(sim_dir, "results.csv"), "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["arquivo_md", "data", "hora", "acertos", "erros", "total_perguntas"])
+            for _ in range(linhas_csv):
+                when = start + timedelta(seconds=rng.randrange(2 * 365 * 86400))
+                total = rng.choice((5, 10, 20))
+                acertos = rng.randint(0, total)
+                writer.writerow([rng.choice(names[sim]), when.strftime("%Y-%m-%d"), when.strftime("%H:%M:%S"),
+                                 acertos, total - acertos, total])
+    return names
+
+def _timeit(fn, repeticoes: int):
+    """Executa fn repeticoes vezes; devolve (resumo dos tempos, último retorno)."""
+    times, result = [], None
+    for _ in range(repeticoes):
+        t0 = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - t0)
+    return _summary(times), result
+
+def bench_suite(args):
+    """Mede as etapas quentes do main.py numa árvore sintética, sem rede, display ou chave de API."""
+    import random
+    import fake_api_server
+    rng = random.Random(args.semente)
+    server = fake_api_server.start_server(latencia=args.latencia, latencia_por_pergunta=args.latencia_por_pergunta,
+                                          semente=args.semente)
+    os.environ["DEEPSEEK_API_KEY"] = "benchmark"  # o .env não sobrescreve variáveis já definidas
+    os.environ["DEEPSEEK_BASE_URL"] = server.base_url
+    root = args.manter or tempfile.mkdtemp(prefix="simuladomd_bench_")
+    os.makedirs(root, exist_ok=True)
+    try:
+        t0 = time.perf_counter()
+        names = build_tree(root, args.simulados, args.capitulos, args.arquivos, args.paragrafos, args.linhas_csv, rng)
+        setup_s = time.perf_counter() - t0
+
+        import main
+        main.ROOT_DIR = root
+        main.QUESTION_CACHE_DIR = os.path.join(root, ".cache", "perguntas")
+        main.invalidate_content_index()
+        main.get_client()  # import do openai e criação do cliente fora das medições
+        sim, r = "bench0", {}
+
+        def discovery():
+            count = 0
+            for s in main.list_simulados():
+                for ch in main.get_chapters(s):
+                    count += len(main.get_md_files(s, ch))
+            return count
+
+        def discovery_cold():
+            main.invalidate_content_index()
+            return discovery()
+
+        r["descoberta_fria"], n_files = _timeit(discovery_cold, args.repeticoes)
+        r["descoberta_quente"], _ = _timeit(discovery, args.repeticoes)
+
+        chapters = main.get_chapters(sim)
+        sample = [chapters[i] for i in sorted(rng.sample(range(len(chapters)), min(20, len(chapters))))]
+        r["capitulo_completo"], _ = _timeit(lambda: [main.get_all_md_content_from_chapter(sim, ch) for ch in sample], args.repeticoes)
+        r["capitulo_completo"]["capitulos_por_repeticao"] = len(sample)
+        content = main.get_all_md_content_from_chapter(sim, chapters[0])
+
+        # extração + normalização de uma resposta típica, sem rede (texto em pedaços, como no streaming)
+        prompt = main.build_prompt(main.compress_content(content), args.perguntas)
+        items = [json.dumps(q, ensure_ascii=False) for q in fake_api_server.make_questions(prompt, random.Random(1))]
+        response = "[" + ",\n".join(items) + "]"
+
+        def parse():
+            parser, out = main.JSONArrayStreamParser(), []
+            for i in range(0, len(response), 64):
+                out += [main.normalize_question(obj) for obj in parser.feed(response[i:i + 64])]
+            return out
+        r["parse_normalizacao"], parsed = _timeit(parse, args.repeticoes * 20)
+        r["parse_normalizacao"]["perguntas"] = len(parsed)
+
+        for mode, on_question in (("geracao_mock", None), ("geracao_mock_streaming", lambda q: None)):
+            main.TIMINGS.clear()
+            r[mode], got = _timeit(lambda: main.generate_questions_from_api(content, args.perguntas, True, on_question),
+                                   args.repeticoes)
+            r[mode]["perguntas"] = len(got)
+            r[mode]["etapas"] = {row["etapa"]: row["media_ms"] for row in main.TIMINGS.summary()}
+
+        cues = [" ".join(q["explanation_cue"].split()[:6]) for q in parsed]
+        r["indice_paragrafos"], index = _timeit(lambda: main.ParagraphIndex(content), args.repeticoes)
+        r["justificativa_com_indice"], _ = _timeit(lambda: [main.find_explanation_in_text(content, c, index) for c in cues], args.repeticoes)
+        r["justificativa_com_indice"]["buscas_por_repeticao"] = len(cues)
+
+        # busca BM25: índice completo (frio), revalidação sem mudanças e consultas de 1 a 3 termos
+        search = main.search_index()
+        r["busca_indexacao_completa"], indexed = _timeit(lambda: search.refresh(force=True), 1)
+        r["busca_indexacao_completa"]["arquivos"] = indexed
+        r["busca_revalidacao"], _ = _timeit(lambda: search.refresh(force=True), args.repeticoes)
+        queries = [" ".join(rng.sample(_WORDS, n)) for n in (1, 2, 3) for _ in range(3)]
+        r["busca_consulta"], _ = _timeit(lambda: [search.search(q, 10) for q in queries], args.repeticoes)
+        r["busca_consulta"]["consultas_por_repeticao"] = len(queries)
+
+        sim_dir = os.path.join(root, sim)
+        r["migracao_results_csv"], migrated = _timeit(lambda: main.open_results_store(sim_dir), 1)
+        r["migracao_results_csv"]["linhas"] = migrated.record_count()
+        store = main.ResultsStore(sim_dir)
+        r["agregacao_completa"], _ = _timeit(store.rebuild_aggregates, args.repeticoes)
+        r["agregacao_dashboard"], _ = _timeit(store.aggregates, args.repeticoes)
+
+        answers = [{"question": q["question"], "selected": [q["options"][0]], "correct": [q["options"][0]],
+                    "is_correct": True, "source_file": names[sim][0], "time_to_answer": 5.0} for q in parsed]
+        base = datetime(2030, 1, 1)
+        stamp = iter(range(10 ** 6))
+        job = lambda: main.make_result_job(sim_dir, names[sim][0], answers, len(answers), 0, len(answers),
+                                           when=base + timedelta(seconds=next(stamp)))
+        r["gravacao_resultado"], _ = _timeit(lambda: main.write_results_batch(sim_dir, [job()]), args.repeticoes)
+        r["gravacao_lote_20"], _ = _timeit(lambda: main.write_results_batch(sim_dir, [job() for _ in range(20)]), args.repeticoes)
+
+        return {
+            "config": {"simulados": args.simulados, "capitulos": args.capitulos, "arquivos_por_capitulo": args.arquivos,
+                       "arquivos_md": n_files, "paragrafos": args.paragrafos, "linhas_csv": args.linhas_csv,
+                       "perguntas": args.perguntas, "latencia_api_s": args.latencia, "repeticoes": args.repeticoes,
+                       "semente": args.semente, "montagem_s": round(setup_s, 3)},
+            "etapas": r,
+            "api_falsa": dict(server.stats),
+        }
+    finally:
+        server.shutdown()
+        if not args.manter:
+            shutil.rmtree(root, ignore_errors=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks do SimuladoMD (saída JSON)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_start = sub.add_parser("startup", help="tempo de abertura (import + primeira janela)")
+    p_start.add_argument("--repeticoes", type=int, default=5)
+    p_suite = sub.add_parser("suite", help="descoberta, leitura, parsing, justificativas, gravação e agregação (árvore sintética)")
+    p_suite.add_argument("--simulados", type=int, default=2)
+    p_suite.add_argument("--capitulos", type=int, default=200, help="capítulos por simulado")
+    p_suite.add_argument("--arquivos", type=int, default=10, help="arquivos .md por capítulo")
+    p_suite.add_argument("--paragrafos", type=int, default=8, help="parágrafos por arquivo .md")
+    p_suite.add_argument("--linhas-csv", type=int, default=100_000, help="linhas do results.csv de cada simulado")
+    p_suite.add_argument("--perguntas", type=int, default=10, help="perguntas por chamada à API falsa")
+    p_suite.add_argument("--latencia", type=float, default=0.05, help="latência da API falsa (s)")
+    p_suite.add_argument("--latencia-por-pergunta", type=float, default=0.0)
+    p_suite.add_argument("--repeticoes", type=int, default=3)
+    p_suite.add_argument("--semente", type=int, default=0)
+    p_suite.add_argument("--manter", help="monta a árvore neste diretório e não apaga no fim")
+    for p in (p_start, p_suite):
+        p.add_argument("--saida", help="grava o JSON neste arquivo (padrão: stdout)")
+    args = parser.parse_args(argv)
+
+    report = {
+        "benchmark": args.command,
+        "quando": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "resultados": bench_startup(args.repeticoes) if args.command == "startup" else bench_suite(args),
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
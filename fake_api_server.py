@@ -0,0 +1,222 @@
+# fake_api_server.py
+"""
+Servidor local que imita o endpoint de chat da DeepSeek (formato OpenAI), para
+testar vazão e tratamento de falhas sem rede e sem gastar créditos.
+
+    python fake_api_server.py [--porta 8765] [--latencia 0.2] [--taxa-json-invalido 0.1] ...
+
+e, no outro terminal:
+
+    DEEPSEEK_API_KEY=teste DEEPSEEK_BASE_URL=http://127.0.0.1:8765 python main.py
+
+As perguntas são montadas a partir de frases do próprio conteúdo enviado no
+prompt (a "explanation_cue" é um trecho real do texto), de forma determinística
+para a mesma semente.
+"""
+import re, sys, json, time, random, argparse, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+CONTENT_MARKER = "--- CONTEÚDO PARA ANÁLISE ---"
+DEFAULT_OPTIONS = {
+    "latencia": 0.0,                # s antes do primeiro byte
+    "latencia_por_pergunta": 0.0,   # s entre perguntas (streaming) / somados (sem streaming)
+    "taxa_json_invalido": 0.0,      # fração das perguntas com JSON quebrado
+    "taxa_erro_http": 0.0,          # fração das chamadas respondidas com 500/503/429
+    "taxa_truncado": 0.0,           # fração das respostas cortadas no meio
+    "taxa_lenta": 0.0,              # fração das chamadas com latencia_lenta a mais (cauda de latência)
+    "latencia_lenta": 0.0,
+    "semente": 0,
+}
+
+def _requested_count(prompt: str) -> int:
+    m = re.search(r"exatamente (\d+) objetos", prompt)
+    return int(m.group(1)) if m else 10
+
+def _content_sentences(prompt: str):
+    content = prompt.split(CONTENT_MARKER, 1)[-1]
+    content = re.sub(r"[#*_`>|\[\]()!-]+", " ", content)
+    sentences = [s.strip() for s in re.split(r"(?<=[.!?])\s+|\n+", content)]
+    return [s for s in sentences if len(s.split()) >= 4] or ["O conteúdo enviado estava vazio ou curto demais."]
+
+def make_questions(prompt: str, rng: random.Random):
+    """Perguntas de múltipla escolha com base nas frases do conteúdo do prompt."""
+    sentences = _content_sentences(prompt)
+    questions = []
+    for i in range(_requested_count(prompt)):
+        sentence = sentences[rng.randrange(len(sentences))]
+        words = sentence.split()
+        cue = " ".join(words[:8])
+        correct = rng.randrange(4)
+        options = [f"Afirmação {i + 1}.{k + 1} sobre {rng.choice(words)}" for k in range(4)]
+        options[correct] = sentence[:120]
+        questions.append({
+            "question": f"Pergunta {i + 1} (#{rng.randrange(10 ** 6)}): qual afirmação aparece no texto?",
+            "options": options,
+            "answer": ["ABCD"[correct]],
+            "explanation_cue": cue,
+        })
+    return questions
+
+def _render_items(questions, rng: random.Random, opts):
+    """Cada pergunta como texto JSON; algumas saem quebradas conforme taxa_json_invalido."""
+    items = []
+    for q in questions:
+        text = json.dumps(q, ensure_ascii=False)
+        if rng.random() < opts["taxa_json_invalido"]:
+            text = text.replace('"options"', "'options'", 1)  # aspas simples: JSON inválido
+        items.append(text)
+    return items
+
+
+class FakeChatHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # conexões persistentes (keep-alive), como a API real
+
+    def log_message(self, fmt, *args):
+        if self.server.options.get("verbose"):
+            super().log_message(fmt, *args)
+
+    def _send_json(self, status: int, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path.rstrip("/") not in ("/chat/completions", "/v1/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            req = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": {"message": "invalid json body"}})
+            return
+
+        opts, rng = self.server.options, self.server.next_rng()
+        self.server.count("chamadas")
+        slow = opts["taxa_lenta"] > 0 and rng.random() < opts["taxa_lenta"]  # sem sorteio extra: mantém as sementes
+        if slow:
+            self.server.count("lentas")
+        time.sleep(opts["latencia"] + (opts["latencia_lenta"] if slow else 0.0))
+        if rng.random() < opts["taxa_erro_http"]:
+            self.server.count("erros_http")
+            status = rng.choice((429, 500, 503))
+            self._send_json(status, {"error": {"message": f"erro simulado {status}", "type": "server_error"}})
+            return
+
+        prompt = next((m.get("content", "") for m in reversed(req.get("messages", []))
+                       if m.get("role") == "user"), "")
+        items = _render_items(make_questions(prompt, rng), rng, opts)
+        truncate = rng.random() < opts["taxa_truncado"]
+        if truncate:
+            self.server.count("truncadas")
+        model = req.get("model", "deepseek-chat")
+        if req.get("stream"):
+            self._stream(items, model, truncate, rng)
+        else:
+            time.sleep(opts["latencia_por_pergunta"] * len(items))
+            text = "[" + ",\n".join(items) + "]"
+            if truncate:
+                text = text[: rng.randrange(1, len(text))]
+            self._send_json(200, {
+                "id": "fake-1", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                             "finish_reason": "length" if truncate else "stop"}],
+                "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(text) // 4,
+                          "total_tokens": (len(prompt) + len(text)) // 4},
+            })
+
+    def _stream(self, items, model: str, truncate: bool, rng: random.Random):
+        """Server-sent events no formato do streaming da OpenAI, terminando em 'data: [DONE]'."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def event(content, finish=None):
+            chunk = {"id": "fake-1", "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": model, "choices": [{"index": 0, "delta": {"content": content} if content else {},
+                                                  "finish_reason": finish}]}
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        cut = rng.randrange(len(items)) if truncate and items else None
+        try:
+            event("[")
+            for i, item in enumerate(items):
+                time.sleep(self.server.options["latencia_por_pergunta"])
+                if i == cut:
+                    event(item[: len(item) // 2], finish="length")
+                    break
+                event(("," if i else "") + item)
+            else:
+                event("]", finish="stop")
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # cliente cancelou (fechou o stream)
+
+
+class FakeChatServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, options):
+        super().__init__(address, FakeChatHandler)
+        self.options = options
+        self.stats = {"chamadas": 0, "erros_http": 0, "truncadas": 0, "lentas": 0}
+        self._rng = random.Random(options["semente"])
+        self._lock = threading.Lock()
+
+    def next_rng(self) -> random.Random:
+        with self._lock:
+            return random.Random(self._rng.random())
+
+    def count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+def start_server(host: str = "127.0.0.1", port: int = 0, **options):
+    """Sobe o servidor numa thread e o devolve (port=0 escolhe uma porta livre; veja .base_url)."""
+    server = FakeChatServer((host, port), {**DEFAULT_OPTIONS, **options})
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor local que imita a API de chat da DeepSeek")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=8765)
+    parser.add_argument("--latencia", type=float, default=0.0, help="s antes de responder")
+    parser.add_argument("--latencia-por-pergunta", type=float, default=0.0, help="s por pergunta gerada")
+    parser.add_argument("--taxa-json-invalido", type=float, default=0.0, help="fração de perguntas com JSON quebrado")
+    parser.add_argument("--taxa-erro-http", type=float, default=0.0, help="fração de chamadas com 429/500/503")
+    parser.add_argument("--taxa-truncado", type=float, default=0.0, help="fração de respostas cortadas no meio")
+    parser.add_argument("--taxa-lenta", type=float, default=0.0, help="fração de chamadas com latência extra")
+    parser.add_argument("--latencia-lenta", type=float, default=0.0, help="s a mais nas chamadas lentas")
+    parser.add_argument("--semente", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="registra cada requisição")
+    args = parser.parse_args(argv)
+
+    options = {k: getattr(args, k) for k in DEFAULT_OPTIONS}
+    options["verbose"] = args.verbose
+    server = FakeChatServer((args.host, args.porta), {**DEFAULT_OPTIONS, **options})
+    print(f"Servidor falso em {server.base_url} (use DEEPSEEK_BASE_URL={server.base_url})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.stats, ensure_ascii=False))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,28 +1,216 @@
 # main.py
-import os, re, json, csv
-from datetime import datetime
+import os, sys, re, ast, json, csv, time, sqlite3, hashlib, functools, math, threading, queue, gzip, random, argparse, heapq, unicodedata, struct, calendar, atexit, logging, bisect
+from array import array
+from collections import defaultdict, OrderedDict, deque, Counter
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 import tkinter as tk
-from tkinter import messagebox, Frame, Label, Button, Checkbutton, StringVar, scrolledtext, Canvas, Scrollbar
+from tkinter import messagebox, Frame, Label, Button, Checkbutton, StringVar, scrolledtext, Canvas, Scrollbar, ttk
 
 from dotenv import load_dotenv
-from openai import OpenAI
 
-import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+# openai e matplotlib são importados no primeiro uso (ver get_client e o dashboard):
+# a tela inicial não precisa deles e eles dominavam o tempo de abertura. O mesmo vale
+# para asyncio (só o servidor) e urllib (só o cliente do servidor).
 
 # -------------------------- CONFIG GLOBAL --------------------------
 load_dotenv()
 
-try:
-    client = OpenAI(api_key=os.getenv("DEEPSEEK_API_KEY"), base_url="https://api.deepseek.com")
-except Exception as e:
-    print(f"Erro ao inicializar o cliente da API: {e}")
-    client = None
+# avisos e erros vão para este logger, nunca para o stdout: no "gerar" o stdout é só JSONL
+# (sem handler configurado, como na GUI, o logging manda WARNING+ para o stderr)
+log = logging.getLogger("simuladomd")
+
+def get_client():
+    """Cliente do provedor principal, criado na primeira geração; None se não houver chave/configuração."""
+    router = provider_router()
+    if router is None:
+        return None
+    try:
+        return router.providers[0].client()
+    except Exception as e:
+        log.error(f"Erro ao inicializar o cliente da API: {e}")
+        return None
+
+def warm_up_imports():
+    """Pré-carrega openai/matplotlib em segundo plano, depois que a janela já apareceu."""
+    try:
+        import openai  # noqa: F401
+        import matplotlib.figure  # noqa: F401
+        import matplotlib.backends.backend_tkagg  # noqa: F401
+    except ImportError:
+        pass
 
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 LOGS_FOLDER_NAME = "logs"
 RESULTS_FILENAME = "results.csv"
+SIMULADO_EXCLUDED = {"__pycache__", "venv", "env", "nenv", LOGS_FOLDER_NAME, "conteudo", "logs"}
+CONTENT_INDEX_TTL = 2.0  # s entre revalidações (stat dos diretórios) do índice de conteúdo
+
+DEEPSEEK_MODEL = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
+PROMPT_VERSION = 2  # incremente ao mudar o prompt: invalida o cache de perguntas
+
+# chamadas à API: tempo limite, novas tentativas em falhas transitórias e reenvios
+# pedindo só as perguntas que faltaram (JSON inválido/truncado)
+API_TIMEOUT_S = 60.0
+API_MAX_ATTEMPTS = 4
+API_BACKOFF_BASE_S = 1.0
+API_BACKOFF_MAX_S = 20.0
+API_REPAIR_ROUNDS = 2
+DEDUP_MAX_AVOID = 30  # perguntas repetidas listadas no reenvio (limita o tamanho do prompt)
+
+# hedge entre provedores (ver PROVEDORES): atraso = p95 recente do preferido, limitado abaixo
+HEDGE_DEFAULT_DELAY_S = 8.0   # enquanto não há HEDGE_MIN_SAMPLES medições
+HEDGE_MIN_DELAY_S = 1.0
+HEDGE_MAX_DELAY_S = 30.0
+HEDGE_MIN_SAMPLES = 10
+PROVIDER_STATS_WINDOW = 200   # latências recentes guardadas por provedor
+PROVIDER_HEALTH_WINDOW = 20   # resultados recentes que entram na taxa de erro
+PROVIDER_UNHEALTHY_ERROR_RATE = 0.5
+PROVIDER_STATS_FILENAME = "provedores.json"
+
+# cache de perguntas geradas (chave = hash do conteúdo + parâmetros)
+QUESTION_CACHE_DIR = os.path.join(ROOT_DIR, ".cache", "perguntas")
+CACHE_MAX_ENTRIES = 500
+CACHE_MAX_BYTES = 50 * 1024 * 1024
+CACHE_MAX_AGE_DAYS = 30
+
+# geração de capítulo inteiro em partes paralelas
+CHUNK_MAX_TOKENS = 3000       # conteúdo estimado por chamada
+MAX_QUESTIONS_PER_CALL = 12   # perguntas por chamada (respostas longas truncam com mais frequência)
+CHUNK_WORKERS = 4
+GENERATION_WORKERS = 4        # gerações simultâneas da GUI (cada uma com até CHUNK_WORKERS partes)
+
+# orçamento de saída: max_tokens = OVERHEAD + nº de perguntas × POR_PERGUNTA
+OUTPUT_TOKENS_PER_QUESTION = 180  # uma pergunta em JSON (enunciado, 4 opções, pista), com folga
+OUTPUT_TOKENS_OVERHEAD = 64
+API_MAX_OUTPUT_TOKENS = 8192      # limite de saída do deepseek-chat
+
+# banco de perguntas pré-geradas (modo offline)
+QUESTION_BANK_FILENAME = "question_bank.json.gz"
+BANK_QUESTIONS_PER_FILE = 20
+
+# modo adaptativo: intervalo de revisão (dobra a cada acerto seguido) e limites do fator "vencido"
+ADAPTIVE_BASE_INTERVAL_DAYS = 1.0
+ADAPTIVE_MIN_DUE_FACTOR = 0.1
+ADAPTIVE_MAX_DUE_FACTOR = 3.0
+
+# perguntas quase repetidas (MinHash + LSH): 16 faixas × 4 linhas acham candidatos a partir de
+# ~50% de semelhança; acima de DEDUP_SIMILARITY (Jaccard estimado) é a mesma pergunta
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16
+DEDUP_SIMILARITY = 0.6
+
+# busca por tema (índice BM25 de todos os simulados)
+SEARCH_BM25_K1 = 1.2
+SEARCH_BM25_B = 0.75
+SEARCH_TOPIC_PASSAGES = 12  # trechos mais bem ranqueados que entram no prompt de um teste por tema
+SEARCH_RESULTS_LIMIT = 50   # trechos listados na tela de busca
+SEARCH_ALL_SIMULADOS = "(todos os simulados)"
+
+# fração (ponderada por IDF) das palavras da pista que o parágrafo precisa conter
+EXPLANATION_MIN_COVERAGE = 0.5
+
+RESULTS_STORE_DIRNAME = "results_store"
+FIGURE_CACHE_SIMULADOS = 4  # dashboards com figuras mantidas em memória
+TIMINGS_BUFFER_SIZE = 5000  # medições recentes mantidas para o painel de diagnóstico
+PROFILE_DIR = os.path.join(ROOT_DIR, ".cache", "perfil")
+WARMUP_DELAY_MS = 500  # pré-carga de openai/matplotlib depois que a janela aparece
+
+# servidor local (modo multiusuário)
+SERVER_DEFAULT_PORT = 8800
+SERVER_MAX_BODY_BYTES = 5 * 1024 * 1024
+SERVER_MAX_QUESTIONS = 50
+SERVER_CLIENT_TIMEOUT_S = 600.0  # a geração de um capítulo inteiro pode levar minutos
+SERVER_CLIENT_QUERY_TIMEOUT_S = 10.0  # listas e agregados (GET): respostas rápidas ou erro
+USERS_DIRNAME = "usuarios"       # <simulado>/usuarios/<usuário>/ guarda os resultados de cada um
+
+# -------------------------- INSTRUMENTAÇÃO --------------------------
+# span("etapa") mede um trecho e guarda (etapa, duração, thread, campos) num buffer circular:
+# custa um perf_counter na entrada e outro na saída. Com SIMULADOMD_PROFILE=etapa1,etapa2
+# (ou "*"), essas etapas também rodam sob cProfile e o .prof vai para .cache/perfil/.
+class Timings:
+    """Buffer circular das medições mais recentes, com resumo por etapa e exportação."""
+    def __init__(self, maxlen: int):
+        self.records = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float, **fields):
+        record = {"etapa": name, "ms": round(seconds * 1000, 3), "quando": time.time(),
+                  "thread": threading.current_thread().name, **fields}
+        with self._lock:
+            self.records.append(record)
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.records)
+
+    def clear(self):
+        with self._lock:
+            self.records.clear()
+
+    def summary(self):
+        """Por etapa: n, total, média, p50, p95 e máximo (ms), da mais cara para a mais barata."""
+        by_name = defaultdict(list)
+        for r in self.snapshot():
+            by_name[r["etapa"]].append(r["ms"])
+        rows = []
+        for name, values in by_name.items():
+            values.sort()
+            pick = lambda p: values[min(len(values) - 1, int(p * len(values)))]
+            rows.append({"etapa": name, "n": len(values), "total_ms": round(sum(values), 1),
+                         "media_ms": round(sum(values) / len(values), 2), "p50_ms": pick(0.5),
+                         "p95_ms": pick(0.95), "max_ms": values[-1]})
+        return sorted(rows, key=lambda r: -r["total_ms"])
+
+    def export_json(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"resumo": self.summary(), "medicoes": self.snapshot()}, f, ensure_ascii=False, indent=2)
+
+    def export_csv(self, path: str):
+        records = self.snapshot()
+        fields = ["etapa", "ms", "quando", "thread"]
+        fields += sorted({k for r in records for k in r} - set(fields))
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(records)
+
+TIMINGS = Timings(TIMINGS_BUFFER_SIZE)
+_profile_targets = {s.strip() for s in os.getenv("SIMULADOMD_PROFILE", "").split(",") if s.strip()}
+_profile_lock = threading.Lock()  # um cProfile por vez (o interpretador só aceita um ativo)
+
+@contextmanager
+def span(name: str, **fields):
+    profiler = None
+    if _profile_targets and (name in _profile_targets or "*" in _profile_targets) and _profile_lock.acquire(blocking=False):
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # outro profiler já ativo
+            profiler = None
+            _profile_lock.release()
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        TIMINGS.add(name, time.perf_counter() - t0, **fields)
+        if profiler is not None:
+            profiler.disable()
+            _profile_lock.release()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profiler.dump_stats(os.path.join(PROFILE_DIR, f"{name}_{datetime.now():%Y%m%d_%H%M%S_%f}.prof"))
+
+def timed(name: str):
+    """Decorador: a função inteira vira um span."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
 
 # -------------------------- FUNÇÕES DE I/O --------------------------
 def is_chapter_dir(name: str) -> bool:
@@ -54,6 +242,83 @@ def _looks_like_simulado(sim_path: str) -> bool:
     return has_csv or has_chapter_direct or has_chapter_in_conteudo
 
 
+class ContentTreeIndex:
+    """
+    Foto da árvore de conteúdo (simulados, capítulos, .md) montada numa única
+    passada com os.scandir. Guarda o mtime de cada diretório lido: criar, apagar
+    ou renomear entradas muda o mtime do diretório pai e invalida a foto.
+    """
+    def __init__(self, root: str):
+        self.root = root
+        self.dir_mtimes = {}   # diretório -> mtime na hora da leitura
+        self.root_dirs = set()
+        self.conteudo_dirs = set()
+        self.chapters = {}     # base do simulado -> capítulos ordenados
+        self.md_files = {}     # diretório do capítulo -> arquivos .md ordenados
+        self.checked_at = time.monotonic()
+        self._build()
+
+    def _scan(self, path: str):
+        """Entradas (nome, é_dir, é_arquivo) de um diretório; registra o mtime dele."""
+        try:
+            self.dir_mtimes[path] = os.stat(path).st_mtime
+            with os.scandir(path) as it:
+                return [(e.name, e.is_dir(), e.is_file()) for e in it]
+        except (FileNotFoundError, NotADirectoryError):
+            self.dir_mtimes[path] = None
+            return []
+
+    @timed("descoberta")
+    def _build(self):
+        self.root_dirs = {n for n, is_dir, _ in self._scan(self.root) if is_dir}
+        conteudo = os.path.join(self.root, "conteudo")
+        if "conteudo" in self.root_dirs:
+            self.conteudo_dirs = {n for n, is_dir, _ in self._scan(conteudo) if is_dir}
+        bases = [os.path.join(self.root, d) for d in self.root_dirs if not d.startswith(".") and d not in SIMULADO_EXCLUDED]
+        bases += [os.path.join(conteudo, d) for d in self.conteudo_dirs]
+        for base in bases:
+            chapters = [n for n, is_dir, _ in self._scan(base) if is_dir and n != LOGS_FOLDER_NAME and is_chapter_dir(n)]
+            self.chapters[base] = sorted(chapters, key=_chapter_sort_key)
+            for chapter in chapters:
+                chapter_path = os.path.join(base, chapter)
+                files = [n for n, _, is_file in self._scan(chapter_path) if is_file and n.lower().endswith(".md")]
+                self.md_files[chapter_path] = sorted(files, key=lambda x: x.lower())
+
+    def is_fresh(self) -> bool:
+        """Revalida (no máximo a cada CONTENT_INDEX_TTL s) comparando os mtimes dos diretórios."""
+        now = time.monotonic()
+        if now - self.checked_at < CONTENT_INDEX_TTL:
+            return True
+        for path, mtime in self.dir_mtimes.items():
+            try:
+                current = os.stat(path).st_mtime
+            except OSError:
+                current = None
+            if current != mtime:
+                return False
+        self.checked_at = now
+        return True
+
+_content_index = None
+_content_index_lock = threading.Lock()
+
+def content_index() -> ContentTreeIndex:
+    global _content_index
+    with _content_index_lock:
+        if _content_index is None or _content_index.root != ROOT_DIR or not _content_index.is_fresh():
+            _content_index = ContentTreeIndex(ROOT_DIR)
+        return _content_index
+
+def invalidate_content_index():
+    """Força nova leitura na próxima consulta (ex.: depois de criar pastas)."""
+    global _content_index
+    with _content_index_lock:
+        _content_index = None
+
+def _chapter_sort_key(name: str):
+    m = re.match(r"^(\d+)", name)
+    return (int(m.group(1)) if m else float("inf"), name.lower())
+
 def list_simulados():
     """
     Lista todos os simulados válidos:
@@ -61,45 +326,19 @@ def list_simulados():
     - Diretórios em conteudo/ que não sejam logs, etc.
     - Mostra diretórios mesmo se estiverem vazios, para permitir novos simulados.
     """
-    sims = set()
-    excl = {"__pycache__", "venv", "env", "nenv", LOGS_FOLDER_NAME, "conteudo", "logs"}
-    # raiz
-    for d in os.listdir(ROOT_DIR):
-        full = os.path.join(ROOT_DIR, d)
-        if not os.path.isdir(full):
-            continue
-        if d.startswith(".") or d in excl:
-            continue
-        sims.add(d)
-    # conteudo/
-    conteudo_dir = os.path.join(ROOT_DIR, "conteudo")
-    if os.path.isdir(conteudo_dir):
-        for d in os.listdir(conteudo_dir):
-            full = os.path.join(conteudo_dir, d)
-            if not os.path.isdir(full) or d in excl:
-                continue
-            sims.add(d)
+    idx = content_index()
+    sims = {d for d in idx.root_dirs if not d.startswith(".") and d not in SIMULADO_EXCLUDED}
+    sims |= {d for d in idx.conteudo_dirs if d not in SIMULADO_EXCLUDED}
     return sorted(sims, key=str.lower)
 
 def resolve_simulado_root(simulado_name: str) -> str:
     """Raiz do simulado (novo: ./simulado; antigo: ./conteudo/simulado)."""
-    cand1 = os.path.join(ROOT_DIR, simulado_name)                 # novo
-    cand2 = os.path.join(ROOT_DIR, "conteudo", simulado_name)     # antigo
-    if os.path.isdir(cand1):
-        return cand1
-    if os.path.isdir(cand2):
-        return cand2
-    return cand1  # fallback
-
-def resolve_simulado_root(simulado_name: str) -> str:
-    """Raiz do simulado (novo: ./simulado; antigo: ./conteudo/simulado)."""
-    cand1 = os.path.join(ROOT_DIR, simulado_name)                 # novo
-    cand2 = os.path.join(ROOT_DIR, "conteudo", simulado_name)     # antigo
-    if os.path.isdir(cand1):
-        return cand1
-    if os.path.isdir(cand2):
-        return cand2
-    return cand1  # fallback
+    idx = content_index()
+    if simulado_name in idx.root_dirs:
+        return os.path.join(ROOT_DIR, simulado_name)             # novo
+    if simulado_name in idx.conteudo_dirs:
+        return os.path.join(ROOT_DIR, "conteudo", simulado_name)  # antigo
+    return os.path.join(ROOT_DIR, simulado_name)  # fallback
 
 def resolve_chapter_base(simulado_name: str) -> str:
     """
@@ -107,15 +346,10 @@ def resolve_chapter_base(simulado_name: str) -> str:
     1. ./conteudo/<simulado>/ (layout antigo)
     2. ./<simulado>/ (layout novo)
     """
-    # layout antigo
-    old_base = os.path.join(ROOT_DIR, "conteudo", simulado_name)
-    if os.path.isdir(old_base):
-        return old_base
-    # layout novo
-    new_base = os.path.join(ROOT_DIR, simulado_name)
-    if os.path.isdir(new_base):
-        return new_base
-    return new_base  # fallback
+    idx = content_index()
+    if simulado_name in idx.conteudo_dirs:
+        return os.path.join(ROOT_DIR, "conteudo", simulado_name)
+    return os.path.join(ROOT_DIR, simulado_name)
 
 def ensure_simulado_structure_for(simulado_name: str):
     """Cria logs/ e results.csv no lugar correto do simulado."""
@@ -128,8 +362,13 @@ def ensure_simulado_structure_for(simulado_name: str):
 
 
 
+_ensured_dirs = set()
+
 def ensure_simulado_structure(simulado_dir: str):
-    """Garante logs/ e results.csv dentro do simulado selecionado."""
+    """Garante logs/ e results.csv dentro do simulado selecionado (verifica uma vez por sessão)."""
+    if simulado_dir in _ensured_dirs:
+        return
+    _ensured_dirs.add(simulado_dir)
     os.makedirs(os.path.join(simulado_dir, LOGS_FOLDER_NAME), exist_ok=True)
     results_csv = os.path.join(simulado_dir, RESULTS_FILENAME)
     if not os.path.exists(results_csv):
@@ -142,22 +381,7 @@ def get_chapters(simulado_name: str):
     Retorna lista de capítulos (diretórios cujo nome começa com dígito) do simulado.
     Considera tanto diretórios na raiz do simulado quanto em simulado/conteudo/.
     """
-    base = resolve_chapter_base(simulado_name)
-    try:
-        dirs = [
-            d for d in os.listdir(base)
-            if os.path.isdir(os.path.join(base, d))
-            and d != LOGS_FOLDER_NAME
-            and is_chapter_dir(d)
-        ]
-        def keyfn(x):
-            m = re.match(r"^(\d+)", x)
-            return (int(m.group(1)) if m else float("inf"), x.lower())
-        return sorted(dirs, key=keyfn)
-    except Exception:
-        return []
-
-
+    return list(content_index().chapters.get(resolve_chapter_base(simulado_name), []))
 
 def read_file(path: str):
     try:
@@ -166,62 +390,169 @@ def read_file(path: str):
     except FileNotFoundError:
         return None
 
-def get_md_content(simulado_name: str, chapter_name: str, file_name: str):
-    return read_file(os.path.join(ROOT_DIR, simulado_name, chapter_name, file_name))
-
-def get_md_content(simulado_name: str, chapter_name: str, file_name: str):
-    file_path = os.path.join(resolve_chapter_base(simulado_name), chapter_name, file_name)
-    try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            return f.read()
-    except FileNotFoundError:
-        return None
-    
+@timed("leitura_conteudo")
 def get_md_content(simulado_name: str, chapter_name: str, file_name: str):
     """Use sempre a base resolvida (não o ROOT direto)."""
-    file_path = os.path.join(resolve_chapter_base(simulado_name), chapter_name, file_name)
-    try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            return f.read()
-    except FileNotFoundError:
-        return None
-    
-def get_all_md_content_from_chapter(simulado_name: str, chapter_name: str):
-    all_content = []
+    return read_file(os.path.join(resolve_chapter_base(simulado_name), chapter_name, file_name))
+
+CHAPTER_FILE_SEPARATOR = "\n\n---\n\n"
+
+def join_md_files(parts):
+    """[(arquivo, conteúdo)] -> (conteúdo unido, [(offset, arquivo)]) para saber de que arquivo veio cada trecho."""
+    sources, pos = [], 0
+    for name, text in parts:
+        sources.append((pos, name))
+        pos += len(text) + len(CHAPTER_FILE_SEPARATOR)
+    return CHAPTER_FILE_SEPARATOR.join(text for _, text in parts), sources
+
+@timed("leitura_conteudo")
+def chapter_content_with_sources(simulado_name: str, chapter_name: str):
+    chapter_path = os.path.join(resolve_chapter_base(simulado_name), chapter_name)
+    parts = []
     for f in get_md_files(simulado_name, chapter_name):
-        c = get_md_content(simulado_name, chapter_name, f)
+        c = read_file(os.path.join(chapter_path, f))
         if c:
-            all_content.append(c)
-    return "\n\n---\n\n".join(all_content)
+            parts.append((f, c))
+    return join_md_files(parts)
 
 def get_all_md_content_from_chapter(simulado_name: str, chapter_name: str):
-    all_content = []
-    for f in get_md_files(simulado_name, chapter_name):
-        c = get_md_content(simulado_name, chapter_name, f)
-        if c:
-            all_content.append(c)
-    return "\n\n---\n\n".join(all_content)
+    return chapter_content_with_sources(simulado_name, chapter_name)[0]
 
 def get_md_files(simulado_name: str, chapter_name: str):
     """Retorna lista de arquivos .md no capítulo (ordenada)."""
-    base = resolve_chapter_base(simulado_name)
-    chapter_path = os.path.join(base, chapter_name)
+    chapter_path = os.path.join(resolve_chapter_base(simulado_name), chapter_name)
+    return list(content_index().md_files.get(chapter_path, []))
+
+# -------------------------- CACHE DE PERGUNTAS --------------------------
+def question_cache_key(content: str, num_questions: int, model: str = DEEPSEEK_MODEL,
+                       prompt_version: int = PROMPT_VERSION) -> str:
+    """Hash do (conteúdo, nº de perguntas, modelo, versão do prompt)."""
+    h = hashlib.sha256()
+    for part in (str(prompt_version), model, str(num_questions), content):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+def _cache_path(key: str) -> str:
+    return os.path.join(QUESTION_CACHE_DIR, f"{key}.json")
+
+@timed("cache_leitura")
+def load_cached_questions(key: str):
+    """Retorna as perguntas salvas para a chave, ou None (ausente/expirado/corrompido)."""
+    path = _cache_path(key)
+    try:
+        if time.time() - os.path.getmtime(path) > CACHE_MAX_AGE_DAYS * 86400:
+            os.remove(path)
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            questions = json.load(f)
+        os.utime(path)  # marca como usado recentemente (LRU)
+        return questions
+    except (OSError, ValueError):
+        return None
+
+def store_cached_questions(key: str, questions):
+    """Grava atomicamente (tmp + replace) e aplica a política de expiração."""
+    try:
+        os.makedirs(QUESTION_CACHE_DIR, exist_ok=True)
+        tmp = _cache_path(key) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(questions, f, ensure_ascii=False)
+        os.replace(tmp, _cache_path(key))
+        evict_question_cache()
+    except OSError as e:
+        log.warning(f"não foi possível gravar o cache de perguntas: {e}")
+
+def evict_question_cache(max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES,
+                         max_age_days: float = CACHE_MAX_AGE_DAYS):
+    """Remove entradas vencidas e, depois, as menos usadas até caber nos limites."""
     try:
-        files = [
-            f for f in os.listdir(chapter_path)
-            if os.path.isfile(os.path.join(chapter_path, f)) and f.lower().endswith('.md')
-        ]
-        return sorted(files, key=lambda x: x.lower())
+        entries = []
+        with os.scandir(QUESTION_CACHE_DIR) as it:
+            for e in it:
+                if e.is_file() and e.name.endswith(".json"):
+                    st = e.stat()
+                    entries.append((st.st_mtime, st.st_size, e.path))
     except FileNotFoundError:
-        return []
+        return
+    now = time.time()
+    entries.sort()  # mais antigos primeiro
+    total = sum(size for _, size, _ in entries)
+    for i, (mtime, size, path) in enumerate(entries):
+        expired = now - mtime > max_age_days * 86400
+        over = (len(entries) - i) > max_entries or total > max_bytes
+        if not (expired or over):
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+# -------------------------- PROMPT (COMPRESSÃO E ORÇAMENTO DE TOKENS) --------------------------
+_MD_NOISE = [
+    (re.compile(r"<!--.*?-->", re.DOTALL), ""),                      # comentários HTML
+    (re.compile(r"!\[[^\]]*\]\([^)]*\)|!\[[^\]]*\]\[[^\]]*\]"), ""),  # imagens
+    (re.compile(r"\[([^\]]+)\]\([^)]*\)"), r"\1"),                    # links: fica só o texto
+    (re.compile(r"^[ \t]*\[[^\]]+\]:[ \t]*\S+.*$", re.MULTILINE), ""),  # definições de links
+    (re.compile(r"<?https?://[^\s>)]+>?"), ""),                       # URLs soltas
+    (re.compile(r"</?[A-Za-z][^>\n]*>"), ""),                         # tags HTML
+    # negrito: só pares que envolvem texto, fora de `código` e sem mexer em identificadores
+    # (`**kwargs`, __init__, x**2 ficam intactos; a 1ª alternativa devolve o trecho de código)
+    (re.compile(r"(`+)[^\n]*?\1|(?<![\w*])\*\*(?=\S)(.+?)(?<=\S)\*\*(?![\w*])"
+                r"|(?<!\w)__(?=[^\s_])(?!\w+__(?!\w))(.+?)(?<=[^\s_])__(?!\w)"),
+     lambda m: m.group(0) if m.group(1) else m.group(2) or m.group(3)),
+    (re.compile(r"^[ \t]*\|?[ \t]*:?-+:?[ \t]*(\|[ \t]*:?-+:?[ \t]*)+\|?[ \t]*\n?", re.MULTILINE), ""),  # |---|---|
+    (re.compile(r"(?<=\S)[ \t]{2,}"), " "),                           # espaços repetidos (não a indentação)
+    (re.compile(r"[ \t]+$", re.MULTILINE), ""),
+]
+_TABLE_ROW = re.compile(r"^[ \t]*\|(.*?)\|?[ \t]*$", re.MULTILINE)
+DEDUP_MIN_CHARS = 40  # blocos menores (títulos, "---", frases soltas) nunca são removidos
+
+def compress_markdown(text: str) -> str:
+    """Tira do Markdown o que só gasta token: imagens, URLs, HTML, ênfase, réguas de tabela."""
+    for pattern, repl in _MD_NOISE:
+        text = pattern.sub(repl, text)
+    text = _TABLE_ROW.sub(lambda m: " | ".join(c.strip() for c in m.group(1).split("|")), text)
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+def dedupe_blocks(text: str) -> str:
+    """
+    Remove parágrafos repetidos (cabeçalhos/rodapés copiados em cada arquivo do
+    capítulo, avisos padrão...), mantendo a primeira ocorrência. Títulos e os
+    separadores '---' ficam: o fatiamento em partes depende deles.
+    """
+    seen, kept = set(), []
+    for block in text.split("\n\n"):
+        key = " ".join(block.split()).lower()
+        if len(key) >= DEDUP_MIN_CHARS and not key.startswith("#"):
+            if key in seen:
+                continue
+            seen.add(key)
+        kept.append(block)
+    return "\n\n".join(kept)
 
-# -------------------------- LLM --------------------------
-def generate_questions_from_api(content: str, num_questions: int = 10):
-    if not client:
-        messagebox.showerror("Erro de API", "O cliente da API não foi inicializado.")
-        return None
+@timed("prompt_compressao")
+def compress_content(content: str) -> str:
+    """Conteúdo enxuto para o prompt (idempotente: pode ser aplicado mais de uma vez)."""
+    return dedupe_blocks(compress_markdown(content))
+
+def output_token_budget(num_questions: int) -> int:
+    """max_tokens proporcional ao nº de perguntas (evita resposta truncada e reserva à toa)."""
+    return min(API_MAX_OUTPUT_TOKENS, OUTPUT_TOKENS_OVERHEAD + num_questions * OUTPUT_TOKENS_PER_QUESTION)
 
-    prompt = f"""
+def estimate_request_tokens(content: str, num_questions: int) -> dict:
+    """Estimativa de tokens de entrada (prompt já comprimido) e do teto de saída de uma chamada."""
+    prompt = sum(estimate_tokens(m["content"]) for m in _api_messages(content, num_questions))
+    return {"entrada": prompt, "saida_max": output_token_budget(num_questions)}
+
+# -------------------------- LLM --------------------------
+def build_prompt(content: str, num_questions: int, avoid=None) -> str:
+    avoid_text = ""
+    if avoid:  # reenvio: pede só as que faltaram, sem repetir as já aceitas
+        listed = "\n".join(f"- {q}" for q in avoid)
+        avoid_text = f"\nNÃO repita nenhuma destas perguntas, que já foram feitas:\n{listed}\n"
+    return f"""
 Você deve responder SOMENTE com um array JSON (sem texto fora do array). O array deve ter exatamente {num_questions} objetos.
 Cada objeto terá as chaves:
 - \"question\": string
@@ -230,67 +561,2128 @@ Cada objeto terá as chaves:
 - \"explanation_cue\": string curta do texto original
 
 NÃO escreva nada antes/depois do array. NÃO use aspas simples.
---- CONTEÚDO PARA ANÁLISE ---
+{avoid_text}--- CONTEÚDO PARA ANÁLISE ---
 {content}
 """
 
+def normalize_question(q, i: int = 0):
+    """Valida e normaliza uma pergunta devolvida pela API (levanta ValueError)."""
+    letter_set = {"A", "B", "C", "D"}
+    if not isinstance(q, dict):
+        raise ValueError(f"Item {i+1}: não é um objeto JSON.")
+    for k in ("question", "options", "answer", "explanation_cue"):
+        if k not in q:
+            raise ValueError(f"Item {i+1}: chave ausente '{k}'.")
+    if not isinstance(q["options"], list) or len(q["options"]) != 4:
+        raise ValueError(f"Item {i+1}: 'options' deve ter 4 itens.")
+    ans = q["answer"]
+    if isinstance(ans, str):
+        ans = [ans]
+    if not isinstance(ans, list) or not all(isinstance(x, str) for x in ans):
+        raise ValueError(f"Item {i+1}: 'answer' deve ser array de letras.")
+    ans = [x.strip().upper() for x in ans]
+    if not all(x in letter_set for x in ans):
+        converted = []
+        for x in ans:
+            if x.isdigit() and int(x) in range(4):
+                converted.append("ABCD"[int(x)])
+            else:
+                try:
+                    idx = q["options"].index(x)
+                    converted.append("ABCD"[idx])
+                except ValueError:
+                    raise ValueError(f"Item {i+1}: valor de answer inválido: {x!r}")
+        ans = converted
+    q["answer"] = sorted(set(ans))
+    return q
+
+def normalize_questions(data):
+    """Valida e normaliza a lista de perguntas devolvida pela API (levanta ValueError)."""
+    return [normalize_question(q, i) for i, q in enumerate(data)]
+
+class JSONArrayStreamParser:
+    """
+    Parser incremental: recebe o texto do array JSON em pedaços (streaming) e
+    devolve cada objeto de nível superior assim que ele fecha. Objetos que não
+    são JSON válido são pulados e contados em `invalid`.
+    """
+    def __init__(self):
+        self.invalid = 0
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._buf = []
+
+    def feed(self, text: str):
+        done = []
+        for ch in text:
+            if not self._started:
+                self._started = ch == "["
+                continue
+            if self._depth == 0:
+                if ch == "{":  # vírgulas, espaços e o ']' final são ignorados
+                    self._depth, self._buf = 1, ["{"]
+                continue
+            self._buf.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        done.append(json.loads("".join(self._buf)))
+                    except json.JSONDecodeError:
+                        self.invalid += 1
+        return done
+
+class RateLimiter:
+    """Token bucket: no máximo rate_per_s chamadas por segundo (rajadas de até burst)."""
+    def __init__(self, rate_per_s: float, burst: int = 1):
+        self.rate = rate_per_s
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+# limites globais das chamadas à API (configurados pelo modo em lote; a GUI não limita)
+_api_slots = None
+_api_rate = None
+_api_max_attempts = API_MAX_ATTEMPTS
+_api_max_rounds = GENERATION_WORKERS * CHUNK_WORKERS  # rodadas simultâneas possíveis sem limite configurado
+
+def configure_api_limits(max_in_flight=None, rate_per_s=None, max_attempts=None):
+    """
+    Limita chamadas simultâneas e por segundo, valendo também para as partes de um capítulo.
+    max_attempts: tentativas por pedido em falhas transitórias (padrão API_MAX_ATTEMPTS).
+    """
+    global _api_slots, _api_rate, _api_max_attempts, _api_max_rounds
+    _api_slots = threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+    _api_rate = RateLimiter(rate_per_s, burst=max_in_flight or 1) if rate_per_s else None
+    _api_max_attempts = max(1, max_attempts) if max_attempts else API_MAX_ATTEMPTS
+    # as rodadas rodam dentro de api_slot: com limite, no máximo max_in_flight de uma vez
+    _api_max_rounds = max_in_flight or GENERATION_WORKERS * CHUNK_WORKERS
+
+@contextmanager
+def api_slot():
+    slots, rate = _api_slots, _api_rate
+    if slots:
+        slots.acquire()
     try:
-        response = client.chat.completions.create(
-            model="deepseek-chat",
-            messages=[
-                {"role": "system", "content": "Você é um gerador de testes. Saída EXCLUSIVAMENTE em JSON válido (array)."},
-                {"role": "user", "content": prompt},
-            ],
-            temperature=0,
-            max_tokens=2048,
-        )
-        raw = (response.choices[0].message.content or "").strip()
-
-        # extrai o primeiro array
-        m = re.search(r"\[.*\]", raw, re.DOTALL)
-        if not m:
-            raise ValueError("Não foi possível localizar um array JSON na resposta da API.")
-        data = json.loads(m.group(0))
-
-        # normalização mínima
-        letter_set = {"A", "B", "C", "D"}
-        norm = []
-        for i, q in enumerate(data):
-            for k in ("question", "options", "answer", "explanation_cue"):
-                if k not in q:
-                    raise ValueError(f"Item {i+1}: chave ausente '{k}'.")
-            if not isinstance(q["options"], list) or len(q["options"]) != 4:
-                raise ValueError(f"Item {i+1}: 'options' deve ter 4 itens.")
-            ans = q["answer"]
-            if isinstance(ans, str):
-                ans = [ans]
-            if not isinstance(ans, list) or not all(isinstance(x, str) for x in ans):
-                raise ValueError(f"Item {i+1}: 'answer' deve ser array de letras.")
-            ans = [x.strip().upper() for x in ans]
-            if not all(x in letter_set for x in ans):
-                converted = []
-                for x in ans:
-                    if x.isdigit() and int(x) in range(4):
-                        converted.append("ABCD"[int(x)])
-                    else:
-                        try:
-                            idx = q["options"].index(x)
-                            converted.append("ABCD"[idx])
-                        except ValueError:
-                            raise ValueError(f"Item {i+1}: valor de answer inválido: {x!r}")
-                ans = converted
-            q["answer"] = sorted(set(ans))
-            norm.append(q)
-        return norm
+        if rate:
+            rate.acquire()
+        yield
+    finally:
+        if slots:
+            slots.release()
+
+def backoff_delay(attempt: int, base_delay: float = API_BACKOFF_BASE_S, max_delay: float = API_BACKOFF_MAX_S) -> float:
+    """Espera antes da tentativa seguinte: exponencial com "full jitter" (evita rajadas sincronizadas)."""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+# -------------------------- PROVEDORES (ROTEAMENTO E HEDGE) --------------------------
+# O provedor principal vem de DEEPSEEK_API_KEY/DEEPSEEK_BASE_URL/DEEPSEEK_MODEL; um reserva
+# opcional (qualquer endpoint compatível com a OpenAI), de FALLBACK_API_KEY/FALLBACK_BASE_URL/
+# FALLBACK_MODEL. Cada rodada começa no provedor preferido (o principal, a menos que esteja
+# falhando muito). Se a primeira pergunta válida não chegar dentro do p95 recente dele (ou se
+# ele falhar antes), a mesma rodada vai também para o outro: a primeira pergunta válida decide
+# o vencedor e o stream do perdedor é fechado. Como o hedge só dispara na cauda (~5% das
+# rodadas), o custo médio quase não muda. As medições ficam em .cache/provedores.json.
+class ProviderStats:
+    """Latências até a primeira pergunta válida e resultados recentes de um provedor."""
+    def __init__(self):
+        self.latencies = deque(maxlen=PROVIDER_STATS_WINDOW)
+        self.outcomes = deque(maxlen=PROVIDER_HEALTH_WINDOW)  # True = respondeu, False = erro
+        self.counts = {"chamadas": 0, "vitorias": 0, "erros": 0, "hedges": 0, "canceladas": 0}
+        self._lock = threading.Lock()
+
+    def record(self, event: str, latency=None, ok=None):
+        with self._lock:
+            self.counts[event] = self.counts.get(event, 0) + 1
+            if latency is not None:
+                self.latencies.append(round(latency, 4))
+            if ok is not None:
+                self.outcomes.append(ok)
+
+    def percentile(self, p: float):
+        with self._lock:
+            values = sorted(self.latencies)
+        if len(values) < HEDGE_MIN_SAMPLES:
+            return None
+        return values[min(len(values) - 1, int(p * len(values)))]
+
+    def error_rate(self):
+        with self._lock:
+            outcomes = list(self.outcomes)
+        return outcomes.count(False) / len(outcomes) if len(outcomes) >= HEDGE_MIN_SAMPLES // 2 else 0.0
+
+    def to_json(self):
+        with self._lock:
+            return {"latencias": list(self.latencies), "resultados": list(self.outcomes), "contagens": dict(self.counts)}
+
+    def load_json(self, data):
+        with self._lock:
+            self.latencies.extend(data.get("latencias", []))
+            self.outcomes.extend(bool(v) for v in data.get("resultados", []))
+            self.counts.update(data.get("contagens", {}))
+
+class Provider:
+    """Um endpoint compatível com a OpenAI (chave, URL e modelo), com cliente próprio."""
+    def __init__(self, name: str, api_key: str, base_url: str, model: str):
+        self.name, self.api_key, self.base_url, self.model = name, api_key, base_url, model
+        self.stats = ProviderStats()
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def key(self) -> str:
+        return f"{self.base_url}|{self.model}"
+
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                from openai import OpenAI
+                # um cliente por provedor: o pool HTTP dele reaproveita as conexões;
+                # as novas tentativas ficam por nossa conta (_request_questions), não do SDK
+                self._client = OpenAI(api_key=self.api_key, base_url=self.base_url,
+                                      timeout=API_TIMEOUT_S, max_retries=0)
+            return self._client
+
+class ProviderRouter:
+    """Ordem de tentativa e atraso do hedge a partir das medições de cada provedor."""
+    def __init__(self, providers):
+        self.providers = providers
+        self.path = os.path.join(ROOT_DIR, ".cache", PROVIDER_STATS_FILENAME)
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            saved = {}
+        for p in providers:
+            p.stats.load_json(saved.get(p.key, {}))
+
+    def ordered(self):
+        """O principal primeiro, a menos que a taxa de erro recente dele passe do limite."""
+        healthy = [p for p in self.providers if p.stats.error_rate() < PROVIDER_UNHEALTHY_ERROR_RATE]
+        return healthy + [p for p in self.providers if p not in healthy]
+
+    def hedge_delay(self, provider: Provider) -> float:
+        p95 = provider.stats.percentile(0.95)
+        if p95 is None:
+            return HEDGE_DEFAULT_DELAY_S
+        return min(HEDGE_MAX_DELAY_S, max(HEDGE_MIN_DELAY_S, p95))
+
+    def summary(self):
+        rows = []
+        for p in self.providers:
+            rows.append({"provedor": p.name, "url": p.base_url, "modelo": p.model, **p.stats.counts,
+                         "p50_s": p.stats.percentile(0.5), "p95_s": p.stats.percentile(0.95),
+                         "taxa_erro": round(p.stats.error_rate(), 3), "hedge_apos_s": round(self.hedge_delay(p), 3)})
+        return rows
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({p.key: p.stats.to_json() for p in self.providers}, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            log.warning(f"não foi possível salvar as medições dos provedores: {e}")
+
+_router = None
+_router_lock = threading.Lock()
+
+def provider_router():
+    """Roteador montado do ambiente/.env no primeiro uso; None se não houver DEEPSEEK_API_KEY."""
+    global _router
+    with _router_lock:
+        if _router is None and os.getenv("DEEPSEEK_API_KEY"):
+            providers = [Provider("principal", os.getenv("DEEPSEEK_API_KEY"),
+                                  os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com"), DEEPSEEK_MODEL)]
+            if os.getenv("FALLBACK_API_KEY") and os.getenv("FALLBACK_BASE_URL"):
+                providers.append(Provider("reserva", os.getenv("FALLBACK_API_KEY"), os.getenv("FALLBACK_BASE_URL"),
+                                          os.getenv("FALLBACK_MODEL") or DEEPSEEK_MODEL))
+            _router = ProviderRouter(providers)
+            atexit.register(_router.save)
+        return _router
+
+# as tentativas de uma rodada com hedge rodam aqui; um perdedor ainda esperando os cabeçalhos
+# da resposta só percebe que perdeu quando eles chegam (aí fecha o stream na hora)
+_hedge_pool = (0, None)  # (nº de threads, executor)
+
+def hedge_executor() -> ThreadPoolExecutor:
+    """Duas threads por rodada simultânea possível: uma tentativa nunca espera na fila."""
+    global _hedge_pool
+    workers = 2 * _api_max_rounds
+    with _router_lock:
+        size, pool = _hedge_pool
+        if size < workers:  # limites maiores (configure_api_limits): troca por um pool maior
+            _hedge_pool = (workers, ThreadPoolExecutor(max_workers=workers, thread_name_prefix="provedor"))
+            if pool is not None:
+                pool.shutdown(wait=False)  # as tentativas em andamento terminam normalmente
+        return _hedge_pool[1]
+
+class QuestionGenerationError(RuntimeError):
+    """Falha ao obter/validar perguntas da API (exibida pela GUI na thread do Tk)."""
+
+def _api_messages(content: str, num_questions: int, avoid=None):
+    return [
+        {"role": "system", "content": "Você é um gerador de testes. Saída EXCLUSIVAMENTE em JSON válido (array)."},
+        {"role": "user", "content": build_prompt(content, num_questions, avoid)},
+    ]
+
+def _transient_api_errors():
+    """Erros que valem nova tentativa: rede, tempo limite, 429 e 5xx."""
+    import openai
+    return (openai.APIConnectionError, openai.APITimeoutError,
+            openai.RateLimitError, openai.InternalServerError)
+
+def _provider_call(provider: Provider, request, stream: bool, on_text, stop):
+    """Uma chamada a um provedor; on_text recebe o texto em pedaços. Devolve False se stop() interrompeu."""
+    client = provider.client()
+    if stream:
+        response = client.chat.completions.create(model=provider.model, stream=True, **request)
+        try:
+            for chunk in response:
+                if stop():
+                    return False
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    on_text(delta)
+        finally:
+            response.close()
+    else:
+        response = client.chat.completions.create(model=provider.model, **request)
+        if stop():
+            return False
+        on_text(response.choices[0].message.content or "")
+    return True
+
+def _api_round(content: str, num_questions: int, avoid, accept, stream: bool, cancel_event=None):
+    """
+    Uma rodada pedindo num_questions perguntas. Cada item válido vai para accept(pergunta)
+    assim que é lido (no streaming, antes de a resposta terminar); itens com JSON ou formato
+    inválido são descartados. Com um provedor reserva, a rodada pode virar uma corrida (ver
+    PROVEDORES): só o vencedor entrega perguntas. Devolve quantos itens foram descartados.
+    """
+    with span("prompt_montagem"):
+        request = dict(messages=_api_messages(content, num_questions, avoid),
+                       temperature=0, max_tokens=output_token_budget(num_questions))
+    router = provider_router()
+    order = router.ordered()
+    hedge = order[1] if len(order) > 1 else None
+    stream_calls = stream or hedge is not None  # o perdedor só pode ser cancelado fechando o stream
+    cond = threading.Condition()
+    winner, finished = None, {}  # provedor -> (exceção ou None, itens descartados)
+    started_at = {}              # provedor -> início da tentativa (o atraso do hedge conta daqui, não da fila)
+
+    def cancelled():
+        return cancel_event is not None and cancel_event.is_set()
+
+    def attempt(provider: Provider):
+        nonlocal winner
+        parser, invalid, parse_s, started = JSONArrayStreamParser(), 0, 0.0, time.perf_counter()
+        with cond:
+            started_at[provider] = started
+            cond.notify_all()
+
+        def on_text(text):
+            nonlocal winner, invalid, parse_s
+            t = time.perf_counter()
+            valid = []
+            for obj in parser.feed(text):
+                try:
+                    valid.append(normalize_question(obj, 0))
+                except ValueError as e:
+                    log.warning(f"pergunta ignorada: {e}", extra={"campos": {"provedor": provider.name}})
+                    invalid += 1
+            parse_s += time.perf_counter() - t
+            if not valid:
+                return
+            with cond:
+                if winner is None:  # primeira pergunta válida da rodada: este provedor vence
+                    winner = provider
+                    latency = time.perf_counter() - started
+                    provider.stats.record("vitorias", latency, ok=True)
+                    TIMINGS.add("api_primeira_pergunta", latency, stream=stream, provedor=provider.name)
+                    cond.notify_all()
+            if winner is provider:
+                for q in valid:
+                    accept(q)
+
+        provider.stats.record("chamadas")
+        error = None
+        try:
+            completed = _provider_call(provider, request, stream_calls, on_text,
+                                       lambda: cancelled() or (winner is not None and winner is not provider))
+        except Exception as e:
+            error, completed = e, True
+            provider.stats.record("erros", ok=False)
+        elapsed = time.perf_counter() - started
+        if not completed and winner is not provider:
+            # perdeu a corrida: o tempo até o cancelamento é um limite inferior da latência dele
+            provider.stats.record("canceladas", elapsed if not cancelled() else None)
+        elif error is None and winner is not provider:
+            # resposta inteira sem nenhuma pergunta válida: conta como falha, e o tempo (da
+            # resposta toda) fica fora da janela de latência até a primeira pergunta
+            provider.stats.record("sem_perguntas", ok=False)
+        TIMINGS.add("parse_normalizacao", parse_s, stream=stream, provedor=provider.name)
+        TIMINGS.add(f"provedor_{provider.name}", elapsed, erro=type(error).__name__ if error else None)
+        with cond:
+            finished[provider] = (error, invalid + parser.invalid)
+            cond.notify_all()
+
+    first = order[0]
+    with span("api", stream=stream, perguntas=num_questions):
+        if hedge is None:
+            attempt(first)
+        else:
+            pool, delay = hedge_executor(), router.hedge_delay(first)
+            pool.submit(attempt, first)
+            with cond:
+                # em fatias: ninguém notifica cond quando cancel_event é setado
+                while not (winner is not None or first in finished or cancelled()):
+                    remaining = POLL_INTERVAL_MS / 1000
+                    if first in started_at:
+                        remaining = min(remaining, started_at[first] + delay - time.perf_counter())
+                        if remaining <= 0:
+                            break
+                    cond.wait(remaining)
+                launch = winner is None and not cancelled() and (first not in finished or finished[first][0] is not None)
+            if launch:  # o preferido está lento (ou falhou): a mesma rodada vai também para o outro
+                hedge.stats.record("hedges")
+                pool.submit(attempt, hedge)
+            launched = [first, hedge] if launch else [first]
+            with cond:
+                # cancelado com vencedor: ele para no próximo pedaço; espera para não chamar accept depois
+                while not ((winner is not None and winner in finished) or (cancelled() and winner is None)
+                           or all(p in finished for p in launched)):
+                    cond.wait(POLL_INTERVAL_MS / 1000)
+
+    with cond:
+        results = dict(finished)
+        won = winner
+    if won is not None:
+        error, invalid = results.get(won, (None, 0))
+        if error is not None:  # falhou no meio: o que já foi aceito fica, o resto vem nas próximas rodadas
+            raise error
+        return invalid
+    errors = [results[p][0] for p in order if p in results and results[p][0] is not None]
+    if errors and len(errors) == len(results):
+        transient = _transient_api_errors()
+        raise next((e for e in errors if isinstance(e, transient)), errors[0])
+    return sum(invalid for _, invalid in results.values())
+
+def _request_questions(content: str, num_questions: int, on_question=None, cancel_event=None,
+                       served=None, initial=(), duplicates=()):
+    """
+    Pede as perguntas à API com tempo limite e novas tentativas:
+    - falhas transitórias (rede, timeout, 429, 5xx): espera com backoff exponencial + jitter
+      e tenta de novo, até API_MAX_ATTEMPTS falhas (ou o configurado em configure_api_limits);
+    - resposta com itens inválidos, truncada ou curta: até API_REPAIR_ROUNDS reenvios
+      pedindo só as que faltam (e listando as já aceitas para não repeti-las).
+    As perguntas aceitas numa tentativa que falhou no meio são mantidas.
+    Com served (ServedRun), perguntas já servidas no simulado (ou quase iguais) são
+    descartadas e entram na lista "não repita" do reenvio. initial: perguntas já aceitas.
+    """
+    collected, seen, duplicates = [], set(), list(duplicates)
+
+    def accept(q):
+        key = _question_key(q)
+        if len(collected) >= num_questions or key in seen:
+            return
+        seen.add(key)
+        if served is not None and not served.reserve(q):
+            duplicates.append(q["question"])
+            return
+        collected.append(q)
+        if on_question:
+            on_question(q)
+
+    def cancelled():
+        return cancel_event is not None and cancel_event.is_set()
+
+    for q in initial:
+        seen.add(_question_key(q))
+        collected.append(q)
+        if on_question:
+            on_question(q)
+
+    transient = _transient_api_errors()
+    failures = repairs = 0
+    last_error = None
+    while len(collected) < num_questions and not cancelled():
+        missing = num_questions - len(collected)
+        avoid = [q["question"] for q in collected] + duplicates[-DEDUP_MAX_AVOID:]
+        try:
+            with api_slot():
+                invalid = _api_round(content, missing, avoid, accept, on_question is not None, cancel_event)
+        except transient as e:
+            failures += 1
+            last_error = e
+            if failures >= _api_max_attempts:
+                break
+            delay = backoff_delay(failures)
+            log.warning(f"falha temporária da API ({type(e).__name__}); nova tentativa em {delay:.1f}s",
+                        extra={"campos": {"erro": type(e).__name__, "tentativa": failures, "espera_s": round(delay, 2)}})
+            if cancel_event is not None:
+                cancel_event.wait(delay)
+            else:
+                time.sleep(delay)
+            continue
+        if len(collected) < num_questions and not cancelled():
+            repairs += 1
+            if repairs > API_REPAIR_ROUNDS:
+                break
+            log.warning(f"{num_questions - len(collected)} pergunta(s) faltando ({invalid} inválida(s), "
+                        f"{len(duplicates)} repetida(s)); pedindo de novo só as que faltam",
+                        extra={"campos": {"faltando": num_questions - len(collected), "invalidas": invalid,
+                                          "repetidas": len(duplicates), "reenvio": repairs}})
+
+    if not collected and not cancelled():
+        if last_error is not None:
+            raise QuestionGenerationError(f"A API não respondeu após {failures} tentativa(s): {last_error}") from last_error
+        raise QuestionGenerationError("Nenhuma pergunta válida recebida da API.")
+    return collected
+
+def generate_questions_from_api(content: str, num_questions: int = 10, force_regenerate: bool = False,
+                                on_question=None, cancel_event=None, served=None):
+    """
+    Gera (ou lê do cache) as perguntas. Pode rodar fora da thread do Tk: não abre diálogos.
+    Com on_question, usa streaming e chama on_question(pergunta) para cada item validado.
+    Com served (ServedRun do teste), só pede à API substitutas para as já servidas.
+    """
+    content = compress_content(content)
+    key = question_cache_key(content, num_questions)
+    cached, fresh, duplicates = None, [], []
+    if not force_regenerate:
+        cached = load_cached_questions(key)
+        if cached:
+            if served is not None:
+                fresh = [q for q in cached if served.reserve(q)]
+                duplicates = [q["question"] for q in cached if q not in fresh]
+            if served is None or not duplicates or not get_client():
+                result = cached if served is None or not fresh else fresh
+                if on_question:
+                    for q in result:
+                        on_question(q)
+                return result
+
+    client = get_client()
+    if not client:
+        raise QuestionGenerationError("O cliente da API não foi inicializado.")
+
+    def cached_fallback(error):
+        # todas as do cache já foram respondidas e a API falhou: repetir é melhor que não ter teste
+        log.warning("API indisponível; usando as perguntas do cache (já respondidas)",
+                    extra={"campos": {"erro": str(error), "perguntas": len(cached)}})
+        if on_question:
+            for q in cached:
+                on_question(q)
+        return cached
+
+    try:
+        norm = _request_questions(content, num_questions, on_question, cancel_event, served, fresh, duplicates)
+    except QuestionGenerationError as e:
+        if not cached:
+            raise
+        return cached_fallback(e)
     except Exception as e:
-        messagebox.showerror("Erro de API", f"Ocorreu um erro ao processar a resposta da API: {e}")
+        if not cached:
+            raise QuestionGenerationError(f"Ocorreu um erro ao processar a resposta da API: {e}") from e
+        return cached_fallback(e)
+    if cancel_event is not None and cancel_event.is_set():
+        return norm  # parcial: não vai para o cache
+    if len(norm) == num_questions:
+        store_cached_questions(key, norm)
+    else:  # incompleto: usa agora, mas tenta completar na próxima vez
+        log.warning(f"a API devolveu {len(norm)} de {num_questions} perguntas válidas",
+                    extra={"campos": {"validas": len(norm), "pedidas": num_questions}})
+    return norm
+
+# -------------------------- CAPÍTULO EM PARTES (MAP-REDUCE) --------------------------
+def estimate_tokens(text: str) -> int:
+    """Estimativa grosseira (~4 caracteres por token)."""
+    return len(text) // 4 + 1
+
+def _pack(pieces, max_tokens: float, sep: str):
+    """Junta pedaços consecutivos em blocos de até max_tokens (um pedaço maior fica sozinho)."""
+    blocks, current, size = [], [], 0
+    for piece in pieces:
+        t = estimate_tokens(piece)
+        if current and size + t > max_tokens:
+            blocks.append(sep.join(current))
+            current, size = [], 0
+        current.append(piece)
+        size += t
+    if current:
+        blocks.append(sep.join(current))
+    return blocks
+
+def _split_sections(content: str, max_tokens: float = CHUNK_MAX_TOKENS):
+    """
+    Quebra nos separadores '---' e nos títulos Markdown, mantendo-os no início de cada seção.
+    Seções maiores que max_tokens caem para parágrafos, e parágrafos grandes (transcrições
+    sem linha em branco), para linhas, reagrupados até max_tokens.
+    """
+    parts = re.split(r"\n(?=-{3,}[ \t]*\n)|\n(?=#{1,6}\s)", content)
+    sections = []
+    for part in parts:
+        if estimate_tokens(part) <= max_tokens:
+            sections.append(part)
+            continue
+        pieces = []
+        for para in (p for p in part.split("\n\n") if p.strip()):
+            if estimate_tokens(para) <= max_tokens:
+                pieces.append(para)
+            else:
+                pieces.extend(_pack([line for line in para.split("\n") if line.strip()], max_tokens, "\n"))
+        sections.extend(_pack(pieces, max_tokens, "\n\n"))
+    return [sec for sec in sections if sec.strip()]
+
+def split_content_into_chunks(content: str, num_questions: int):
+    """
+    Divide o conteúdo em partes de tamanho parecido, respeitando CHUNK_MAX_TOKENS
+    e MAX_QUESTIONS_PER_CALL (para a resposta JSON não ser truncada): nenhuma parte
+    passa do tamanho cuja fatia proporcional das perguntas excederia o limite, e
+    seções maiores que isso são quebradas nos parágrafos.
+    """
+    total = max(1, sum(estimate_tokens(sec) for sec in _split_sections(content)))
+    max_size = min(CHUNK_MAX_TOKENS, MAX_QUESTIONS_PER_CALL * total / max(1, num_questions))
+    sections = _split_sections(content, max_size)
+    n_chunks = max(-(-total // CHUNK_MAX_TOKENS), -(-num_questions // MAX_QUESTIONS_PER_CALL), 1)
+    n_chunks = min(n_chunks, len(sections)) or 1
+    target = total / n_chunks
+
+    chunks, current, size = [], [], 0
+    for sec in sections:
+        t = estimate_tokens(sec)
+        if current and (size + t > max_size or (size + t / 2 > target and len(chunks) < n_chunks - 1)):
+            chunks.append("\n".join(current))
+            current, size = [], 0
+        current.append(sec)
+        size += t
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+def distribute_questions(num_questions: int, chunks):
+    """
+    Reparte as perguntas proporcionalmente ao tamanho de cada parte (maiores restos),
+    no máximo MAX_QUESTIONS_PER_CALL por parte: o excedente vai para as partes com
+    folga. Só passa do limite se as partes não comportarem todas as perguntas.
+    """
+    weights = [estimate_tokens(c) for c in chunks]
+    total = sum(weights)
+    shares = [num_questions * w / total for w in weights]
+    counts = [int(x) for x in shares]
+    by_remainder = sorted(range(len(chunks)), key=lambda i: shares[i] - counts[i], reverse=True)
+    for i in by_remainder[:num_questions - sum(counts)]:
+        counts[i] += 1
+    if len(chunks) * MAX_QUESTIONS_PER_CALL >= num_questions:
+        overflow = sum(max(0, c - MAX_QUESTIONS_PER_CALL) for c in counts)
+        counts = [min(c, MAX_QUESTIONS_PER_CALL) for c in counts]
+        for _ in range(overflow):  # a parte mais "devedora" (fatia - perguntas) entre as que têm folga
+            i = max((i for i in range(len(chunks)) if counts[i] < MAX_QUESTIONS_PER_CALL),
+                    key=lambda i: shares[i] - counts[i])
+            counts[i] += 1
+    return counts
+
+def _question_key(q) -> str:
+    return re.sub(r"\W+", " ", q["question"].lower()).strip()
+
+def merge_questions(batches):
+    """Junta os lotes na ordem do capítulo, descartando perguntas repetidas."""
+    seen, merged = set(), []
+    for batch in batches:
+        for q in batch:
+            key = _question_key(q)
+            if key not in seen:
+                seen.add(key)
+                merged.append(q)
+    return merged
+
+def generate_questions_chunked(content: str, num_questions: int = 10, force_regenerate: bool = False,
+                               on_question=None, cancel_event=None, served=None):
+    """
+    Map-reduce para capítulos inteiros: cada parte vira uma chamada à API (em paralelo,
+    limitado a CHUNK_WORKERS) e os resultados são unidos e deduplicados.
+    Com on_question, as partes usam streaming e as perguntas repetidas não são repassadas.
+    """
+    chunks = split_content_into_chunks(compress_content(content), num_questions)
+    jobs = [(c, n) for c, n in zip(chunks, distribute_questions(num_questions, chunks)) if n > 0]
+    if len(jobs) == 1:
+        return generate_questions_from_api(jobs[0][0], jobs[0][1], force_regenerate, on_question, cancel_event, served)
+
+    if on_question:
+        lock, seen, deliver = threading.Lock(), set(), on_question
+        def on_question(q):
+            with lock:
+                key = _question_key(q)
+                if key in seen:
+                    return
+                seen.add(key)
+            deliver(q)
+
+    def run(chunk, n):
+        if cancel_event is not None and cancel_event.is_set():
+            return []
+        return generate_questions_from_api(chunk, n, force_regenerate, on_question, cancel_event, served)
+
+    batches, errors = [], []
+    with ThreadPoolExecutor(max_workers=CHUNK_WORKERS, thread_name_prefix="parte") as pool:
+        futures = [pool.submit(run, c, n) for c, n in jobs]
+        for f in futures:  # mantém a ordem das partes
+            try:
+                batches.append(f.result())
+            except QuestionGenerationError as e:
+                errors.append(e)
+    if errors and not any(batches):
+        raise errors[0]
+    return merge_questions(batches)
+
+# -------------------------- JUSTIFICATIVAS (ÍNDICE DE PARÁGRAFOS) --------------------------
+def normalize_text(text: str) -> str:
+    """Minúsculas, sem acentos, pontuação vira espaço (comparação tolerante)."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(re.findall(r"\w+", text))
+
+def tokenize(text: str):
+    return [t for t in normalize_text(text).split() if len(t) > 1]
+
+class ParagraphIndex:
+    """
+    Índice dos parágrafos de um texto, montado uma vez por teste: offsets, texto
+    normalizado e índice invertido token -> parágrafos. A busca só olha os
+    parágrafos que compartilham tokens com a pista, qualquer que seja o tamanho do texto.
+    """
+    @timed("indice_paragrafos")
+    def __init__(self, full_text: str, sources=None):
+        self.text = full_text
+        self.sources = sources or []  # [(offset, arquivo .md)] quando o texto junta vários arquivos
+        self.spans = []        # (início, fim) de cada parágrafo em full_text
+        self.normalized = []
+        self.postings = defaultdict(set)
+        pos = 0
+        for m in re.finditer(r"\n[ \t]*\n", full_text):
+            self._add(pos, m.start())
+            pos = m.end()
+        self._add(pos, len(full_text))
+
+    def _add(self, start: int, end: int):
+        norm = normalize_text(self.text[start:end])
+        if not norm:
+            return
+        pid = len(self.spans)
+        self.spans.append((start, end))
+        self.normalized.append(norm)
+        for tok in set(norm.split()):
+            if len(tok) > 1:
+                self.postings[tok].add(pid)
+
+    def paragraph(self, pid: int) -> str:
+        start, end = self.spans[pid]
+        return self.text[start:end].strip()
+
+    def _idf(self, tok: str) -> float:
+        return math.log(1 + len(self.spans) / len(self.postings[tok]))
+
+    def rank(self, cue: str, k: int = 3):
+        """[(pontuação, id)] dos k parágrafos mais parecidos com a pista."""
+        tokens = set(tokenize(cue))
+        known = [t for t in tokens if t in self.postings]
+        if not known:
+            return []
+        weight = {t: self._idf(t) for t in known}
+        total = sum(weight.values()) + sum(math.log(1 + len(self.spans)) for t in tokens if t not in self.postings)
+        scores = defaultdict(float)
+        for t in known:
+            for pid in self.postings[t]:
+                scores[pid] += weight[t]
+        norm_cue = normalize_text(cue)
+        ranked = []
+        for pid, score in scores.items():
+            coverage = score / total
+            if norm_cue in self.normalized[pid]:
+                coverage += 1.0  # trecho literal (ignorando acentos/pontuação) vence
+            ranked.append((coverage, pid))
+        return heapq.nlargest(k, ranked)
+
+    def locate(self, cue: str, min_coverage: float = EXPLANATION_MIN_COVERAGE):
+        """Id do parágrafo que melhor contém a pista, ou None."""
+        best = self.rank(cue, 1)
+        if best and best[0][0] >= min_coverage:
+            return best[0][1]
+        return None
+
+    def lookup(self, cue: str, min_coverage: float = EXPLANATION_MIN_COVERAGE):
+        pid = self.locate(cue, min_coverage)
+        return self.paragraph(pid) if pid is not None else None
+
+    def source_of(self, cue: str):
+        """Arquivo .md de onde vem o trecho da pista (None sem sources ou sem trecho)."""
+        pid = self.locate(cue or "")
+        if pid is None or not self.sources:
+            return None
+        i = bisect.bisect_right([offset for offset, _ in self.sources], self.spans[pid][0]) - 1
+        return self.sources[i][1] if i >= 0 else None
+
+@timed("justificativa")
+def find_explanation_in_text(full_text, cue, index=None):
+    """Parágrafo que melhor contém a pista; passe o ParagraphIndex do teste para não reindexar."""
+    if index is None:
+        index = ParagraphIndex(full_text)
+    return index.lookup(cue or "") or "Contexto não encontrado no texto original."
+
+# -------------------------- BANCO DE PERGUNTAS (OFFLINE) --------------------------
+_bank_memo = {}  # caminho -> (mtime, banco) para amostrar sem reler o arquivo
+
+def question_bank_path(simulado_name: str) -> str:
+    """O banco fica ao lado do results.csv do simulado."""
+    return os.path.join(ROOT_DIR, simulado_name, QUESTION_BANK_FILENAME)
+
+def load_question_bank(simulado_name: str):
+    """{"version": 1, "files": {"<capítulo>/<arquivo.md>": {"questions": [...]}}}"""
+    path = question_bank_path(simulado_name)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {"version": 1, "files": {}}
+    memo = _bank_memo.get(path)
+    if memo and memo[0] == mtime:
+        return memo[1]
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            bank = json.load(f)
+    except (OSError, ValueError) as e:
+        log.warning(f"banco de perguntas ilegível ({path}): {e}")
+        return {"version": 1, "files": {}}
+    _bank_memo[path] = (mtime, bank)
+    return bank
+
+def save_question_bank(simulado_name: str, bank):
+    path = question_bank_path(simulado_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        json.dump(bank, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, path)
+    _bank_memo.pop(path, None)
+
+def bank_key(chapter_name: str, file_name: str) -> str:
+    return f"{chapter_name}/{file_name}"
+
+def file_signature(path: str):
+    """(mtime, tamanho) — barato; o hash só é calculado quando a assinatura muda."""
+    st = os.stat(path)
+    return st.st_mtime, st.st_size
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def build_question_bank(simulado_name: str, per_file: int = BANK_QUESTIONS_PER_FILE,
+                        force_regenerate: bool = False, report=None):
+    """
+    Atualiza o banco de forma incremental. Cada entrada guarda um manifesto do arquivo
+    (caminho, mtime, tamanho, sha256): só arquivos novos ou com conteúdo alterado
+    são regenerados, e as perguntas de arquivos apagados são descartadas.
+    Com force_regenerate, regenera tudo (ignorando também o cache de perguntas).
+    O banco é salvo após cada arquivo: uma interrupção não perde o que já foi gerado.
+    report recebe o progresso (padrão: log.info); falhas vão para log.error.
+    """
+    report = report or log.info
+    bank = load_question_bank(simulado_name)
+    files = bank["files"]
+    stats = {"novos": 0, "alterados": 0, "inalterados": 0, "removidos": 0, "falhas": 0}
+    base = resolve_chapter_base(simulado_name)
+    seen = set()
+    for chapter in get_chapters(simulado_name):
+        for md_file in get_md_files(simulado_name, chapter):
+            key = bank_key(chapter, md_file)
+            seen.add(key)
+            path = os.path.join(base, chapter, md_file)
+            try:
+                mtime, size = file_signature(path)
+            except OSError:
+                continue
+            entry = files.get(key)
+            if entry and not force_regenerate and (entry.get("mtime"), entry.get("size")) == (mtime, size):
+                stats["inalterados"] += 1
+                continue
+            content = read_file(path)
+            if not content:
+                continue
+            digest = content_hash(content)
+            if entry and not force_regenerate and entry.get("sha256") == digest:
+                entry["mtime"], entry["size"] = mtime, size  # só o mtime mudou (ex.: touch)
+                stats["inalterados"] += 1
+                save_question_bank(simulado_name, bank)
+                continue
+            try:
+                questions = generate_questions_chunked(content, per_file, force_regenerate)
+            except QuestionGenerationError as e:
+                stats["falhas"] += 1
+                log.error(f"[{simulado_name}] ERRO {key}: {e}")
+                continue
+            for q in questions:
+                q["source_file"] = md_file
+            stats["alterados" if entry else "novos"] += 1
+            files[key] = {"path": os.path.relpath(path, ROOT_DIR), "mtime": mtime, "size": size,
+                          "sha256": digest, "questions": questions}
+            save_question_bank(simulado_name, bank)
+            report(f"[{simulado_name}] {key}: {len(questions)} perguntas")
+
+    removed = [k for k in files if k not in seen]
+    for k in removed:
+        del files[k]
+        report(f"[{simulado_name}] removido do banco: {k}")
+    stats["removidos"] = len(removed)
+    if removed:
+        save_question_bank(simulado_name, bank)
+    return stats
+
+def sample_from_bank(simulado_name: str, chapter_name: str, file_name=None, num_questions: int = 10,
+                     adaptive: bool = False):
+    """
+    Sorteia perguntas do banco (capítulo inteiro ou um arquivo), sem chamar a API.
+    No modo adaptativo, as mais erradas (e com revisão vencida) têm mais chance de voltar.
+    """
+    files = load_question_bank(simulado_name)["files"]
+    if file_name:
+        entries = [files.get(bank_key(chapter_name, file_name))]
+    else:
+        prefix = f"{chapter_name}/"
+        entries = [v for k, v in files.items() if k.startswith(prefix)]
+    pool = [q for e in entries if e for q in e["questions"]]
+    if adaptive:
+        idx, now = mastery_index(simulado_name), time.time()
+        picked = weighted_sample(pool, [idx.question_weight(q, now) for q in pool], num_questions)
+        return [dict(q) for q in picked]
+    return [dict(q) for q in random.sample(pool, min(num_questions, len(pool)))]
+
+# -------------------------- MODO ADAPTATIVO (DOMÍNIO E REPETIÇÃO ESPAÇADA) --------------------------
+# O domínio sai do answers.db (ver RESPOSTAS). Relatórios logs/teste_*.txt que ainda não estão no
+# banco (dois formatos: o antigo "Pergunta N: ... Resultado: Correto" e o atual "PN: ... | OK") são
+# importados na primeira consulta; os novos são achados por um scandir da pasta de logs.
+_LOG_HEADER = re.compile(r"^Relatório do Teste - (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\s*$", re.MULTILINE)
+_LOG_BASE = re.compile(r"^Arquivo Base: (.*)$", re.MULTILINE)
+_LOG_OLD_ITEM = re.compile(r"^Pergunta \d+: (.*)\n\s*- Resposta do usuário: (.*)\n\s*- Resposta correta: (.*)\n"
+                           r"\s*- Resultado: (Correto|Incorreto)", re.MULTILINE)
+_LOG_NEW_ITEM = re.compile(r"^P\d+: (.*)\n[ \t]+R: (.*) \| G: (.*) \| (OK|X)[ \t]*$", re.MULTILINE)
+
+def parse_test_log(path: str):
+    """
+    (arquivo base, data/hora, [(pergunta, acertou, marcadas, gabarito), ...]) de um relatório
+    teste_*.txt, ou None. Marcadas e gabarito vêm como o texto da lista gravado no relatório.
+    """
+    text = read_file(path)
+    if not text:
+        return None
+    header, base = _LOG_HEADER.search(text), _LOG_BASE.search(text)
+    if not header or not base:
+        return None
+    items = [(q, r == "Correto", sel, cor) for q, sel, cor, r in _LOG_OLD_ITEM.findall(text)]
+    items += [(q, r == "OK", sel, cor) for q, sel, cor, r in _LOG_NEW_ITEM.findall(text)]
+    return base.group(1).strip(), datetime.strptime(header.group(1), "%Y-%m-%d %H:%M:%S"), items
+
+def weakness(tentativas: int, erros: int, acertos_seguidos: int, ultimo_ts: float, now: float) -> float:
+    """
+    Peso de revisão: taxa de erro suavizada (Laplace; nunca visto = 0,5) vezes o quanto
+    a revisão está "vencida". O intervalo dobra a cada acerto seguido (1, 2, 4... dias).
+    """
+    p_err = (erros + 1) / (tentativas + 2)
+    if not tentativas:
+        return p_err
+    interval = ADAPTIVE_BASE_INTERVAL_DAYS * 86400 * 2 ** min(acertos_seguidos, 16)
+    due = (now - ultimo_ts) / interval
+    return p_err * min(ADAPTIVE_MAX_DUE_FACTOR, max(ADAPTIVE_MIN_DUE_FACTOR, due))
+
+def weighted_sample(items, weights, k: int, rng=random):
+    """
+    k itens sem reposição, com probabilidade proporcional ao peso (Efraimidis-Spirakis):
+    cada item recebe a chave log(u)/peso e ficam as k maiores, via heap em O(n log k).
+    """
+    keyed = ((math.log(1.0 - rng.random()) / max(w, 1e-9), i) for i, w in enumerate(weights))
+    return [items[i] for _, i in heapq.nlargest(k, keyed)]
+
+class MasteryIndex:
+    """
+    Domínio por pergunta (hash) e por arquivo .md de um simulado, lido do answers.db.
+    Só é recalculado quando entram respostas novas (gravadas pelo app ou importadas dos relatórios).
+    """
+    def __init__(self, sim_dir: str):
+        self.sim_dir = sim_dir
+        self.answers = AnswerLog(sim_dir)
+        self.questions = {}  # hash da pergunta -> [tentativas, erros, acertos seguidos, último ts]
+        self.files = {}      # arquivo .md de origem -> [tentativas, erros, acertos seguidos, último ts]
+        self._version = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        with self._lock:
+            self.answers.import_text_logs()
+            version = self.answers.last_id()
+            if version != self._version:
+                self.questions = self._fold(self.answers.history("question_hash"))
+                self.files = self._fold(self.answers.history("source_file"))
+                self._version = version
+        return self
+
+    @staticmethod
+    def _fold(rows):
+        table = {}
+        for key, ok, ts in rows:  # em ordem cronológica por chave
+            row = table.setdefault(key, [0, 0, 0, 0.0])
+            row[0] += 1
+            row[1] += not ok
+            row[2] = row[2] + 1 if ok else 0
+            row[3] = max(row[3], ts)
+        return table
+
+    def question_weight(self, question, now=None) -> float:
+        return weakness(*(self.questions.get(question_hash(question)) or (0, 0, 0, 0.0)), now or time.time())
+
+    def file_weight(self, md_filename: str, now=None) -> float:
+        return weakness(*(self.files.get(md_filename) or (0, 0, 0, 0.0)), now or time.time())
+
+    def weakest(self, table: str = "files", n: int = 10):
+        """Os n itens (arquivos ou perguntas) com maior peso de revisão agora."""
+        now = time.time()
+        rows = getattr(self, table)
+        return heapq.nlargest(n, ((weakness(*row, now), key, row[0], row[1]) for key, row in rows.items()))
+
+_mastery_memo = {}
+_mastery_memo_lock = threading.Lock()
+
+def mastery_index(simulado_name: str) -> MasteryIndex:
+    sim_dir = os.path.join(ROOT_DIR, simulado_name)
+    with _mastery_memo_lock:
+        idx = _mastery_memo.get(sim_dir)
+        if idx is None:
+            idx = _mastery_memo[sim_dir] = MasteryIndex(sim_dir)
+    return idx.refresh()
+
+def adaptive_chapter_content(simulado_name: str, chapter_name: str, num_questions: int):
+    """
+    Conteúdo do teste adaptativo de um capítulo: sorteia arquivos ponderando pela fraqueza
+    até encher o orçamento (CHUNK_MAX_TOKENS por chamada que o nº de perguntas pede).
+    Devolve (conteúdo, [(offset, arquivo)]) com os arquivos escolhidos na ordem do capítulo.
+    """
+    files = get_md_files(simulado_name, chapter_name)
+    if not files:
+        return "", []
+    idx = mastery_index(simulado_name)
+    now = time.time()
+    ranked = weighted_sample(files, [idx.file_weight(f, now) for f in files], len(files))
+    budget = CHUNK_MAX_TOKENS * max(1, -(-num_questions // MAX_QUESTIONS_PER_CALL))
+    chosen, contents, used = set(), {}, 0
+    for f in ranked:
+        c = get_md_content(simulado_name, chapter_name, f)
+        if not c:
+            continue
+        chosen.add(f)
+        contents[f] = c
+        used += estimate_tokens(c)
+        if used >= budget:
+            break
+    return join_md_files([(f, contents[f]) for f in files if f in chosen])
+
+# -------------------------- RESULTADOS (ARMAZENAMENTO BINÁRIO) --------------------------
+# <simulado>/results_store/
+#   arquivos.tsv   "capitulo\tarquivo_md" por linha; o nº da linha é o id do arquivo (só cresce)
+#   AAAA-MM.bin    registros de tamanho fixo, só com append (uma partição por mês)
+#   .migrated      marca que o results.csv antigo já foi importado
+#   aggregates.json  somas por arquivo/capítulo/dia/hora, atualizadas a cada resultado (ver ResultsStore.aggregates)
+RESULTS_RECORD = struct.Struct("<qIHHH")  # data/hora (s desde 1970, hora local), id do arquivo, acertos, erros, total
+
+def extract_chapter(md_filename: str) -> str:
+    """Capítulo do teste: 'Capítulo N' (teste completo) ou o prefixo 'N.' do arquivo."""
+    m = re.search(r"Capítulo\s+(\d+)", md_filename) or re.search(r"(\d+)\.", md_filename)
+    return m.group(1) if m else "N/A"
+
+class ResultsStore:
+    """Resultados tipados de um simulado, com capítulo extraído na escrita e data/hora nativas."""
+    def __init__(self, sim_dir: str):
+        self.sim_dir = sim_dir
+        self.dir = os.path.join(sim_dir, RESULTS_STORE_DIRNAME)
+        self.names_path = os.path.join(self.dir, "arquivos.tsv")
+        self.names, self._ids, self._names_size = [], {}, -1
+
+    def _load_names(self):
+        try:
+            size = os.path.getsize(self.names_path)
+        except OSError:
+            size = 0
+        if size == self._names_size:
+            return
+        self.names, self._ids = [], {}
+        if size:
+            with open(self.names_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    chapter, _, name = line.rstrip("\n").partition("\t")
+                    self._ids[name] = len(self.names)
+                    self.names.append((chapter, name))
+        self._names_size = size
+
+    def file_id(self, md_filename: str) -> int:
+        self._load_names()
+        fid = self._ids.get(md_filename)
+        if fid is None:
+            os.makedirs(self.dir, exist_ok=True)
+            with open(self.names_path, "a", encoding="utf-8") as f:
+                f.write(f"{extract_chapter(md_filename)}\t{md_filename}\n")
+            self._load_names()
+            fid = self._ids[md_filename]
+        return fid
+
+    def append(self, md_filename: str, when: datetime, acertos: int, erros: int, total: int):
+        fid = self.file_id(md_filename)
+        record = RESULTS_RECORD.pack(calendar.timegm(when.timetuple()), fid, acertos, erros, total)
+        aggr = self.aggregates()  # antes do append: a contagem de registros ainda bate
+        with open(os.path.join(self.dir, when.strftime("%Y-%m") + ".bin"), "ab") as f:
+            f.write(record)
+        self._apply(aggr, self.names[fid][0], md_filename, when, acertos, erros, total)
+        self._save_aggregates(aggr)
+
+    def append_many(self, rows):
+        """
+        Acrescenta muitos resultados (md, data/hora, acertos, erros, total) de uma vez: um write
+        por partição e um único recálculo dos agregados no fim (append() regrava os agregados a cada linha).
+        """
+        by_partition = defaultdict(list)
+        for md_filename, when, acertos, erros, total in rows:
+            fid = self.file_id(md_filename)
+            by_partition[f"{when.year:04d}-{when.month:02d}"].append(
+                RESULTS_RECORD.pack(calendar.timegm(when.timetuple()), fid, acertos, erros, total))
+        os.makedirs(self.dir, exist_ok=True)
+        for partition, records in by_partition.items():
+            with open(os.path.join(self.dir, partition + ".bin"), "ab") as f:
+                f.write(b"".join(records))
+        return self.rebuild_aggregates()
+
+    def partitions(self):
+        try:
+            return sorted(os.path.join(self.dir, f) for f in os.listdir(self.dir) if f.endswith(".bin"))
+        except FileNotFoundError:
+            return []
+
+    def iter_records(self, partitions=None):
+        """(datetime, arquivo_md, capitulo, acertos, erros, total) — sem pandas."""
+        self._load_names()
+        for path in partitions or self.partitions():
+            with open(path, "rb") as f:
+                data = f.read()
+            usable = len(data) - len(data) % RESULTS_RECORD.size  # ignora registro incompleto no fim
+            for ts, fid, acertos, erros, total in RESULTS_RECORD.iter_unpack(data[:usable]):
+                chapter, name = self.names[fid]
+                yield datetime(1970, 1, 1) + timedelta(seconds=ts), name, chapter, acertos, erros, total
+
+    # ---- agregados (O(1) por resultado; o dashboard só lê estas tabelas) ----
+    @property
+    def aggregates_path(self) -> str:
+        return os.path.join(self.dir, "aggregates.json")
+
+    def record_count(self) -> int:
+        return sum(os.path.getsize(p) // RESULTS_RECORD.size for p in self.partitions())
+
+    @staticmethod
+    def _empty_aggregates():
+        # por_arquivo/por_capitulo: [acertos, erros, total]; por_dia: [acertos, erros, total, soma_%, n]; por_hora: [soma_%, n]
+        return {"records": 0, "by_file": {}, "by_chapter": {}, "by_day": {}, "by_hour": {}}
+
+    @staticmethod
+    def _apply(aggr, chapter, md_filename, when, acertos, erros, total):
+        aggr["records"] += 1
+        for table, key in (("by_file", md_filename), ("by_chapter", chapter)):
+            row = aggr[table].setdefault(key, [0, 0, 0])
+            row[0] += acertos; row[1] += erros; row[2] += total
+        day = aggr["by_day"].setdefault(when.date().isoformat(), [0, 0, 0, 0.0, 0])
+        day[0] += acertos; day[1] += erros; day[2] += total
+        if total > 0:  # % de acerto do teste entra nas médias por dia/hora
+            pct = acertos / total * 100
+            day[3] += pct; day[4] += 1
+            hour = aggr["by_hour"].setdefault(str(when.hour), [0.0, 0])
+            hour[0] += pct; hour[1] += 1
+
+    def _save_aggregates(self, aggr):
+        os.makedirs(self.dir, exist_ok=True)
+        tmp = self.aggregates_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(aggr, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, self.aggregates_path)
+
+    def rebuild_aggregates(self):
+        """Recalcula os agregados a partir dos registros brutos."""
+        aggr = self._empty_aggregates()
+        for when, name, chapter, acertos, erros, total in self.iter_records():
+            self._apply(aggr, chapter, name, when, acertos, erros, total)
+        self._save_aggregates(aggr)
+        return aggr
+
+    def aggregates(self):
+        """Agregados salvos; refeitos se faltarem ou não baterem com o nº de registros."""
+        try:
+            with open(self.aggregates_path, "r", encoding="utf-8") as f:
+                aggr = json.load(f)
+            if aggr.get("records") == self.record_count():
+                return aggr
+        except (OSError, ValueError):
+            pass
+        return self.rebuild_aggregates()
+
+    def migrate_csv(self):
+        """Importa uma única vez o results.csv existente (linhas inválidas são ignoradas)."""
+        marker = os.path.join(self.dir, ".migrated")
+        if os.path.exists(marker):
+            return 0
+        os.makedirs(self.dir, exist_ok=True)
+        rows = []
+        try:
+            with open(os.path.join(self.sim_dir, RESULTS_FILENAME), "r", newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    try:
+                        when = datetime.fromisoformat(f"{row['data']}T{row['hora']}")  # bem mais rápido que strptime
+                        rows.append((row["arquivo_md"], when, int(row["acertos"]), int(row["erros"]), int(row["total_perguntas"])))
+                    except (KeyError, TypeError, ValueError):
+                        continue
+        except FileNotFoundError:
+            pass
+        count = len(rows)
+        if rows:
+            self.append_many(rows)
+        with open(marker, "w", encoding="utf-8") as f:
+            f.write(f"{datetime.now().isoformat()} {count} linhas importadas de {RESULTS_FILENAME}\n")
+        return count
+
+def open_results_store(sim_dir: str) -> ResultsStore:
+    """Store pronto para leitura: lote interrompido concluído e CSV antigo migrado (sob o lock)."""
+    store = ResultsStore(sim_dir)
+    if (not os.path.exists(os.path.join(store.dir, ".migrated"))
+            or os.path.exists(os.path.join(sim_dir, ".journal.json"))):
+        with simulado_lock(sim_dir):  # outra instância pode estar gravando ou migrando ao mesmo tempo
+            recover_pending_results(sim_dir)
+            store.migrate_csv()
+    return store
+
+# -------------------------- RESPOSTAS (SQLITE) --------------------------
+# <simulado>/answers.db: uma linha por resposta, para consultas por pergunta/arquivo/capítulo
+# sem varrer os relatórios de texto. WAL: leituras (dashboard, modo adaptativo) não esperam a
+# gravação. Cada teste entra numa transação, marcado em tests pelo nome do relatório: regravar
+# (recuperação do journal) ou importar o mesmo relatório de novo não duplica nada.
+ANSWERS_DB_FILENAME = "answers.db"
+_ANSWERS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS questions (
+    hash TEXT PRIMARY KEY,
+    text TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tests (
+    log_name TEXT PRIMARY KEY,
+    md_filename TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    imported INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS answers (
+    id INTEGER PRIMARY KEY,
+    log_name TEXT NOT NULL REFERENCES tests(log_name),
+    question_hash TEXT NOT NULL REFERENCES questions(hash),
+    source_file TEXT,
+    chapter TEXT,
+    selected TEXT NOT NULL,
+    correct TEXT NOT NULL,
+    is_correct INTEGER NOT NULL,
+    time_to_answer REAL,
+    ts INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_answers_chapter ON answers(chapter, question_hash, is_correct);
+CREATE INDEX IF NOT EXISTS idx_answers_question ON answers(question_hash, ts);
+CREATE INDEX IF NOT EXISTS idx_answers_file ON answers(source_file, is_correct);
+CREATE TABLE IF NOT EXISTS minhash (
+    hash TEXT PRIMARY KEY REFERENCES questions(hash),
+    signature BLOB
+);
+"""
+
+def question_hash(question) -> str:
+    """Identificador estável da pergunta (texto normalizado): o mesmo enunciado dá o mesmo hash."""
+    text = question["question"] if isinstance(question, dict) else question
+    return hashlib.sha1(_question_key({"question": text}).encode("utf-8")).hexdigest()[:16]
+
+def _as_list(value):
+    """Respostas dos relatórios antigos vêm como repr de lista Python ("['A', 'B']")."""
+    if isinstance(value, list):
+        return value
+    try:
+        parsed = ast.literal_eval(value)
+        return list(parsed) if isinstance(parsed, (list, tuple)) else [str(parsed)]
+    except (ValueError, SyntaxError):
+        return [value]
+
+class AnswerLog:
+    """Respostas de um simulado em SQLite (uma conexão curta por operação: seguro entre threads)."""
+    def __init__(self, sim_dir: str):
+        self.sim_dir = sim_dir
+        self.path = os.path.join(sim_dir, ANSWERS_DB_FILENAME)
+
+    @contextmanager
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_ANSWERS_SCHEMA)
+            with conn:  # transação: commit no fim, rollback em exceção
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _insert_test(conn, log_name, md_filename, chapter, when_ts, answers, imported=False):
+        """Insere um teste e suas respostas; devolve False se o relatório já estava no banco."""
+        cur = conn.execute("INSERT OR IGNORE INTO tests (log_name, md_filename, ts, imported) VALUES (?, ?, ?, ?)",
+                           (log_name, md_filename, int(when_ts), int(imported)))
+        if not cur.rowcount:
+            return False
+        rows = []
+        for ans in answers:
+            h = question_hash(ans["question"])
+            conn.execute("INSERT OR IGNORE INTO questions (hash, text) VALUES (?, ?)", (h, ans["question"]))
+            rows.append((log_name, h, ans.get("source_file"), chapter,
+                         json.dumps(ans["selected"], ensure_ascii=False), json.dumps(ans["correct"], ensure_ascii=False),
+                         int(bool(ans["is_correct"])), ans.get("time_to_answer"), int(ans.get("answered_at") or when_ts)))
+        conn.executemany("""INSERT INTO answers (log_name, question_hash, source_file, chapter, selected, correct,
+                            is_correct, time_to_answer, ts) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""", rows)
+        return True
+
+    def record_tests(self, jobs):
+        """Grava os testes de um lote do ResultsWriter (idempotente)."""
+        with self.connect() as conn:
+            for job in jobs:
+                when = datetime.fromisoformat(job["when"])
+                self._insert_test(conn, os.path.basename(job["indiv_log"]), job["md_filename"],
+                                  job.get("chapter") or extract_chapter(job["md_filename"]), when.timestamp(), job["answers"])
+
+    def recorded_logs(self):
+        with self.connect() as conn:
+            return {name for (name,) in conn.execute("SELECT log_name FROM tests")}
+
+    def import_text_logs(self):
+        """
+        Importa os relatórios logs/teste_*.txt que ainda não estão no banco (sem tempo de
+        resposta, que os relatórios não têm). Devolve quantos testes entraram.
+        """
+        logs_dir = os.path.join(self.sim_dir, LOGS_FOLDER_NAME)
+        try:
+            with os.scandir(logs_dir) as it:
+                names = {e.name for e in it if e.name.startswith("teste_") and e.name.endswith(".txt")}
+        except FileNotFoundError:
+            return 0
+        new = sorted(names - self.recorded_logs())
+        if not new:
+            return 0
+        imported = 0
+        # o lock do simulado garante que não lemos um relatório cujo lote ainda está sendo gravado
+        with simulado_lock(self.sim_dir), self.connect() as conn:
+            for name in new:
+                parsed = parse_test_log(os.path.join(logs_dir, name))
+                if not parsed:
+                    continue
+                base, when, items = parsed
+                source = base if base.lower().endswith(".md") else None
+                answers = [{"question": q, "selected": _as_list(sel), "correct": _as_list(cor),
+                            "is_correct": ok, "source_file": source} for q, ok, sel, cor in items]
+                imported += self._insert_test(conn, name, base, extract_chapter(base), when.timestamp(),
+                                              answers, imported=True)
+        return imported
+
+    def most_missed(self, chapter=None, source_file=None, limit: int = 10):
+        """Perguntas mais erradas (opcionalmente de um capítulo ou arquivo), pelos índices."""
+        where, params = [], []
+        if chapter is not None:
+            where.append("a.chapter = ?"); params.append(str(chapter))
+        if source_file is not None:
+            where.append("a.source_file = ?"); params.append(source_file)
+        sql = f"""
+            SELECT q.text, COUNT(*) AS tentativas, SUM(1 - a.is_correct) AS erros, MAX(a.ts) AS ultima
+            FROM answers a JOIN questions q ON q.hash = a.question_hash
+            {"WHERE " + " AND ".join(where) if where else ""}
+            GROUP BY a.question_hash HAVING erros > 0
+            ORDER BY erros DESC, tentativas ASC, ultima DESC LIMIT ?"""
+        with self.connect() as conn:
+            return [{"pergunta": text, "tentativas": n, "erros": e, "ultima": datetime.fromtimestamp(ts).isoformat()}
+                    for text, n, e, ts in conn.execute(sql, (*params, limit))]
+
+    def history(self, column: str):
+        """(chave, acertou, ts) em ordem cronológica, por pergunta ('question_hash') ou arquivo ('source_file')."""
+        assert column in ("question_hash", "source_file")
+        with self.connect() as conn:
+            return conn.execute(f"SELECT {column}, is_correct, ts FROM answers WHERE {column} IS NOT NULL "
+                                f"ORDER BY {column}, ts, id").fetchall()
+
+    def question_texts(self, hashes):
+        with self.connect() as conn:
+            marks = ",".join("?" * len(hashes))
+            return dict(conn.execute(f"SELECT hash, text FROM questions WHERE hash IN ({marks})", list(hashes)))
+
+    def question_signatures(self, exclude=()):
+        """(hash, assinatura MinHash) das perguntas respondidas; calcula e grava as que faltam."""
+        with self.connect() as conn:
+            rows = conn.execute("SELECT q.hash, q.text, m.signature FROM questions q "
+                                "LEFT JOIN minhash m ON m.hash = q.hash").fetchall()
+            out, missing = [], []
+            for h, text, blob in rows:
+                if h in exclude:
+                    continue
+                if blob is None:
+                    sig = minhash_signature(text)
+                    missing.append((h, _MINHASH_STRUCT.pack(*sig) if sig else b""))
+                else:
+                    sig = _MINHASH_STRUCT.unpack(blob) if blob else None
+                out.append((h, sig))
+            conn.executemany("INSERT OR REPLACE INTO minhash (hash, signature) VALUES (?, ?)", missing)
+        return out
+
+    def last_id(self) -> int:
+        with self.connect() as conn:
+            return conn.execute("SELECT COALESCE(MAX(id), 0) FROM answers").fetchone()[0]
+
+# -------------------------- DEDUPLICAÇÃO (MINHASH) --------------------------
+# Perguntas quase iguais ("Qual é o tamanho máximo de um blob...?" x "Qual o tamanho máximo de
+# um blob...?") têm hashes exatos diferentes. Cada enunciado vira um conjunto de palavras e bigramas
+# (sem acento e sem as palavras de enunciado), resumido numa assinatura MinHash; o LSH
+# por faixas acha os candidatos sem comparar com todas as perguntas já servidas.
+# As assinaturas ficam na tabela minhash do answers.db: só perguntas novas são calculadas.
+_MINHASH_PRIME = (1 << 61) - 1
+_minhash_rng = random.Random(20240611)  # semente fixa: assinaturas gravadas continuam comparáveis
+_MINHASH_PARAMS = [(_minhash_rng.randrange(1, _MINHASH_PRIME), _minhash_rng.randrange(_MINHASH_PRIME))
+                   for _ in range(MINHASH_PERMUTATIONS)]
+_MINHASH_ROWS = MINHASH_PERMUTATIONS // MINHASH_BANDS
+_MINHASH_STRUCT = struct.Struct(f"<{MINHASH_PERMUTATIONS}Q")
+_DEDUP_STOPWORDS = {
+    "qual", "quais", "que", "das", "dos", "de", "do", "da", "um", "uma", "os", "as", "no", "na", "nos", "nas",
+    "em", "para", "com", "por", "ao", "aos", "se", "seguintes", "seguinte", "opcoes", "opcao", "alternativas",
+    "alternativa", "abaixo", "sobre", "texto", "segundo", "acordo", "correta", "corretamente", "melhor",
+}
+
+def question_shingles(text: str):
+    """Palavras significativas do enunciado e seus bigramas (conjunto de hashes de 64 bits)."""
+    words = [w for w in tokenize(text) if w not in _DEDUP_STOPWORDS]
+    grams = words + [" ".join(words[i:i + 2]) for i in range(len(words) - 1)]
+    return {int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=8).digest(), "little") for g in grams}
+
+def minhash_signature(text: str):
+    shingles = question_shingles(text)
+    if not shingles:
         return None
+    return tuple(min((a * x + b) % _MINHASH_PRIME for x in shingles) for a, b in _MINHASH_PARAMS)
+
+def minhash_similarity(sig1, sig2) -> float:
+    """Fração de posições iguais: estimativa do índice de Jaccard entre os dois conjuntos."""
+    return sum(a == b for a, b in zip(sig1, sig2)) / len(sig1)
+
+class SignatureSet:
+    """Hashes exatos e assinaturas MinHash, com busca de quase-duplicatas por LSH (sem lock próprio)."""
+    def __init__(self):
+        self.buckets = defaultdict(list)  # (faixa, valores da faixa) -> assinaturas
+        self.known = set()                # hashes exatos já indexados
+
+    def add(self, h, sig):
+        self.known.add(h)
+        if sig is None:
+            return
+        for band in range(MINHASH_BANDS):
+            self.buckets[(band, sig[band * _MINHASH_ROWS:(band + 1) * _MINHASH_ROWS])].append(sig)
+
+    def contains(self, h, sig) -> bool:
+        if h in self.known:
+            return True
+        if sig is None:
+            return False
+        for band in range(MINHASH_BANDS):
+            for other in self.buckets.get((band, sig[band * _MINHASH_ROWS:(band + 1) * _MINHASH_ROWS]), ()):
+                if minhash_similarity(sig, other) >= DEDUP_SIMILARITY:
+                    return True
+        return False
+
+class ServedIndex:
+    """
+    Perguntas já respondidas num simulado (do answers.db), com busca de quase-duplicatas
+    por LSH. Só o que foi respondido conta como servido: um teste cancelado ou abandonado
+    não gasta as perguntas dele. Seguro entre threads.
+    """
+    def __init__(self, sim_dir: str):
+        self.answers = AnswerLog(sim_dir)
+        self.answered = SignatureSet()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        with self._lock:
+            self.answers.import_text_logs()
+            version = self.answers.last_id()
+            if version != self._version:
+                for h, sig in self.answers.question_signatures(exclude=self.answered.known):
+                    self.answered.add(h, sig)
+                self._version = version
+        return self
+
+    def contains(self, h, sig) -> bool:
+        with self._lock:
+            return self.answered.contains(h, sig)
+
+    def new_run(self) -> "ServedRun":
+        return ServedRun(self)
+
+class ServedRun:
+    """
+    Reservas de uma geração (todas as partes de um teste): as perguntas aceitas valem
+    só para este teste não repetir a si mesmo e somem com ele.
+    """
+    def __init__(self, index: ServedIndex):
+        self.index = index
+        self.reserved = SignatureSet()
+        self._lock = threading.Lock()
+
+    def reserve(self, question) -> bool:
+        """
+        True se a pergunta é nova (e a reserva, para as outras partes do mesmo teste não a
+        repetirem); False se ela, ou uma quase igual, já foi respondida ou reservada.
+        """
+        h = question_hash(question)
+        sig = minhash_signature(question["question"])
+        if self.index.contains(h, sig):
+            return False
+        with self._lock:
+            if self.reserved.contains(h, sig):
+                return False
+            self.reserved.add(h, sig)
+            return True
+
+_served_memo = {}
+_served_memo_lock = threading.Lock()
+
+def served_index(simulado_name: str) -> ServedIndex:
+    sim_dir = os.path.join(ROOT_DIR, simulado_name)
+    with _served_memo_lock:
+        idx = _served_memo.get(sim_dir)
+        if idx is None:
+            idx = _served_memo[sim_dir] = ServedIndex(sim_dir)
+    return idx.refresh()
+
+# -------------------------- BUSCA (ÍNDICE BM25) --------------------------
+# .cache/busca.db: índice invertido de todos os parágrafos de todos os .md de todos os simulados.
+# Termos sem acento, sem palavras vazias e com o plural reduzido ("transações" -> "transacao").
+# Cada linha de postings guarda, para um termo e um arquivo, os trios (parágrafo, tf, tamanho
+# do parágrafo) empacotados num BLOB: a busca lê uma linha por arquivo que contém o termo e
+# calcula o BM25 em memória, sem tocar nos parágrafos sem nenhum termo da consulta. A
+# atualização é incremental: só arquivos com (mtime, tamanho) diferentes são reindexados.
+SEARCH_DB_FILENAME = "busca.db"
+_SEARCH_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    simulado TEXT NOT NULL,
+    chapter TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    paragraphs INTEGER NOT NULL DEFAULT 0,
+    tokens INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_files_simulado ON files(simulado);
+CREATE TABLE IF NOT EXISTS paragraphs (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL REFERENCES files(id),
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_paragraphs_file ON paragraphs(file_id);
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT NOT NULL,
+    file_id INTEGER NOT NULL REFERENCES files(id),
+    data BLOB NOT NULL,
+    PRIMARY KEY (term, file_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_postings_file ON postings(file_id);
+"""
+_SEARCH_STOPWORDS = {
+    "de", "do", "da", "dos", "das", "em", "no", "na", "nos", "nas", "um", "uma", "uns", "umas", "os", "as",
+    "ao", "aos", "para", "pra", "por", "pelo", "pela", "pelos", "pelas", "com", "sem", "se", "que", "como",
+    "mais", "mas", "ou", "seu", "sua", "seus", "suas", "ser", "sao", "foi", "este", "esta", "esse", "essa",
+    "isso", "isto", "ja", "nao", "tambem", "quando", "onde", "entre", "sobre", "ate", "cada", "muito", "qual",
+    "quais", "tem", "ha", "the", "and", "of", "to", "in", "is", "for", "on", "with",
+}
+
+def _fold_plural(term: str) -> str:
+    """Reduz o plural mais comum (já sem acento): transacoes -> transacao, relacionais -> relacional."""
+    if len(term) > 4:
+        if term.endswith(("oes", "aes")):
+            return term[:-3] + "ao"
+        if term.endswith("ais"):
+            return term[:-3] + "al"
+        if term.endswith("eis"):
+            return term[:-3] + "el"
+    if len(term) > 3 and term.endswith("s") and not term.endswith(("ss", "us", "is")):
+        return term[:-1]
+    return term
+
+def search_terms(text: str):
+    return [_fold_plural(t) for t in tokenize(text) if t not in _SEARCH_STOPWORDS]
+
+def split_passages(text: str):
+    """Parágrafos (separados por linha em branco); um título solto vai junto com o parágrafo seguinte."""
+    headings = []
+    for block in re.split(r"\n[ \t]*\n", text):
+        block = block.strip()
+        if not block:
+            continue
+        if all(line.lstrip().startswith("#") for line in block.splitlines()):
+            headings.append(block)
+            continue
+        yield "\n".join(headings + [block])
+        headings = []
+    if headings:
+        yield "\n".join(headings)
+
+class SearchIndex:
+    """Busca BM25 sobre os parágrafos de todos os simulados (SQLite; seguro entre threads)."""
+    def __init__(self, root: str):
+        self.root = root
+        self.path = os.path.join(root, ".cache", SEARCH_DB_FILENAME)
+        self.checked_at = None
+        self._lock = threading.Lock()  # uma atualização por vez
+
+    @contextmanager
+    def connect(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SEARCH_SCHEMA)
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def content_files():
+        """{caminho: (simulado, capítulo, arquivo)} de todos os .md da árvore de conteúdo."""
+        idx, files = content_index(), {}
+        for sim in list_simulados():
+            base = resolve_chapter_base(sim)
+            for chapter in idx.chapters.get(base, []):
+                chapter_path = os.path.join(base, chapter)
+                for name in idx.md_files.get(chapter_path, []):
+                    files[os.path.join(chapter_path, name)] = (sim, chapter, name)
+        return files
+
+    @staticmethod
+    def _remove(conn, file_id: int):
+        conn.execute("DELETE FROM postings WHERE file_id = ?", (file_id,))
+        conn.execute("DELETE FROM paragraphs WHERE file_id = ?", (file_id,))
+        conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
+
+    @staticmethod
+    def _add(conn, path: str, simulado: str, chapter: str, file_name: str, signature):
+        file_id = conn.execute("INSERT INTO files (path, simulado, chapter, file_name, mtime, size) VALUES (?, ?, ?, ?, ?, ?)",
+                               (path, simulado, chapter, file_name, *signature)).lastrowid
+        postings = defaultdict(list)  # termo -> [parágrafo, tf, tamanho, ...]
+        paragraphs = tokens = 0
+        for passage in split_passages(read_file(path) or ""):
+            terms = search_terms(passage)
+            if not terms:
+                continue
+            pid = conn.execute("INSERT INTO paragraphs (file_id, text) VALUES (?, ?)", (file_id, passage)).lastrowid
+            for term, tf in Counter(terms).items():
+                postings[term] += (pid, tf, len(terms))
+            paragraphs += 1
+            tokens += len(terms)
+        conn.executemany("INSERT INTO postings (term, file_id, data) VALUES (?, ?, ?)",
+                         ((term, file_id, array("I", data).tobytes()) for term, data in postings.items()))
+        conn.execute("UPDATE files SET paragraphs = ?, tokens = ? WHERE id = ?", (paragraphs, tokens, file_id))
+
+    @timed("busca_indexacao")
+    def refresh(self, force: bool = False) -> int:
+        """Indexa arquivos novos ou alterados e remove os apagados (no máximo a cada CONTENT_INDEX_TTL s)."""
+        with self._lock:
+            if not force and self.checked_at is not None and time.monotonic() - self.checked_at < CONTENT_INDEX_TTL:
+                return 0
+            files = self.content_files()
+            changed = 0
+            with self.connect() as conn:
+                known = {path: (file_id, (mtime, size))
+                         for file_id, path, mtime, size in conn.execute("SELECT id, path, mtime, size FROM files")}
+                for path in known.keys() - files.keys():
+                    self._remove(conn, known[path][0])
+                    changed += 1
+                for path, (sim, chapter, name) in files.items():
+                    try:
+                        signature = file_signature(path)
+                    except OSError:
+                        continue
+                    old = known.get(path)
+                    if old is not None and old[1] == signature:
+                        continue
+                    if old is not None:
+                        self._remove(conn, old[0])
+                    self._add(conn, path, sim, chapter, name, signature)
+                    changed += 1
+            self.checked_at = time.monotonic()
+            return changed
+
+    @timed("busca")
+    def search(self, query: str, k: int = 10, simulado=None):
+        """[{pontuacao, simulado, capitulo, arquivo, texto}] dos k parágrafos com maior BM25."""
+        terms = set(search_terms(query))
+        if not terms:
+            return []
+        self.refresh()
+        k1, b = SEARCH_BM25_K1, SEARCH_BM25_B
+        with self.connect() as conn:
+            scope, args = ("WHERE simulado = ?", (simulado,)) if simulado else ("", ())
+            n_paragraphs, n_tokens = conn.execute(f"SELECT COALESCE(SUM(paragraphs), 0), COALESCE(SUM(tokens), 0) FROM files {scope}", args).fetchone()
+            if not n_paragraphs:
+                return []
+            base, per_token = k1 * (1 - b), k1 * b / (n_tokens / n_paragraphs)  # tf + k1·(1 - b + b·dl/avgdl)
+            allowed = {fid for (fid,) in conn.execute("SELECT id FROM files WHERE simulado = ?", (simulado,))} if simulado else None
+            postings = []
+            for term in terms:
+                entries = array("I")
+                for file_id, data in conn.execute("SELECT file_id, data FROM postings WHERE term = ?", (term,)):
+                    if allowed is None or file_id in allowed:
+                        entries.frombytes(data)
+                if entries:
+                    postings.append(entries)
+            # o termo mais frequente primeiro: o dict dele sai pronto do zip, os demais somam por cima
+            postings.sort(key=len, reverse=True)
+            scores = {}
+            for entries in postings:
+                df = len(entries) // 3
+                weight = math.log(1 + (n_paragraphs - df + 0.5) / (df + 0.5)) * (k1 + 1)  # idf·(k1 + 1)
+                partial = [weight * tf / (tf + base + per_token * dl) for tf, dl in zip(entries[1::3], entries[2::3])]
+                if not scores:
+                    scores = dict(zip(entries[0::3], partial))
+                    continue
+                get = scores.get
+                for pid, value in zip(entries[0::3], partial):
+                    scores[pid] = get(pid, 0.0) + value
+            top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            if not top:
+                return []
+            rows = {pid: row for pid, *row in conn.execute(
+                f"""SELECT p.id, f.simulado, f.chapter, f.file_name, p.text FROM paragraphs p JOIN files f ON f.id = p.file_id
+                    WHERE p.id IN ({",".join("?" * len(top))})""", [pid for pid, _ in top])}
+        return [{"pontuacao": round(score, 3), "simulado": rows[pid][0], "capitulo": rows[pid][1],
+                 "arquivo": rows[pid][2], "texto": rows[pid][3]} for pid, score in top if pid in rows]
+
+_search_index = None
+_search_index_lock = threading.Lock()
+
+def search_index() -> SearchIndex:
+    global _search_index
+    with _search_index_lock:
+        if _search_index is None or _search_index.root != ROOT_DIR:
+            _search_index = SearchIndex(ROOT_DIR)
+        return _search_index
+
+def topic_quiz_content(query: str, simulado=None, max_tokens: int = CHUNK_MAX_TOKENS):
+    """Só os trechos mais relevantes para a consulta (até max_tokens), no lugar do capítulo inteiro."""
+    parts, used = [], 0
+    for hit in search_index().search(query, SEARCH_TOPIC_PASSAGES, simulado):
+        part = f"## {hit['simulado']} • Capítulo {hit['capitulo']} • {hit['arquivo']}\n\n{hit['texto']}"
+        cost = estimate_tokens(part)
+        if parts and used + cost > max_tokens:
+            break
+        parts.append(part)
+        used += cost
+    return "\n\n---\n\n".join(parts)
+
+# -------------------------- PERSISTÊNCIA (LOGS E RESULTADOS) --------------------------
+# Ao fim de um teste, a GUI só enfileira o resultado; uma thread de escrita grava em lotes.
+# Cada lote, sob o lock do simulado (arquivo .simuladomd.lock, vale entre processos):
+#   1. grava .journal.json com os resultados e o tamanho atual dos arquivos de append (fsync);
+#   2. aplica: log_global.txt, teste_<data>.txt (tmp + rename), results.csv e results_store;
+#   3. fsync dos arquivos tocados e remove o journal.
+# Se o processo cair no meio, o próximo lote (ou o dashboard) encontra o journal, corta os
+# arquivos de append no tamanho anotado e reaplica o lote inteiro: ou entra tudo, ou nada.
+_thread_locks = defaultdict(threading.Lock)
+
+@contextmanager
+def simulado_lock(sim_dir: str):
+    """Lock exclusivo do simulado: entre threads (Lock) e entre processos (flock/msvcrt)."""
+    with _thread_locks[os.path.abspath(sim_dir)]:
+        os.makedirs(sim_dir, exist_ok=True)
+        with open(os.path.join(sim_dir, ".simuladomd.lock"), "a+b") as f:
+            if os.name == "nt":
+                import msvcrt
+                f.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:  # LK_LOCK desiste após ~10 s; continua tentando
+                        continue
+            else:
+                import fcntl
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if os.name == "nt":
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+                else:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def make_result_job(sim_dir: str, md_filename: str, answers, acertos: int, erros: int, total: int, when=None,
+                    chapter=None):
+    """Resultado de um teste pronto para a fila de escrita (só tipos JSON)."""
+    when = (when or datetime.now()).replace(microsecond=0)
+    return {
+        "sim_dir": sim_dir,
+        "md_filename": md_filename,
+        "chapter": chapter or extract_chapter(md_filename),
+        "when": when.isoformat(),
+        "acertos": acertos, "erros": erros, "total": total,
+        "answers": answers,
+        "indiv_log": os.path.join(sim_dir, LOGS_FOLDER_NAME, f"teste_{when.strftime('%Y%m%d_%H%M%S')}.txt"),
+    }
+
+def _append_targets(sim_dir: str, jobs):
+    store = ResultsStore(sim_dir)
+    paths = {os.path.join(sim_dir, LOGS_FOLDER_NAME, "log_global.txt"), os.path.join(sim_dir, RESULTS_FILENAME), store.names_path}
+    paths |= {os.path.join(store.dir, datetime.fromisoformat(j["when"]).strftime("%Y-%m") + ".bin") for j in jobs}
+    return paths
+
+def _apply_result(job, store: ResultsStore):
+    """As três gravações de um teste (mais o results_store). Chamar com o lock do simulado."""
+    sim_dir, md_filename = job["sim_dir"], job["md_filename"]
+    when = datetime.fromisoformat(job["when"])
+    date_str, time_str = when.strftime("%Y-%m-%d"), when.strftime("%H:%M:%S")
+    acertos, erros, total = job["acertos"], job["erros"], job["total"]
+
+    with open(os.path.join(sim_dir, LOGS_FOLDER_NAME, "log_global.txt"), "a", encoding="utf-8") as f:
+        f.write(f"--- TESTE REALIZADO EM {date_str} {time_str} ---\n")
+        f.write(f"Arquivo: {md_filename}\n")
+        f.write(f"Resultado: {acertos} acertos, {erros} erros de {total} perguntas.\n\n")
+
+    tmp = job["indiv_log"] + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(f"Relatório do Teste - {date_str} {time_str}\nArquivo Base: {md_filename}\n")
+        for i, ans in enumerate(job["answers"]):
+            f.write(f"P{i+1}: {ans['question']}\n R: {ans['selected']} | G: {ans['correct']} | {'OK' if ans['is_correct'] else 'X'}\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, job["indiv_log"])
+
+    with open(os.path.join(sim_dir, RESULTS_FILENAME), "a", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerow([md_filename, date_str, time_str, acertos, erros, total])
+    store.append(md_filename, when, acertos, erros, total)
+
+def _fsync_paths(paths):
+    for path in paths:
+        try:
+            with open(path, "rb+") as f:
+                os.fsync(f.fileno())
+        except OSError:
+            pass
 
-def find_explanation_in_text(full_text, cue):
-    for p in full_text.split("\n\n"):
-        if cue in p:
-            return p.strip()
-    return "Contexto não encontrado no texto original."
+def _write_journal(sim_dir: str, sizes, jobs):
+    journal = os.path.join(sim_dir, ".journal.json")
+    with open(journal + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"sizes": sizes, "jobs": jobs}, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(journal + ".tmp", journal)
+
+def recover_pending_results(sim_dir: str):
+    """Conclui um lote interrompido (journal presente). Chamar com o lock do simulado."""
+    journal = os.path.join(sim_dir, ".journal.json")
+    try:
+        with open(journal, "r", encoding="utf-8") as f:
+            pending = json.load(f)
+    except FileNotFoundError:
+        return 0
+    except ValueError:  # journal incompleto: o lote nem começou a ser aplicado
+        os.remove(journal)
+        return 0
+    for path, size in pending["sizes"].items():
+        try:
+            if os.path.getsize(path) > size:
+                with open(path, "rb+") as f:
+                    f.truncate(size)
+        except FileNotFoundError:
+            pass
+    store = ResultsStore(sim_dir)
+    if not os.path.exists(os.path.join(store.dir, ".migrated")):
+        # com os arquivos cortados, o CSV está como antes do lote: migrar aqui (e não antes do
+        # corte ou depois de reaplicar) importa cada linha antiga uma vez e nenhuma do lote;
+        # os tamanhos do journal passam a incluir a migração, para um novo corte não desfazê-la
+        store.migrate_csv()
+        _fsync_paths([*store.partitions(), store.names_path])
+        sizes = {p: (os.path.getsize(p) if os.path.exists(p) else 0) for p in pending["sizes"]}
+        _write_journal(sim_dir, sizes, pending["jobs"])
+    for job in pending["jobs"]:
+        _apply_result(job, store)
+    AnswerLog(sim_dir).record_tests(pending["jobs"])  # os que já tinham entrado são ignorados
+    store.rebuild_aggregates()
+    _fsync_paths(pending["sizes"])
+    os.remove(journal)
+    return len(pending["jobs"])
+
+@timed("gravacao_resultados")
+def write_results_batch(sim_dir: str, jobs):
+    """Grava um lote de resultados do mesmo simulado de forma atômica (ver comentário acima)."""
+    ensure_simulado_structure(sim_dir)
+    store = ResultsStore(sim_dir)
+    with simulado_lock(sim_dir):
+        recover_pending_results(sim_dir)
+        store.migrate_csv()  # depois do journal e antes de acrescentar linhas novas
+        targets = _append_targets(sim_dir, jobs)
+        sizes = {p: (os.path.getsize(p) if os.path.exists(p) else 0) for p in targets}
+        _write_journal(sim_dir, sizes, jobs)
+        for job in jobs:
+            _apply_result(job, store)
+        AnswerLog(sim_dir).record_tests(jobs)
+        _fsync_paths(targets)
+        os.remove(os.path.join(sim_dir, ".journal.json"))
+
+class ResultsWriter:
+    """Fila de resultados com uma thread de escrita; agrupa o que chegou junto num só fsync."""
+    def __init__(self):
+        self.queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, job) -> Future:
+        """Enfileira o resultado; o Future termina quando ele estiver em disco (ou com o erro da gravação)."""
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="gravador", daemon=True)
+                self._thread.start()
+        future = Future()
+        self.queue.put((job, future))
+        return future
+
+    def flush(self):
+        """Bloqueia até tudo o que foi enfileirado estar em disco."""
+        self.queue.join()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            by_sim = defaultdict(list)
+            for job, future in batch:
+                by_sim[job["sim_dir"]].append((job, future))
+            for sim_dir, entries in by_sim.items():
+                try:
+                    write_results_batch(sim_dir, [job for job, _ in entries])
+                except Exception as e:  # o journal (se gravado) garante nova tentativa na próxima abertura
+                    log.error(f"Erro ao gravar resultados em {sim_dir}: {e}")
+                    for _, future in entries:
+                        future.set_exception(e)
+                else:
+                    for _, future in entries:
+                        future.set_result(None)
+            for _ in batch:
+                self.queue.task_done()
+
+RESULTS_WRITER = ResultsWriter()
+atexit.register(RESULTS_WRITER.flush)
+
+# -------------------------- DASHBOARD (GRÁFICOS) --------------------------
+# Figuras criadas com matplotlib.figure.Figure (fora do registro global do pyplot) e
+# guardadas por (simulado, nº de resultados): revisitar o dashboard reaproveita as figuras;
+# quando chegam resultados novos, as antigas são liberadas.
+DASHBOARD_CHARTS = [
+    ("by_file", "Por Arquivo/Tópico"),
+    ("by_chapter", "Por Capítulo"),
+    ("by_day", "Progresso Diário"),
+    ("by_hour", "Por Hora do Dia"),
+]
+_figure_cache = OrderedDict()  # simulado -> (versão dos dados, {gráfico: Figure})
+
+def _release_figures(figures):
+    for fig in figures.values():
+        fig.clear()
+    figures.clear()
+
+def dashboard_figure(simulado_name: str, aggr, chart: str):
+    from matplotlib import style as mpl_style
+    version = aggr["records"]
+    entry = _figure_cache.get(simulado_name)
+    if entry is None or entry[0] != version:
+        if entry is not None:
+            _release_figures(entry[1])
+        entry = (version, {})
+        _figure_cache[simulado_name] = entry
+    _figure_cache.move_to_end(simulado_name)
+    while len(_figure_cache) > FIGURE_CACHE_SIMULADOS:
+        _release_figures(_figure_cache.popitem(last=False)[1][1])
+
+    figures = entry[1]
+    if chart not in figures:
+        with mpl_style.context("seaborn-v0_8-whitegrid"):
+            figures[chart] = render_dashboard_chart(aggr, chart)
+    return figures[chart]
+
+def _grouped_bars(ax, labels, acertos, erros, colors, horizontal=False):
+    pos = list(range(len(labels)))
+    width = 0.4
+    bar = ax.barh if horizontal else ax.bar
+    bar([p - width / 2 for p in pos], acertos, width, color=colors[0], label="acertos")
+    bar([p + width / 2 for p in pos], erros, width, color=colors[1], label="erros")
+    (ax.set_yticks if horizontal else ax.set_xticks)(pos, labels)
+    ax.legend()
+
+@timed("grafico")
+def render_dashboard_chart(aggr, chart: str):
+    """Monta um gráfico do dashboard direto das tabelas agregadas."""
+    from matplotlib.figure import Figure
+    if chart == "by_file":
+        rows = sorted(aggr["by_file"].items())
+        fig = Figure(figsize=(8, max(4, 0.5 * len(rows))))
+        ax = fig.add_subplot()
+        _grouped_bars(ax, [k for k, _ in rows], [r[0] for _, r in rows], [r[1] for _, r in rows],
+                      ["#28a745", "#dc3545"], horizontal=True)
+        ax.set_title("Desempenho por Arquivo/Tópico")
+        ax.set_xlabel("Nº de Questões"); ax.set_ylabel("")
+        fig.tight_layout(); fig.subplots_adjust(left=0.4)
+    elif chart == "by_chapter":
+        rows = sorted(aggr["by_chapter"].items())
+        fig = Figure(figsize=(8, 4))
+        ax = fig.add_subplot()
+        _grouped_bars(ax, [k for k, _ in rows], [r[0] for _, r in rows], [r[1] for _, r in rows], ["#007bff", "#ffc107"])
+        ax.set_title("Desempenho por Capítulo")
+        ax.set_ylabel("Nº de Questões"); ax.set_xlabel("Capítulo")
+        fig.tight_layout()
+    elif chart == "by_day":
+        rows = sorted((datetime.strptime(d, "%Y-%m-%d").date(), r[3] / r[4]) for d, r in aggr["by_day"].items() if r[4])
+        fig = Figure(figsize=(8, 4))
+        ax = fig.add_subplot()
+        ax.plot([d for d, _ in rows], [v for _, v in rows], marker="o", linestyle="-")
+        ax.set_title("Progresso Diário (% de Acerto)")
+        ax.set_ylabel("% de Acerto"); ax.set_xlabel("Data"); ax.set_ylim(0, 105)
+        ax.tick_params(axis="x", labelrotation=45); fig.tight_layout()
+    elif chart == "by_hour":
+        rows = sorted((int(h), r[0] / r[1]) for h, r in aggr["by_hour"].items() if r[1])
+        fig = Figure(figsize=(8, 4))
+        ax = fig.add_subplot()
+        ax.bar(range(len(rows)), [v for _, v in rows])
+        ax.set_xticks(range(len(rows)), [str(h) for h, _ in rows])
+        ax.set_title("Média de Acerto por Hora do Dia")
+        ax.set_ylabel("% de Acerto"); ax.set_xlabel("Hora do Dia"); ax.set_ylim(0, 105)
+        fig.tight_layout()
+    else:
+        raise ValueError(f"Gráfico desconhecido: {chart!r}")
+    return fig
+
+# -------------------------- GERAÇÃO EM SEGUNDO PLANO --------------------------
+# A geração roda fora do loop do Tk; o resultado volta via root.after (ver QuizApp.run_in_background).
+GENERATION_EXECUTOR = ThreadPoolExecutor(max_workers=GENERATION_WORKERS, thread_name_prefix="gerador")
+POLL_INTERVAL_MS = 100
+
+class GenerationJob:
+    """Uma geração em andamento: relógio próprio, sinal de cancelamento e fila de streaming."""
+    def __init__(self):
+        self.started = time.monotonic()
+        self.cancel_event = threading.Event()
+        self.future = None
+        self.content = None
+        self.index = None
+        self.questions = queue.Queue()  # perguntas entregues por streaming
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def cancel(self):
+        self.cancel_event.set()
+        if self.future is not None:
+            self.future.cancel()  # só tem efeito se ainda não começou
+
+# -------------------------- GUI: LISTA VIRTUAL --------------------------
+class VirtualList(Frame):
+    """
+    Lista rolável de botões que só cria widgets para as linhas visíveis: rolar ou trocar
+    os itens reaproveita os mesmos botões, então o custo não depende do nº de itens.
+    """
+    def __init__(self, parent, get_color, row_height=44, font=("Helvetica", 12)):
+        super().__init__(parent, bg=get_color("bg"))
+        self.get_color, self.row_height, self.font = get_color, row_height, font
+        self.items = []  # (texto, comando)
+        self.pool = []   # (botão, id da janela no canvas), reaproveitados entre linhas
+        self.canvas = Canvas(self, bg=get_color("bg"), highlightthickness=0, yscrollincrement=row_height)
+        self.scrollbar = Scrollbar(self, orient="vertical", command=self.canvas.yview)
+        self.canvas.configure(yscrollcommand=self._on_scroll)
+        self.scrollbar.pack(side="right", fill="y")
+        self.canvas.pack(side="left", fill="both", expand=True)
+        self.canvas.bind("<Configure>", lambda e: self._render())
+        self._bind_wheel(self.canvas)
+
+    def _bind_wheel(self, widget):
+        for seq in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            widget.bind(seq, self._on_wheel)
+
+    def _on_wheel(self, event):
+        up = event.num == 4 or getattr(event, "delta", 0) > 0
+        self.canvas.yview_scroll(-1 if up else 1, "units")
+        return "break"
+
+    def _on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        self._render()
+
+    def set_items(self, items):
+        self.items = list(items)
+        self.canvas.configure(scrollregion=(0, 0, 1, len(self.items) * self.row_height))
+        self.canvas.yview_moveto(0)
+        self._render()
+
+    def _render(self):
+        """Reposiciona o pool de botões sobre as linhas que estão na área visível do canvas."""
+        width, height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        first = max(0, int(self.canvas.canvasy(0) // self.row_height))
+        while len(self.pool) < min(height // self.row_height + 2, len(self.items)):
+            button = Button(self.canvas, font=self.font, anchor="w", padx=10,
+                            bg=self.get_color("button_bg"), fg=self.get_color("button_fg"))
+            self._bind_wheel(button)
+            self.pool.append((button, self.canvas.create_window(0, 0, window=button, anchor="nw")))
+        for offset, (button, window) in enumerate(self.pool):
+            index = first + offset
+            if index >= len(self.items):
+                self.canvas.itemconfigure(window, state="hidden")
+                continue
+            text, command = self.items[index]
+            button.config(text=text, command=command)
+            self.canvas.coords(window, 0, index * self.row_height)
+            self.canvas.itemconfigure(window, state="normal", width=max(width - 4, 1), height=self.row_height - 6)
 
 # -------------------------- GUI --------------------------
 class QuizApp:
@@ -335,8 +2727,15 @@ class QuizApp:
         self.current_simulado = None
         self.md_filename = None
         self.md_content = None
+        self.paragraph_index = None
         self.questions = []
         self.user_answers = []
+        self.generation_job = None
+        self.stream_done = True
+        self.file_selection = (None, None)
+        self.screens = {}  # telas persistentes (nome -> Frame), atualizadas no lugar
+        self.server = quiz_server_client()  # None = conteúdo e resultados locais
+        self._backend_requests = {}  # função -> nº do último pedido ao servidor (só o mais recente vale)
 
         self.start_initial_screen()
 
@@ -347,19 +2746,85 @@ class QuizApp:
     def toggle_theme(self):
         self.is_dark_theme = not self.is_dark_theme
         self.root.configure(bg=self.get_color("bg"))
+        # as telas persistentes têm as cores do tema antigo: são montadas de novo na próxima visita
+        if self.current_frame in self.screens.values():
+            self.current_frame = None
+        for frame in self.screens.values():
+            frame.destroy()
+        self.screens.clear()
         self.start_initial_screen()
 
     # util
-    def clear_frame(self):
-        if self.current_frame:
+    def _leave_current_frame(self):
+        """Tira a tela atual da janela: as persistentes só saem do pack, as demais são destruídas."""
+        if self.current_frame is None:
+            return
+        if self.current_frame in self.screens.values():
+            self.current_frame.pack_forget()
+        else:
             self.current_frame.destroy()
+        self.current_frame = None
+
+    def clear_frame(self):
+        self._leave_current_frame()
         self.current_frame = Frame(self.root, bg=self.get_color("bg"))
         self.current_frame.pack(fill="both", expand=True, padx=20, pady=20)
 
+    def show_screen(self, name, build):
+        """
+        Mostra a tela persistente `name`. build(frame) monta os widgets só na primeira
+        visita (ou depois de trocar o tema); quem chama apenas atualiza o conteúdo deles.
+        """
+        frame = self.screens.get(name)
+        if frame is not None and frame is self.current_frame:
+            return frame
+        self._leave_current_frame()
+        if frame is None:
+            frame = self.screens[name] = Frame(self.root, bg=self.get_color("bg"))
+            build(frame)
+        frame.pack(fill="both", expand=True, padx=20, pady=20)
+        self.current_frame = frame
+        return frame
+
+    def backend_call(self, local_fn, *args, on_result):
+        """
+        Consulta o servidor (SIMULADOMD_SERVER) se houver um, senão a função local de mesmo nome,
+        e entrega a lista a on_result na thread do Tk. No servidor, a consulta roda em segundo
+        plano: on_result(None) marca "carregando", e a resposta só é aplicada se for a mais
+        recente e a tela ainda for a mesma.
+        """
+        if self.server is None:
+            on_result(local_fn(*args))
+            return
+        name, frame = local_fn.__name__, self.current_frame
+        request_id = self._backend_requests[name] = self._backend_requests.get(name, 0) + 1
+        remote = getattr(self.server, name)
+
+        def done(future):
+            if self._backend_requests.get(name) != request_id or self.current_frame is not frame:
+                return
+            try:
+                result = future.result()
+            except QuizServerError as e:
+                messagebox.showerror("Servidor", str(e))
+                result = []
+            on_result(result)
+        on_result(None)
+        self.run_in_background(lambda: remote(*args), done)
+
+    def _show_if(self, widget, visible, **pack_options):
+        if visible:
+            widget.pack(**pack_options)
+        else:
+            widget.pack_forget()
+
     # -------- PÁGINA INICIAL --------
     def start_initial_screen(self):
         self.clear_frame()
         Label(self.current_frame, text="Bem-vindo ao SimuladoMD!", font=("Helvetica", 24, "bold"), bg=self.get_color("bg"), fg=self.get_color("fg")).pack(pady=(10, 20))
+        if self.server is not None:
+            Label(self.current_frame, text=f"Servidor: {self.server.base_url} • usuário: {self.server.user}", font=("Helvetica", 11, "italic"),
+                  bg=self.get_color("bg"), fg=self.get_color("fg")).pack(pady=(0, 10))
         Label(self.current_frame, text="Escolha uma opção:", font=("Helvetica", 14), bg=self.get_color("bg"), fg=self.get_color("fg")).pack(pady=(0, 20), anchor="w")
 
         Button(self.current_frame, text="🚀 Iniciar Novo Simulado", font=("Helvetica", 12, "bold"),
@@ -370,78 +2835,245 @@ class QuizApp:
                command=lambda: self.show_simulado_selection(mode="dashboard"),
                width=40, height=2, bg=self.get_color("accent"), fg=self.get_color("button_fg")).pack(pady=10)
 
+        if self.server is None:  # a busca lê o conteúdo local
+            Button(self.current_frame, text="🔎 Buscar por Tema", font=("Helvetica", 12, "bold"),
+                   command=self.show_search_screen,
+                   width=40, height=2, bg=self.get_color("button_bg"), fg=self.get_color("button_fg")).pack(pady=10)
+
         Button(self.current_frame, text=("🌙 Tema Escuro" if not self.is_dark_theme else "☀️ Tema Claro"),
                font=("Helvetica", 12), command=self.toggle_theme,
                bg=self.get_color("button_bg"), fg=self.get_color("button_fg"), width=20).pack(pady=(30, 0))
 
-    # -------- SELECIONAR SIMULADO --------
-    def show_simulado_selection(self, mode: str):
+        Button(self.current_frame, text="⏱ Diagnóstico de desempenho", font=("Helvetica", 11),
+               command=self.show_diagnostics,
+               bg=self.get_color("button_bg"), fg=self.get_color("button_fg"), width=28).pack(pady=(10, 0))
+
+    # -------- DIAGNÓSTICO --------
+    def show_diagnostics(self):
+        """Tempos por etapa (rede, parsing, Tk, disco) das medições mais recentes, com exportação."""
         self.clear_frame()
-        Label(self.current_frame, text="Escolha o simulado:", font=("Helvetica", 14), bg=self.get_color("bg"), fg=self.get_color("fg")).pack(pady=(0, 20), anchor="w")
+        Label(self.current_frame, text="Diagnóstico de desempenho", font=("Helvetica", 24, "bold"), bg=self.get_color("bg"), fg=self.get_color("fg")).pack(pady=(0, 5))
+        Label(self.current_frame, text=f"Últimas {TIMINGS_BUFFER_SIZE} medições (ms). Perfil cProfile: SIMULADOMD_PROFILE=etapa (ou *).",
+              font=("Helvetica", 11, "italic"), bg=self.get_color("bg"), fg=self.get_color("fg")).pack(pady=(0, 10))
+
+        columns = ("etapa", "n", "total_ms", "media_ms", "p50_ms", "p95_ms", "max_ms")
+        table = ttk.Treeview(self.current_frame, columns=columns, show="headings", height=16)
+        for col, title in zip(columns, ("Etapa", "N", "Total", "Média", "p50", "p95", "Máx")):
+            table.heading(col, text=title)
+            table.column(col, width=220 if col == "etapa" else 90, anchor="w" if col == "etapa" else "e")
+        table.pack(fill="both", expand=True)
+
+        def fill():
+            table.delete(*table.get_children())
+            for row in TIMINGS.summary():
+                table.insert("", "end", values=[row[c] for c in columns])
+
+        def export(kind):
+            from tkinter import filedialog
+            path = filedialog.asksaveasfilename(defaultextension=f".{kind}", filetypes=[(kind.upper(), f"*.{kind}")],
+                                                initialfile=f"tempos_{datetime.now():%Y%m%d_%H%M%S}.{kind}")
+            if not path:
+                return
+            try:
+                (TIMINGS.export_json if kind == "json" else TIMINGS.export_csv)(path)
+            except OSError as e:
+                messagebox.showerror("Erro", f"Não foi possível exportar: {e}")
+                return
+            messagebox.showinfo("Exportado", f"Medições salvas em:\n{path}")
 
-        sims = list_simulados()
-        if not sims:
-            Label(self.current_frame, text="Nenhum simulado encontrado. Crie uma pasta (ex.: dp900) com capítulos dentro.", font=("Helvetica", 12),
-                  fg="red", bg=self.get_color("bg")).pack()
-        else:
-            for s in sims:
-                if mode == "quiz":
-                    cb = lambda name=s: self.show_chapter_selection_screen(name)
-                else:
-                    cb = lambda name=s: self.show_dashboard(name)
-                Button(self.current_frame, text=s, font=("Helvetica", 12), command=cb, width=40, height=2, bg=self.get_color("button_bg"), fg=self.get_color("button_fg")).pack(pady=5)
+        def clear():
+            TIMINGS.clear()
+            fill()
+
+        buttons = Frame(self.current_frame, bg=self.get_color("bg"))
+        buttons.pack(pady=10)
+        for text, command in (("↻ Atualizar", fill), ("Exportar JSON", lambda: export("json")),
+                              ("Exportar CSV", lambda: export("csv")), ("Limpar", clear),
+                              ("← Voltar", self.start_initial_screen)):
+            Button(buttons, text=text, command=command, font=("Helvetica", 12),
+                   bg=self.get_color("button_bg"), fg=self.get_color("button_fg")).pack(side="left", padx=5)
+        fill()
 
-        Button(self.current_frame, text="← Voltar ao Início", command=self.start_initial_screen, font=("Helvetica", 12), bg=self.get_color("button_bg"), fg=self.get_color("button_fg")).pack(pady=(20, 0))
+    # -------- SELECIONAR SIMULADO --------
+    def _build_simulado_screen(self, frame):
+        Label(frame, text="Escolha o simulado:", font=("Helvetica", 14), bg=self.get_color("bg"), fg=self.get_color("fg")).pack(pady=(0, 20), anchor="w")
+        self.simulado_empty_label = Label(frame, text="Nenhum simulado encontrado. Crie uma pasta (ex.: dp900) com capítulos dentro.", font=("Helvetica", 12),
+                                          fg="red", bg=self.get_color("bg"))
+        self.simulado_list = VirtualList(frame, self.get_color)
+        self.simulado_list.pack(fill="both", expand=True)
+        Button(frame, text="← Voltar ao Início", command=self.start_initial_screen, font=("Helvetica", 12), bg=self.get_color("button_bg"), fg=self.get_color("button_fg")).pack(pady=(20, 0))
+
+    def show_simulado_selection(self, mode: str):
+        self.show_screen("simulados", self._build_simulado_screen)
+        target = self.show_chapter_selection_screen if mode == "quiz" else self.show_dashboard
+
+        def fill(sims):
+            self.simulado_list.set_items([(s, lambda name=s: target(name)) for s in sims or ()])
+            self._show_if(self.simulado_empty_label, sims == [], before=self.simulado_list)
+        self.backend_call(list_simulados, on_result=fill)
 
     # -------- SELECIONAR CAPÍTULO/ARQUIVO --------
+    def _build_chapter_screen(self, frame):
+        self.chapter_title_label = Label(frame, font=("Helvetica", 24, "bold"), bg=self.get_color("bg"), fg=self.get_color("fg"))
+        self.chapter_title_label.pack(pady=(10, 20))
+        Label(frame, text="1. Escolha um capítulo:", font=("Helvetica", 14), bg=self.get_color("bg"), fg=self.get_color("fg")).pack(pady=(0, 20), anchor="w")
+        self.chapter_empty_label = Label(frame, text="Nenhum capítulo encontrado.", font=("Helvetica", 12), fg="red", bg=self.get_color("bg"))
+        self.chapter_list = VirtualList(frame, self.get_color)
+        self.chapter_list.pack(fill="both", expand=True)
+        Button(frame, text="← Voltar (Simulados)", command=lambda: self.show_simulado_selection("quiz"), font=("Helvetica", 12), bg=self.get_color("button_bg"), fg=self.get_color("button_fg")).pack(pady=(20, 0))
+
     def show_chapter_selection_screen(self, simulado_name):
         self.current_simulado = simulado_name
-        simulado_dir = os.path.join(ROOT_DIR, simulado_name)
-        ensure_simulado_structure(simulado_dir)
+        if self.server is None:
+            ensure_simulado_structure(os.path.join(ROOT_DIR, simulado_name))
 
-        self.clear_frame()
-        Label(self.current_frame, text=f"Simulado: {simulado_name}", font=("Helvetica", 24, "bold"), bg=self.get_color("bg"), fg=self.get_color("fg")).pack(pady=(10, 20))
-        Label(self.current_frame, text="1. Escolha um capítulo:", font=("Helvetica", 14), bg=self.get_color("bg"), fg=self.get_color("fg")).pack(pady=(0, 20), anchor="w")
+        self.show_screen("capitulos", self._build_chapter_screen)
+        self.chapter_title_label.config(text=f"Simulado: {simulado_name}")
 
-        chapters = get_chapters(simulado_name)
-        if not chapters:
-            Label(self.current_frame, text="Nenhum capítulo encontrado.", font=("Helvetica", 12), fg="red", bg=self.get_color("bg")).pack()
-        else:
-            for chapter in chapters:
-                Button(self.current_frame, text=f"Capítulo {chapter}", font=("Helvetica", 12),
-                       command=lambda c=chapter: self.show_file_selection_screen(simulado_name, c), width=40, height=2, bg=self.get_color("button_bg"), fg=self.get_color("button_fg")).pack(pady=5)
-
-        Button(self.current_frame, text="← Voltar (Simulados)", command=lambda: self.show_simulado_selection("quiz"), font=("Helvetica", 12), bg=self.get_color("button_bg"), fg=self.get_color("button_fg")).pack(pady=(20, 0))
+        def fill(chapters):
+            self.chapter_list.set_items([(f"Capítulo {c}", lambda c=c: self.show_file_selection_screen(simulado_name, c))
+                                         for c in chapters or ()])
+            self._show_if(self.chapter_empty_label, chapters == [], before=self.chapter_list)
+        self.backend_call(get_chapters, simulado_name, on_result=fill)
 
-    def show_file_selection_screen(self, simulado_name, chapter_name):
-        self.clear_frame()
-        Label(self.current_frame, text=f"{simulado_name} • Capítulo {chapter_name}", font=("Helvetica", 24, "bold"), bg=self.get_color("bg"), fg=self.get_color("fg")).pack(pady=(10, 20))
-        Label(self.current_frame, text="2. Escolha uma opção:", font=("Helvetica", 14), bg=self.get_color("bg"), fg=self.get_color("fg")).pack(pady=(0, 10), anchor="w")
+    def _build_file_screen(self, frame):
+        bg, fg = self.get_color("bg"), self.get_color("fg")
+        self.file_title_label = Label(frame, font=("Helvetica", 24, "bold"), bg=bg, fg=fg)
+        self.file_title_label.pack(pady=(10, 20))
+        Label(frame, text="2. Escolha uma opção:", font=("Helvetica", 14), bg=bg, fg=fg).pack(pady=(0, 10), anchor="w")
 
         # NOVO: campo para escolher número de perguntas
-        Label(self.current_frame, text="Quantas perguntas deseja gerar? (1-50)", font=("Helvetica", 12), bg=self.get_color("bg"), fg=self.get_color("fg")).pack(pady=(0, 5), anchor="w")
+        Label(frame, text="Quantas perguntas deseja gerar? (1-50)", font=("Helvetica", 12), bg=bg, fg=fg).pack(pady=(0, 5), anchor="w")
         self.num_questions_var = tk.IntVar(value=10)
-        num_entry = tk.Entry(self.current_frame, textvariable=self.num_questions_var, width=5, font=("Helvetica", 12), bg=self.get_color("bg"), fg=self.get_color("fg"))
+        num_entry = tk.Entry(frame, textvariable=self.num_questions_var, width=5, font=("Helvetica", 12), bg=bg, fg=fg)
         num_entry.pack(pady=(0, 10), anchor="w")
 
-        Button(self.current_frame, text="▶ Gerar teste do capítulo inteiro", font=("Helvetica", 12, "bold"),
-               command=lambda: self.start_quiz(simulado_name, chapter_name, None, self.num_questions_var.get()), bg=self.get_color("accent"), fg=self.get_color("button_fg")).pack(pady=(5, 15), fill="x", ipady=5)
+        # as opções continuam marcadas entre uma visita e outra (a tela não é recriada)
+        self.force_regenerate_var = tk.BooleanVar(value=False)
+        self.use_bank_var = tk.BooleanVar(value=False)
+        self.stream_questions_var = tk.BooleanVar(value=True)
+        self.adaptive_var = tk.BooleanVar(value=False)
+        for text, var in (("Forçar nova geração (ignorar perguntas em cache)", self.force_regenerate_var),
+                          ("Usar banco de perguntas offline (sem API)", self.use_bank_var),
+                          ("Começar assim que a primeira pergunta chegar (streaming)", self.stream_questions_var),
+                          ("Modo adaptativo (priorizar arquivos e perguntas que você mais erra)", self.adaptive_var)):
+            Checkbutton(frame, text=text, variable=var, font=("Helvetica", 11), bg=bg, fg=fg,
+                        selectcolor=self.get_color("accent")).pack(pady=(0, 10), anchor="w")
 
-        Label(self.current_frame, text="Ou escolha um arquivo específico:", font=("Helvetica", 12, "italic"), bg=self.get_color("bg"), fg=self.get_color("fg")).pack(pady=(0, 10), anchor="w")
+        Button(frame, text="▶ Gerar teste do capítulo inteiro", font=("Helvetica", 12, "bold"),
+               command=lambda: self.start_quiz_from_selection(None), bg=self.get_color("accent"), fg=self.get_color("button_fg")).pack(pady=(5, 15), fill="x", ipady=5)
 
-        md_files = get_md_files(simulado_name, chapter_name)
-        if not md_files:
-            Label(self.current_frame, text="Nenhum arquivo .md encontrado.", font=("Helvetica", 12), fg="red", bg=self.get_color("bg")).pack()
-        else:
-            for md_file in md_files:
-                Button(self.current_frame, text=md_file, font=("Helvetica", 12),
-                       command=lambda f=md_file: self.start_quiz(simulado_name, chapter_name, f, self.num_questions_var.get()),
-                       wraplength=500, justify="left", bg=self.get_color("button_bg"), fg=self.get_color("button_fg")).pack(pady=5, fill="x")
+        Label(frame, text="Ou escolha um arquivo específico:", font=("Helvetica", 12, "italic"), bg=bg, fg=fg).pack(pady=(0, 10), anchor="w")
+        self.file_empty_label = Label(frame, text="Nenhum arquivo .md encontrado.", font=("Helvetica", 12), fg="red", bg=bg)
+        self.file_list = VirtualList(frame, self.get_color, row_height=36)
+        self.file_list.pack(fill="both", expand=True)
+
+        Button(frame, text="← Voltar (Capítulos)", command=lambda: self.show_chapter_selection_screen(self.file_selection[0]), font=("Helvetica", 12), bg=self.get_color("button_bg"), fg=self.get_color("button_fg")).pack(pady=(20, 0), anchor="s")
 
-        Button(self.current_frame, text="← Voltar (Capítulos)", command=lambda: self.show_chapter_selection_screen(simulado_name), font=("Helvetica", 12), bg=self.get_color("button_bg"), fg=self.get_color("button_fg")).pack(pady=(20, 0), anchor="s")
+    def show_file_selection_screen(self, simulado_name, chapter_name):
+        self.file_selection = (simulado_name, chapter_name)
+        self.show_screen("arquivos", self._build_file_screen)
+        self.file_title_label.config(text=f"{simulado_name} • Capítulo {chapter_name}")
+
+        def fill(md_files):
+            self.file_list.set_items([(f, lambda f=f: self.start_quiz_from_selection(f)) for f in md_files or ()])
+            self._show_if(self.file_empty_label, md_files == [], before=self.file_list)
+        self.backend_call(get_md_files, simulado_name, chapter_name, on_result=fill)
+
+    def start_quiz_from_selection(self, file_name):
+        simulado_name, chapter_name = self.file_selection
+        self.start_quiz(simulado_name, chapter_name, file_name, self.num_questions_var.get(), self.force_regenerate_var.get(),
+                        self.stream_questions_var.get(), self.use_bank_var.get(), self.adaptive_var.get())
+
+    # -------- BUSCA POR TEMA --------
+    def _build_search_screen(self, frame):
+        bg, fg = self.get_color("bg"), self.get_color("fg")
+        Label(frame, text="Buscar por tema", font=("Helvetica", 24, "bold"), bg=bg, fg=fg).pack(pady=(0, 10))
+        row = Frame(frame, bg=bg)
+        row.pack(fill="x")
+        self.search_var = StringVar()
+        entry = tk.Entry(row, textvariable=self.search_var, font=("Helvetica", 12), bg=bg, fg=fg)
+        entry.pack(side="left", fill="x", expand=True)
+        entry.bind("<Return>", lambda e: self.run_search())
+        self.search_scope_var = StringVar(value=SEARCH_ALL_SIMULADOS)
+        self.search_scope_box = ttk.Combobox(row, textvariable=self.search_scope_var, state="readonly", width=20)
+        self.search_scope_box.pack(side="left", padx=5)
+        Button(row, text="🔎 Buscar", command=self.run_search, font=("Helvetica", 12),
+               bg=self.get_color("button_bg"), fg=self.get_color("button_fg")).pack(side="left")
+
+        self.search_status_label = Label(frame, font=("Helvetica", 11, "italic"), bg=bg, fg=fg)
+        self.search_status_label.pack(anchor="w", pady=5)
+        self.search_results = VirtualList(frame, self.get_color, row_height=36, font=("Helvetica", 11))
+        self.search_results.pack(fill="both", expand=True)
+        self.search_preview = scrolledtext.ScrolledText(frame, wrap=tk.WORD, height=7, font=("Helvetica", 11),
+                                                        bg=self.get_color("explanation_bg"), fg=fg, relief="flat", state="disabled")
+        self.search_preview.pack(fill="x", pady=(10, 0))
+
+        bottom = Frame(frame, bg=bg)
+        bottom.pack(fill="x", pady=(10, 0))
+        Label(bottom, text="Perguntas:", font=("Helvetica", 12), bg=bg, fg=fg).pack(side="left")
+        self.search_num_var = tk.IntVar(value=10)
+        tk.Entry(bottom, textvariable=self.search_num_var, width=5, font=("Helvetica", 12), bg=bg, fg=fg).pack(side="left", padx=5)
+        self.search_quiz_button = Button(bottom, text="▶ Gerar teste sobre este tema", command=self.start_topic_quiz, state="disabled",
+                                         font=("Helvetica", 12, "bold"), bg=self.get_color("accent"), fg=self.get_color("button_fg"))
+        self.search_quiz_button.pack(side="left", padx=10)
+        Button(bottom, text="← Voltar ao Início", command=self.start_initial_screen, font=("Helvetica", 12),
+               bg=self.get_color("button_bg"), fg=self.get_color("button_fg")).pack(side="right")
+        self.search_hits, self.search_query = [], ("", None)
+
+    def show_search_screen(self):
+        self.show_screen("busca", self._build_search_screen)
+        self.search_scope_box.config(values=[SEARCH_ALL_SIMULADOS] + list_simulados())
+
+    def run_search(self):
+        """Busca fora da thread do Tk (a primeira vez também monta o índice)."""
+        query = self.search_var.get().strip()
+        scope = self.search_scope_var.get()
+        scope = None if scope == SEARCH_ALL_SIMULADOS else scope
+        if not query:
+            return
+        self.search_status_label.config(text="Buscando...")
+
+        def work():
+            started = time.perf_counter()
+            return search_index().search(query, SEARCH_RESULTS_LIMIT, scope), (time.perf_counter() - started) * 1000
+
+        def done(future):
+            try:
+                hits, ms = future.result()
+            except (OSError, sqlite3.Error) as e:
+                self.search_status_label.config(text=f"Erro na busca: {e}")
+                return
+            self.search_hits, self.search_query = hits, (query, scope)
+            self.search_status_label.config(text=f"{len(hits)} trechos em {ms:.0f} ms" if hits else "Nenhum trecho encontrado.")
+            self.search_results.set_items([
+                (f"{h['pontuacao']:.1f} • {h['simulado']} • Cap. {h['capitulo']} • {h['arquivo']} — {' '.join(h['texto'].split())[:90]}",
+                 lambda h=h: self._preview_search_hit(h)) for h in hits])
+            self.search_quiz_button.config(state="normal" if hits else "disabled")
+            self._preview_search_hit(hits[0] if hits else None)
+        self.run_in_background(work, done)
+
+    def _preview_search_hit(self, hit):
+        self.search_preview.config(state="normal")
+        self.search_preview.delete("1.0", tk.END)
+        if hit:
+            self.search_preview.insert(tk.END, f"{hit['simulado']} • Capítulo {hit['capitulo']} • {hit['arquivo']}\n\n{hit['texto']}")
+        self.search_preview.config(state="disabled")
+
+    def start_topic_quiz(self):
+        query, scope = self.search_query
+        if not self.search_hits:
+            return
+        self.current_simulado = scope or self.search_hits[0]["simulado"]  # o resultado vai para o simulado do melhor trecho
+        self.start_quiz(self.current_simulado, "Busca", None, self.search_num_var.get(), topic=query, topic_scope=scope)
 
     # -------- QUIZ --------
-    def start_quiz(self, simulado_name, chapter_name, file_name=None, num_questions=10):
+    def start_quiz(self, simulado_name, chapter_name, file_name=None, num_questions=10, force_regenerate=False,
+                   stream_questions=True, use_bank=False, adaptive=False, topic=None, topic_scope=None):
+        """
+        Gera e começa um teste: de um arquivo, do capítulo inteiro ou, com topic, só dos trechos
+        que a busca BM25 acha para o tema (topic_scope restringe a um simulado; None = todos).
+        """
         self.clear_frame()
         # Temporizador e bolinha girando
         loading_frame = Frame(self.current_frame, bg=self.get_color("bg"))
@@ -453,71 +3085,218 @@ class QuizApp:
         canvas.pack()
         ball = canvas.create_oval(10, 10, 30, 30, fill="#007bff" if not self.is_dark_theme else "#ffc107")
 
-        self.root.update()
-        import time
-        start_time = time.time()
+        self.current_chapter, self.quiz_file_name = chapter_name, file_name
+        adaptive = adaptive and self.server is None  # o domínio por usuário só existe localmente
+        self.md_filename = (f"{simulado_name} • Capítulo {chapter_name} ({'Adaptativo' if adaptive else 'Completo'})"
+                            if not file_name else file_name)
+        if topic:
+            self.md_filename = f"Busca: {topic}"
+        back = self.show_search_screen if topic else (lambda: self.show_file_selection_screen(simulado_name, chapter_name))
+        self.md_content = None
+        self.paragraph_index = None
+        self.questions, self.user_answers = [], []
+        self.current_question_index = 0
+        self.expected_questions = num_questions
+        self.quiz_started = False
+        self.stream_done = False
+        self.waiting_for_question = False
+
+        # cada geração tem um token próprio; cancelar = trocar o token (o resultado antigo é descartado)
+        job = GenerationJob()
+        self.generation_job = job
+        stream_questions = stream_questions and not use_bank and self.server is None  # o banco já responde na hora
+        server = self.server
+        on_question = job.questions.put if stream_questions else None
+
+        def work():
+            sources = None
+            if server is not None:  # o servidor compartilha cache e geração com os outros usuários
+                content, questions = server.generate(simulado_name, chapter_name, file_name, num_questions,
+                                                     force_regenerate, use_bank)
+                job.index = ParagraphIndex(content) if content else None
+                job.content = content
+                return questions
+            if topic:  # só os trechos mais relevantes vão para a API
+                content = topic_quiz_content(topic, topic_scope)
+            elif file_name:
+                content = get_md_content(simulado_name, chapter_name, file_name)
+            elif adaptive and not use_bank:  # só os arquivos mais fracos do capítulo vão para a API
+                content, sources = adaptive_chapter_content(simulado_name, chapter_name, num_questions)
+            else:
+                content, sources = chapter_content_with_sources(simulado_name, chapter_name)
+            if content:
+                # antes de job.content: quem vê o conteúdo já vê o índice; sources: arquivo de cada resposta
+                job.index = ParagraphIndex(content, sources)
+            job.content = content
+            if not content or job.cancel_event.is_set():
+                return None
+            if use_bank:
+                return sample_from_bank(simulado_name, chapter_name, file_name, num_questions, adaptive)
+            served = served_index(simulado_name).new_run()  # não repete perguntas já respondidas
+            if file_name or topic:
+                return generate_questions_from_api(content, num_questions, force_regenerate, on_question, job.cancel_event, served)
+            return generate_questions_chunked(content, num_questions, force_regenerate, on_question, job.cancel_event, served)
+
+        def pump():
+            if self.generation_job is not job:
+                return
+            self.receive_streamed_questions(job)
+            self.root.after(POLL_INTERVAL_MS, pump)
+
+        def done(future):
+            if self.generation_job is not job:
+                return  # cancelado ou substituído por outra geração
+            self.generation_job = None
+            self.stream_done = True
+            try:
+                questions = future.result()
+            except Exception as e:
+                questions, error = None, e
+            else:
+                error = None
+            if stream_questions:
+                self.receive_streamed_questions(job)
+            else:
+                self.md_content, self.questions = job.content, (questions or [])
+                self.paragraph_index = job.index
+
+            if self.quiz_started:  # streaming: o teste já começou com o que chegou
+                if error:
+                    log.warning("geração interrompida", extra={"campos": {"perguntas": len(self.questions), "erro": str(error)}})
+                if self.waiting_for_question:
+                    self.show_final_results()
+                return
+            if error:
+                messagebox.showerror("Servidor" if isinstance(error, QuizServerError) else "Erro de API",
+                                     f"Ocorreu um erro ao gerar as perguntas: {error}")
+                back()
+                return
+            if not job.content:
+                messagebox.showerror("Erro", f"Não foi possível encontrar conteúdo para '{self.md_filename}'.")
+                back()
+                return
+            if not self.questions and use_bank:
+                messagebox.showerror("Erro", "O banco de perguntas não tem perguntas para esta seleção.\n"
+                                             f"Gere-o com: python main.py banco {simulado_name}")
+                back()
+                return
+            if not self.questions:
+                messagebox.showerror("Erro", "Não foi possível gerar as perguntas.")
+                back()
+                return
+
+            self.quiz_started = True
+            self.display_question()
+
+        def cancel():
+            job.cancel()
+            if self.generation_job is job:
+                self.generation_job = None
+            back()
+
+        Button(loading_frame, text="✖ Cancelar", command=cancel, font=("Helvetica", 12),
+               bg=self.get_color("button_bg"), fg=self.get_color("button_fg")).pack(pady=(20, 0))
+
         angle = 0
-        running = True
         def animate():
             nonlocal angle
-            if not running:
+            if self.generation_job is not job or self.quiz_started:
                 return
             angle = (angle + 15) % 360
             x = 10 + 10 * (1 + 0.7 * (math.cos(math.radians(angle))))
             y = 10 + 10 * (1 + 0.7 * (math.sin(math.radians(angle))))
             canvas.coords(ball, x, y, x+20, y+20)
-            elapsed = int(time.time() - start_time)
+            elapsed = int(job.elapsed())
             timer_label.config(text=f"{elapsed//60:02d}:{elapsed%60:02d}")
             self.root.after(60, animate)
-        import math
         animate()
-        self.root.update()
-
-        self.md_filename = (f"{simulado_name} • Capítulo {chapter_name} (Completo)" if not file_name else file_name)
-        self.md_content = (
-            get_all_md_content_from_chapter(simulado_name, chapter_name)
-            if not file_name else
-            get_md_content(simulado_name, chapter_name, file_name)
-        )
-        self.root.update()
-        running = False  # para parar animação
-        if not self.md_content:
-            messagebox.showerror("Erro", f"Não foi possível encontrar conteúdo para '{self.md_filename}'.")
-            self.show_file_selection_screen(simulado_name, chapter_name)
-            return
 
-        self.questions = generate_questions_from_api(self.md_content, num_questions)
-        self.root.update()
-        running = False
+        job.future = self.run_in_background(work, done)
+        if stream_questions:
+            pump()
+
+    def receive_streamed_questions(self, job):
+        """Move as perguntas recebidas por streaming para self.questions (thread do Tk)."""
+        while True:
+            try:
+                self.questions.append(job.questions.get_nowait())
+            except queue.Empty:
+                break
+        if self.md_content is None:
+            self.paragraph_index = job.index
+            self.md_content = job.content
         if not self.questions:
-            messagebox.showerror("Erro", "Não foi possível gerar as perguntas.")
-            self.show_file_selection_screen(simulado_name, chapter_name)
             return
+        if not self.quiz_started:
+            self.quiz_started = True
+            self.display_question()
+        elif self.waiting_for_question and self.current_question_index < len(self.questions):
+            self.waiting_for_question = False
+            self.display_question()
+
+    def run_in_background(self, fn, on_done):
+        """Executa fn no pool de geração e chama on_done(future) na thread do Tk."""
+        return self.when_done(GENERATION_EXECUTOR.submit(fn), on_done)
+
+    def when_done(self, future, on_done):
+        """Chama on_done(future) na thread do Tk quando o future terminar (polling com after)."""
+        def poll():
+            if future.done():
+                on_done(future)
+            else:
+                self.root.after(POLL_INTERVAL_MS, poll)
+        self.root.after(POLL_INTERVAL_MS, poll)
+        return future
+
+    def _build_question_screen(self, frame):
+        """Tela de pergunta, criada uma vez: display_question/check_answer só atualizam os widgets."""
+        bg, fg = self.get_color("bg"), self.get_color("fg")
+        self.progress_label = Label(frame, font=("Helvetica", 14, "bold"), bg=bg, fg=fg)
+        self.progress_label.pack(anchor="w")
+        self.question_label = Label(frame, wraplength=850, justify="left", font=("Helvetica", 16), bg=bg, fg=fg)
+        self.question_label.pack(pady=(10, 20), anchor="w")
+        self.instruction_label = Label(frame, font=("Helvetica", 12, "italic"), bg=bg, fg=fg)
+        self.instruction_label.pack(pady=(0, 15), anchor="w")
 
-        self.current_question_index = 0
-        self.user_answers = []
-        self.display_question()
+        self.option_vars, self.option_labels = [], []
+        for _ in range(4):  # normalize_question garante sempre 4 alternativas
+            var = StringVar(value="")
+            cb = Checkbutton(frame, variable=var, offvalue="", font=("Helvetica", 12), anchor="w", wraplength=800, justify="left")
+            cb.pack(fill="x", pady=5)
+            self.option_vars.append(var)
+            self.option_labels.append(cb)
+
+        self.submit_button = Button(frame, text="Submeter Resposta", command=self.check_answer, font=("Helvetica", 12, "bold"), bg=self.get_color("button_bg"), fg=self.get_color("button_fg"))
+        self.submit_button.pack(pady=20)
+
+        # justificativa e botão de avançar ficam fora do pack até a correção
+        self.explanation_frame = Frame(frame, bg=self.get_color("explanation_bg"), bd=1, relief="solid")
+        Label(self.explanation_frame, text="Justificativa:", font=("Helvetica", 12, "bold"), bg=self.get_color("explanation_bg"), fg=fg).pack(anchor="w", padx=10, pady=(5, 0))
+        self.explanation_widget = scrolledtext.ScrolledText(self.explanation_frame, wrap=tk.WORD, height=4, font=("Helvetica", 11), bg=self.get_color("explanation_bg"), fg=fg, relief="flat")
+        self.explanation_widget.pack(fill="x", expand=True, padx=10, pady=(0, 10))
+        self.next_button = Button(frame, font=("Helvetica", 12, "bold"))
 
+    @timed("tela_pergunta")
     def display_question(self):
-        self.clear_frame()
+        self.show_screen("pergunta", self._build_question_screen)
         q_data = self.questions[self.current_question_index]
         instruction = f"Marque {len(q_data['answer'])} resposta{'s' if len(q_data['answer']) > 1 else ''} correta{'s' if len(q_data['answer']) > 1 else ''}."
 
-        Label(self.current_frame, text=f"Pergunta {self.current_question_index + 1}/{len(self.questions)}", font=("Helvetica", 14, "bold"), bg=self.get_color("bg"), fg=self.get_color("fg")).pack(anchor="w")
-        Label(self.current_frame, text=q_data['question'], wraplength=850, justify="left", font=("Helvetica", 16), bg=self.get_color("bg"), fg=self.get_color("fg")).pack(pady=(10, 20), anchor="w")
-        Label(self.current_frame, text=instruction, font=("Helvetica", 12, "italic"), bg=self.get_color("bg"), fg=self.get_color("fg")).pack(pady=(0, 15), anchor="w")
+        total = len(self.questions) if self.stream_done else max(self.expected_questions, len(self.questions))
+        self.progress_label.config(text=f"Pergunta {self.current_question_index + 1}/{total}")
+        self.question_label.config(text=q_data['question'])
+        self.instruction_label.config(text=instruction)
 
-        self.option_vars, self.option_labels = [], []
-        for option in q_data['options']:
-            var = StringVar(value="")
-            self.option_vars.append(var)
-            cb = Checkbutton(self.current_frame, text=option, variable=var, onvalue=option, offvalue="", font=("Helvetica", 12), bg=self.get_color("bg"), fg=self.get_color("fg"), anchor="w", wraplength=800, justify="left", selectcolor=self.get_color("accent"))
-            cb.pack(fill="x", pady=5)
-            self.option_labels.append(cb)
+        self.question_shown_at = time.monotonic()
+        for var, cb, option in zip(self.option_vars, self.option_labels, q_data['options']):
+            cb.config(text=option, onvalue=option, state="normal", bg=self.get_color("bg"), fg=self.get_color("fg"), selectcolor=self.get_color("accent"))
+            var.set("")
 
-        self.submit_button = Button(self.current_frame, text="Submeter Resposta", command=self.check_answer, font=("Helvetica", 12, "bold"), bg=self.get_color("button_bg"), fg=self.get_color("button_fg"))
-        self.submit_button.pack(pady=20)
+        self.submit_button.config(state="normal")
+        self.explanation_frame.pack_forget()
+        self.next_button.pack_forget()
 
+    @timed("tela_correcao")
     def check_answer(self):
         self.submit_button.config(state="disabled")
         for cb in self.option_labels:
@@ -530,12 +3309,22 @@ class QuizApp:
         letter_map = {"A": 0, "B": 1, "C": 2, "D": 3}
         correct_answers_text = sorted([all_option_texts[letter_map[l]] for l in api_answer_letters if l in letter_map])
         is_correct = (selected_answers == correct_answers_text)
+        time_to_answer = round(time.monotonic() - self.question_shown_at, 2)
+
+        explanation_cue = q_data.get("explanation_cue", "")
+        if self.paragraph_index is None:
+            self.paragraph_index = ParagraphIndex(self.md_content)
+        # capítulo inteiro/adaptativo: o arquivo sai do trecho da pista (é o que o MasteryIndex aprende)
+        source_file = q_data.get("source_file") or self.quiz_file_name or self.paragraph_index.source_of(explanation_cue)
 
         self.user_answers.append({
             "question": q_data["question"],
             "selected": selected_answers,
             "correct": correct_answers_text,
-            "is_correct": is_correct
+            "is_correct": is_correct,
+            "source_file": source_file,
+            "time_to_answer": time_to_answer,
+            "answered_at": time.time(),
         })
 
         for cb in self.option_labels:
@@ -546,26 +3335,32 @@ class QuizApp:
             elif was_selected and not is_correct_option:
                 cb.config(bg=self.get_color("wrong_bg"), fg=self.get_color("wrong_fg"), selectcolor=self.get_color("wrong_bg"))
 
-        explanation_frame = Frame(self.current_frame, bg=self.get_color("explanation_bg"), bd=1, relief="solid")
-        explanation_frame.pack(fill="x", pady=10)
-        Label(explanation_frame, text="Justificativa:", font=("Helvetica", 12, "bold"), bg=self.get_color("explanation_bg"), fg=self.get_color("fg")).pack(anchor="w", padx=10, pady=(5, 0))
-
-        explanation_cue = q_data.get("explanation_cue", "")
-        explanation_text = find_explanation_in_text(self.md_content, explanation_cue)
+        explanation_text = find_explanation_in_text(self.md_content, explanation_cue, self.paragraph_index)
 
-        explanation_widget = scrolledtext.ScrolledText(explanation_frame, wrap=tk.WORD, height=4, font=("Helvetica", 11), bg=self.get_color("explanation_bg"), fg=self.get_color("fg"), relief="flat")
-        explanation_widget.insert(tk.END, explanation_text)
-        explanation_widget.config(state="disabled")
-        explanation_widget.pack(fill="x", expand=True, padx=10, pady=(0, 10))
+        self.explanation_widget.config(state="normal")
+        self.explanation_widget.delete("1.0", tk.END)
+        self.explanation_widget.insert(tk.END, explanation_text)
+        self.explanation_widget.config(state="disabled")
+        self.explanation_widget.yview_moveto(0)
+        self.explanation_frame.pack(fill="x", pady=10)
 
-        if self.current_question_index < len(self.questions) - 1:
-            Button(self.current_frame, text="Próxima Pergunta →", command=self.next_question, font=("Helvetica", 12, "bold"), bg=self.get_color("button_bg"), fg=self.get_color("button_fg")).pack(pady=10)
+        if self.current_question_index < len(self.questions) - 1 or not self.stream_done:
+            self.next_button.config(text="Próxima Pergunta →", command=self.next_question, bg=self.get_color("button_bg"), fg=self.get_color("button_fg"))
         else:
-            Button(self.current_frame, text="Ver Resultados Finais", command=self.show_final_results, font=("Helvetica", 12, "bold"), bg="#4CAF50", fg="white").pack(pady=10)
+            self.next_button.config(text="Ver Resultados Finais", command=self.show_final_results, bg="#4CAF50", fg="white")
+        self.next_button.pack(pady=10)
 
     def next_question(self):
         self.current_question_index += 1
-        self.display_question()
+        if self.current_question_index < len(self.questions):
+            self.display_question()
+        elif self.stream_done:
+            self.show_final_results()
+        else:  # streaming: a próxima pergunta ainda está a caminho
+            self.waiting_for_question = True
+            self.clear_frame()
+            Label(self.current_frame, text="Aguardando a próxima pergunta...", font=("Helvetica", 16),
+                  bg=self.get_color("bg"), fg=self.get_color("fg")).pack(pady=50)
 
     # -------- RESULTADOS --------
     def show_final_results(self):
@@ -582,135 +3377,662 @@ class QuizApp:
         Button(self.current_frame, text="Ir para o Início", command=self.start_initial_screen, font=("Helvetica", 14, "bold"), bg=self.get_color("button_bg"), fg=self.get_color("button_fg")).pack(pady=20)
 
     def save_logs_and_results(self, acertos, erros):
-        now = datetime.now()
-        date_str, time_str = now.strftime("%Y-%m-%d"), now.strftime("%H:%M:%S")
-        timestamp_file = now.strftime("%Y%m%d_%H%M%S")
-
+        """Enfileira a gravação (logs, results.csv e results_store); o aviso só sai depois do disco."""
+        if self.server is not None:
+            self.submit_results_to_server(acertos, erros)
+            return
         sim_dir = os.path.join(ROOT_DIR, self.current_simulado)
-        ensure_simulado_structure(sim_dir)
-        logs_dir = os.path.join(sim_dir, LOGS_FOLDER_NAME)
-        global_log = os.path.join(logs_dir, "log_global.txt")
-        indiv_log = os.path.join(logs_dir, f"teste_{timestamp_file}.txt")
-        results_csv = os.path.join(sim_dir, RESULTS_FILENAME)
-
-        with open(global_log, "a", encoding="utf-8") as f:
-            f.write(f"--- TESTE REALIZADO EM {date_str} {time_str} ---\n")
-            f.write(f"Arquivo: {self.md_filename}\n")
-            f.write(f"Resultado: {acertos} acertos, {erros} erros de {len(self.questions)} perguntas.\n\n")
-
-        with open(indiv_log, "w", encoding="utf-8") as f:
-            f.write(f"Relatório do Teste - {date_str} {time_str}\nArquivo Base: {self.md_filename}\n")
-            for i, ans in enumerate(self.user_answers):
-                f.write(f"P{i+1}: {ans['question']}\n R: {ans['selected']} | G: {ans['correct']} | {'OK' if ans['is_correct'] else 'X'}\n")
-
-        with open(results_csv, "a", newline="", encoding="utf-8") as f:
-            csv.writer(f).writerow([self.md_filename, date_str, time_str, acertos, erros, len(self.questions)])
-
-        messagebox.showinfo("Salvo!", f"Resultados salvos com sucesso.\nRelatório: {indiv_log}")
+        job = make_result_job(sim_dir, self.md_filename, self.user_answers, acertos, erros, len(self.questions),
+                              chapter=self.current_chapter)
+
+        def done(future):
+            try:
+                future.result()
+            except Exception as e:
+                messagebox.showerror("Erro ao salvar", f"Não foi possível gravar os resultados em {sim_dir}:\n{e}")
+                return
+            messagebox.showinfo("Salvo!", f"Resultados salvos com sucesso.\nRelatório: {job['indiv_log']}")
+        self.when_done(RESULTS_WRITER.submit(job), done)
+
+    def submit_results_to_server(self, acertos, erros):
+        """Envia o resultado para a pasta do usuário no servidor (fora da thread do Tk)."""
+        server, args = self.server, (self.current_simulado, self.current_chapter, self.md_filename,
+                                     self.user_answers, acertos, erros, len(self.questions))
+
+        def done(future):
+            try:
+                report = future.result()
+            except QuizServerError as e:
+                messagebox.showerror("Servidor", f"Não foi possível enviar o resultado: {e}")
+                return
+            messagebox.showinfo("Salvo!", f"Resultados enviados para o servidor ({server.user}).\nRelatório: {report}")
+        self.run_in_background(lambda: server.submit_result(*args), done)
 
     # -------- DASHBOARD --------
     def show_dashboard(self, simulado_name):
         self.current_simulado = simulado_name
         sim_dir = os.path.join(ROOT_DIR, simulado_name)
-        results_csv = os.path.join(sim_dir, RESULTS_FILENAME)
 
         self.clear_frame()
         Label(self.current_frame, text=f"Meu Progresso — {simulado_name}", font=("Helvetica", 24, "bold"), bg=self.get_color("bg"), fg=self.get_color("fg")).pack(pady=(0, 10))
         Button(self.current_frame, text="← Trocar Simulado", command=lambda: self.show_simulado_selection("dashboard"), font=("Helvetica", 12), bg=self.get_color("button_bg"), fg=self.get_color("button_fg")).pack(pady=(0, 10))
 
-        try:
-            df = pd.read_csv(results_csv)
-            if df.empty:
-                raise FileNotFoundError
-        except (FileNotFoundError, pd.errors.EmptyDataError):
+        if self.server is not None:  # a consulta ao servidor não pode travar a thread do Tk
+            frame = self.current_frame
+            loading = Label(frame, text="Carregando do servidor...", font=("Helvetica", 14, "italic"),
+                            bg=self.get_color("bg"), fg=self.get_color("fg"))
+            loading.pack(pady=50)
+
+            def done(future):
+                if self.current_frame is not frame:
+                    return  # o usuário já saiu do dashboard
+                loading.destroy()
+                try:
+                    aggr = future.result()
+                except QuizServerError as e:
+                    messagebox.showerror("Servidor", str(e))
+                    aggr = ResultsStore._empty_aggregates()
+                self._render_dashboard(simulado_name, aggr)
+            self.run_in_background(lambda: self.server.aggregates(simulado_name), done)
+            return
+
+        with span("dashboard_dados"):
+            aggr = open_results_store(sim_dir).aggregates()
+        self._render_dashboard(simulado_name, aggr)
+
+    def _render_dashboard(self, simulado_name, aggr):
+        if not aggr["records"]:
             Label(self.current_frame, text="Nenhum dado de resultado encontrado para este simulado.\nFaça um simulado para ver seu progresso!",
                   font=("Helvetica", 14), bg=self.get_color("bg"), fg=self.get_color("fg")).pack(pady=50)
             return
 
-        main_canvas = Canvas(self.current_frame, bg=self.get_color("bg"))
-        scrollbar = Scrollbar(self.current_frame, orient="vertical", command=main_canvas.yview)
-        scrollable_frame = Frame(main_canvas, bg=self.get_color("bg"))
-        scrollable_frame.bind("<Configure>", lambda e: main_canvas.configure(scrollregion=main_canvas.bbox("all")))
-        main_canvas.create_window((0, 0), window=scrollable_frame, anchor="nw")
-        main_canvas.configure(yscrollcommand=scrollbar.set)
-        main_canvas.pack(side="left", fill="both", expand=True)
-        scrollbar.pack(side="right", fill="y")
-
-        # dados
-        df["data"] = pd.to_datetime(df["data"])
-        # extrai número do capítulo; se não achar, marca N/A
-        df["capitulo"] = (df["arquivo_md"]
-                          .str.extract(r'Capítulo\s+(\d+)')
-                          .fillna(df["arquivo_md"].str.extract(r'(\d+)\.'))
-                          .fillna("N/A"))
-        df["percent_acerto"] = (df["acertos"] / df["total_perguntas"]) * 100
-
-        # estatísticas
-        stats_frame = Frame(scrollable_frame, bg=self.get_color("stats_bg"), bd=2, relief="groove")
+        # estatísticas (tabelas pré-calculadas do results_store)
+        stats_frame = Frame(self.current_frame, bg=self.get_color("stats_bg"), bd=2, relief="groove")
         stats_frame.pack(pady=10, padx=10, fill="x")
 
-        total_acertos = df["acertos"].sum()
-        total_perguntas = df["total_perguntas"].sum()
+        total_acertos = sum(row[0] for row in aggr["by_day"].values())
+        total_perguntas = sum(row[2] for row in aggr["by_day"].values())
         percent_total = (total_acertos / total_perguntas * 100) if total_perguntas > 0 else 0
 
-        df_today = df[df["data"].dt.date == datetime.today().date()]
-        acertos_hoje = df_today["acertos"].sum()
-        perguntas_hoje = df_today["total_perguntas"].sum()
+        acertos_hoje, _, perguntas_hoje, _, _ = aggr["by_day"].get(datetime.today().strftime("%Y-%m-%d"), [0, 0, 0, 0.0, 0])
         percent_hoje = (acertos_hoje / perguntas_hoje * 100) if perguntas_hoje > 0 else 0
 
         Label(stats_frame, text=f"Acerto Total: {percent_total:.1f}%", font=("Helvetica", 14, "bold"), bg=self.get_color("stats_bg"), fg=self.get_color("fg")).pack()
         Label(stats_frame, text=f"Acerto Hoje: {percent_hoje:.1f}%", font=("Helvetica", 14, "bold"), bg=self.get_color("stats_bg"), fg=self.get_color("fg")).pack()
 
-        # gráficos
-        plt.style.use('seaborn-v0_8-whitegrid')
-
-        # 1. Por arquivo/tópico
-        df_by_file = df.groupby("arquivo_md")[["acertos", "erros"]].sum()
-        fig1, ax1 = plt.subplots(figsize=(8, max(4, 0.5 * len(df_by_file))))
-        df_by_file.plot(kind="barh", ax=ax1, color=["#28a745", "#dc3545"])
-        ax1.set_title("Desempenho por Arquivo/Tópico")
-        ax1.set_xlabel("Nº de Questões"); ax1.set_ylabel("")
-        fig1.tight_layout(); fig1.subplots_adjust(left=0.4)
-        FigureCanvasTkAgg(fig1, master=scrollable_frame).get_tk_widget().pack(pady=10, padx=10, fill="x")
-
-        # 2. Por capítulo
-        df_by_chapter = df.groupby("capitulo")[["acertos", "erros"]].sum()
-        fig2, ax2 = plt.subplots(figsize=(8, 4))
-        df_by_chapter.plot(kind="bar", ax=ax2, color=["#007bff", "#ffc107"])
-        ax2.set_title("Desempenho por Capítulo")
-        ax2.set_ylabel("Nº de Questões"); ax2.set_xlabel("Capítulo")
-        plt.xticks(rotation=0); fig2.tight_layout()
-        FigureCanvasTkAgg(fig2, master=scrollable_frame).get_tk_widget().pack(pady=10, padx=10, fill="x")
-
-        # 3. Progresso diário
-        df_by_day = df.groupby(df["data"].dt.date)["percent_acerto"].mean()
-        fig3, ax3 = plt.subplots(figsize=(8, 4))
-        df_by_day.plot(kind="line", ax=ax3, marker="o", style="-")
-        ax3.set_title("Progresso Diário (% de Acerto)")
-        ax3.set_ylabel("% de Acerto"); ax3.set_xlabel("Data"); ax3.set_ylim(0, 105)
-        plt.xticks(rotation=45); fig3.tight_layout()
-        FigureCanvasTkAgg(fig3, master=scrollable_frame).get_tk_widget().pack(pady=10, padx=10, fill="x")
-
-        # 4. Por hora do dia
-        df["hora"] = pd.to_datetime(df["hora"], format="%H:%M:%S").dt.hour
-        df_by_hour = df.groupby("hora")["percent_acerto"].mean()
-        fig4, ax4 = plt.subplots(figsize=(8, 4))
-        df_by_hour.plot(kind="bar", ax=ax4)
-        ax4.set_title("Média de Acerto por Hora do Dia")
-        ax4.set_ylabel("% de Acerto"); ax4.set_xlabel("Hora do Dia"); ax4.set_ylim(0, 105)
-        plt.xticks(rotation=0); fig4.tight_layout()
-        FigureCanvasTkAgg(fig4, master=scrollable_frame).get_tk_widget().pack(pady=10, padx=10, fill="x")
+        # gráficos: uma aba por gráfico, renderizado só quando a aba é aberta
+        notebook = ttk.Notebook(self.current_frame)
+        notebook.pack(fill="both", expand=True, padx=10, pady=10)
+        tabs = {}
+        for chart, title in DASHBOARD_CHARTS:
+            tab = Frame(notebook, bg=self.get_color("bg"))
+            notebook.add(tab, text=title)
+            tabs[str(tab)] = (chart, tab)
+
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+        def on_tab_changed(_event):
+            chart, tab = tabs[notebook.select()]
+            if tab.winfo_children():
+                return  # já desenhado nesta visita
+            fig = dashboard_figure(simulado_name, aggr, chart)
+            canvas = Canvas(tab, bg=self.get_color("bg"), highlightthickness=0)
+            scrollbar = Scrollbar(tab, orient="vertical", command=canvas.yview)
+            inner = Frame(canvas, bg=self.get_color("bg"))
+            inner.bind("<Configure>", lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
+            canvas.create_window((0, 0), window=inner, anchor="nw")
+            canvas.configure(yscrollcommand=scrollbar.set)
+            canvas.pack(side="left", fill="both", expand=True)
+            scrollbar.pack(side="right", fill="y")
+            FigureCanvasTkAgg(fig, master=inner).get_tk_widget().pack(pady=10, padx=10, fill="x")
+
+        notebook.bind("<<NotebookTabChanged>>", on_tab_changed)
+        on_tab_changed(None)  # primeira aba (o evento inicial pode ter saído antes do bind)
+
+# -------------------------- LOTE SEM GUI --------------------------
+class JsonLogFormatter(logging.Formatter):
+    """Uma linha JSON por evento (campos extras em record.campos)."""
+    def format(self, record):
+        data = {"ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+                "nivel": record.levelname, "msg": record.getMessage()}
+        data.update(getattr(record, "campos", {}))
+        return json.dumps(data, ensure_ascii=False)
+
+def collect_generation_jobs(simulados, chapters=None, files=None, whole_chapter=False):
+    """[(simulado, capítulo, arquivo|None)] — arquivo None = capítulo inteiro."""
+    jobs = []
+    for sim in simulados:
+        for chapter in get_chapters(sim):
+            if chapters and chapter not in chapters:
+                continue
+            if whole_chapter:
+                jobs.append((sim, chapter, None))
+                continue
+            for md_file in get_md_files(sim, chapter):
+                if not files or md_file in files:
+                    jobs.append((sim, chapter, md_file))
+    return jobs
+
+def run_generation_job(sim, chapter, md_file, num_questions, force_regenerate=False):
+    """Gera um teste sem Tk; devolve um dict pronto para JSON (com 'erro' em caso de falha)."""
+    result = {"simulado": sim, "capitulo": chapter, "arquivo": md_file, "num_perguntas": num_questions}
+    started = time.monotonic()
+    content = (get_md_content(sim, chapter, md_file) if md_file
+               else get_all_md_content_from_chapter(sim, chapter))
+    if not content:
+        result["erro"] = "conteúdo não encontrado"
+        return result
+    compact = compress_content(content)
+    result["tokens_estimados"] = {"conteudo_original": estimate_tokens(content),
+                                  **estimate_request_tokens(compact, num_questions)}
+
+    try:  # novas tentativas e reenvios ficam em _request_questions (limite de configure_api_limits)
+        result["perguntas"] = generate_questions_chunked(compact, num_questions, force_regenerate)
+    except QuestionGenerationError as e:
+        result["erro"] = str(e)
+    result["segundos"] = round(time.monotonic() - started, 3)
+    return result
+
+def _job_output_path(out_dir, result):
+    name = os.path.splitext(result["arquivo"])[0] if result["arquivo"] else "capitulo_completo"
+    return os.path.join(out_dir, result["simulado"], result["capitulo"], f"{name}.json")
+
+def run_generation_batch(jobs, num_questions, concurrency=4, rate_per_s=None, attempts=API_MAX_ATTEMPTS,
+                         force_regenerate=False, out_dir=None):
+    """Executa os jobs em paralelo; cada resultado vai para out_dir/<sim>/<cap>/<arq>.json ou stdout (JSONL)."""
+    configure_api_limits(concurrency, rate_per_s, attempts)
+    failures = 0
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="lote") as pool:
+            futures = [pool.submit(run_generation_job, sim, ch, f, num_questions, force_regenerate)
+                       for sim, ch, f in jobs]
+            for done_count, future in enumerate(as_completed(futures), 1):
+                result = future.result()
+                summary = {k: result.get(k) for k in ("simulado", "capitulo", "arquivo", "segundos")}
+                summary["progresso"] = f"{done_count}/{len(jobs)}"
+                if "erro" in result:
+                    failures += 1
+                    log.error("falha na geração", extra={"campos": {**summary, "erro": result["erro"]}})
+                else:
+                    log.info("teste gerado", extra={"campos": {**summary, "perguntas": len(result["perguntas"])}})
+                if out_dir:
+                    path = _job_output_path(out_dir, result)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    with open(path, "w", encoding="utf-8") as f:
+                        json.dump(result, f, ensure_ascii=False, indent=2)
+                else:
+                    print(json.dumps(result, ensure_ascii=False), flush=True)
+    finally:
+        configure_api_limits()
+    return failures
+
+# -------------------------- SERVIDOR LOCAL (MODO MULTIUSUÁRIO) --------------------------
+# `python main.py servidor` sobe um servidor HTTP (asyncio, só biblioteca padrão) que expõe
+# simulados, capítulos, geração de perguntas e envio de resultados. Todos os clientes usam o
+# mesmo cache de perguntas, e pedidos idênticos em andamento são unificados (single-flight):
+# uma chamada à API atende todo mundo que pediu o mesmo conteúdo. Os resultados de cada
+# usuário vão para <simulado>/usuarios/<usuário>/, com o mesmo layout do simulado (logs/,
+# results.csv, results_store/, answers.db). A GUI usa o servidor quando SIMULADOMD_SERVER
+# está definido (ex.: SIMULADOMD_SERVER=http://127.0.0.1:8800 SIMULADOMD_USER=ana).
+_USER_NAME = re.compile(r"^[\w-][\w.-]{0,63}$")
+
+class ServerRequestError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+def user_results_dir(simulado_name: str, user: str) -> str:
+    if not isinstance(user, str) or not _USER_NAME.match(user):
+        raise ServerRequestError(400, "usuário inválido (letras, dígitos, '.', '_' e '-', até 64)")
+    return os.path.join(ROOT_DIR, simulado_name, USERS_DIRNAME, user)
+
+def _require_simulado(simulado_name):
+    if simulado_name not in list_simulados():
+        raise ServerRequestError(404, f"simulado não encontrado: {simulado_name!r}")
+    return simulado_name
+
+def _require_chapter(simulado_name: str, chapter_name):
+    """Só capítulos listados no índice: o nome vai para os.path.join (nada de '..' ou caminhos absolutos)."""
+    if chapter_name not in get_chapters(simulado_name):
+        raise ServerRequestError(404, f"capítulo não encontrado: {chapter_name!r}")
+    return chapter_name
+
+def _require_md_file(simulado_name: str, chapter_name: str, file_name):
+    if file_name not in get_md_files(simulado_name, chapter_name):
+        raise ServerRequestError(404, f"arquivo não encontrado: {file_name!r}")
+    return file_name
+
+class QuizServer:
+    """Servidor HTTP/1.1 (keep-alive, corpo JSON) com geração compartilhada entre clientes."""
+    def __init__(self, host: str = "127.0.0.1", port: int = SERVER_DEFAULT_PORT, concurrency: int = CHUNK_WORKERS):
+        self.host, self.port = host, port
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="servidor")
+        self.inflight = {}  # chave da geração -> asyncio.Future compartilhado
+        self.stats = {"requisicoes": 0, "geracoes": 0, "coalescidas": 0, "erros": 0, "resultados": 0}
+        self.loop = None
+        self._server = None
+        self._ready = threading.Event()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    # ---- ciclo de vida ----
+    async def serve(self):
+        import asyncio
+        self.loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]  # port=0 escolhe uma porta livre
+        self._ready.set()
+        async with self._server:
+            try:
+                await self._server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+
+    def start_in_thread(self):
+        """Sobe o servidor numa thread (testes, benchmark) e devolve self quando já aceita conexões."""
+        import asyncio
+        threading.Thread(target=lambda: asyncio.run(self.serve()), name="servidor-quiz", daemon=True).start()
+        self._ready.wait()
+        return self
+
+    def stop(self):
+        if self.loop is not None and self._server is not None:
+            self.loop.call_soon_threadsafe(self._server.close)
+        self.executor.shutdown(wait=False)
+
+    # ---- HTTP ----
+    async def _handle_connection(self, reader, writer):
+        import asyncio
+        from http import HTTPStatus
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length") or 0)
+                if length > SERVER_MAX_BODY_BYTES:
+                    status, payload = 413, {"erro": "corpo grande demais"}
+                    headers["connection"] = "close"
+                else:
+                    body = await reader.readexactly(length) if length else b""
+                    status, payload = await self._dispatch(method, target, body)
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                writer.write((f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+                              "Content-Type: application/json; charset=utf-8\r\n"
+                              f"Content-Length: {len(data)}\r\n"
+                              f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode("latin-1") + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass  # cliente desconectou ou mandou lixo
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method: str, target: str, body: bytes):
+        import urllib.parse
+        self.stats["requisicoes"] += 1
+        url = urllib.parse.urlsplit(target)
+        params = {k: v[-1] for k, v in urllib.parse.parse_qs(url.query).items()}
+        route = self.routes.get((method, url.path.rstrip("/")))
+        try:
+            if route is None:
+                raise ServerRequestError(404, f"rota desconhecida: {method} {url.path}")
+            try:
+                data = json.loads(body) if body else {}
+            except ValueError:
+                raise ServerRequestError(400, "corpo não é JSON válido")
+            if not isinstance(data, dict):
+                raise ServerRequestError(400, "corpo deve ser um objeto JSON")
+            return 200, await route(self, {**params, **data})
+        except ServerRequestError as e:
+            self.stats["erros"] += 1
+            return e.status, {"erro": str(e)}
+        except QuestionGenerationError as e:
+            self.stats["erros"] += 1
+            return 502, {"erro": str(e)}
+        except Exception as e:
+            self.stats["erros"] += 1
+            log.exception("erro no servidor", extra={"campos": {"rota": url.path}})
+            return 500, {"erro": f"{type(e).__name__}: {e}"}
+
+    def _run(self, fn, *args):
+        return self.loop.run_in_executor(self.executor, fn, *args)
+
+    # ---- rotas ----
+    async def _status(self, params):
+        return {**self.stats, "em_andamento": len(self.inflight)}
+
+    async def _simulados(self, params):
+        return {"simulados": await self._run(list_simulados)}
+
+    async def _capitulos(self, params):
+        sim = _require_simulado(params.get("simulado"))
+        return {"capitulos": await self._run(get_chapters, sim)}
+
+    async def _arquivos(self, params):
+        sim = _require_simulado(params.get("simulado"))
+        chapter = await self._run(_require_chapter, sim, params.get("capitulo"))
+        return {"arquivos": await self._run(get_md_files, sim, chapter)}
+
+    async def _gerar(self, params):
+        """
+        Gera (ou tira do cache) as perguntas. Pedidos com o mesmo conteúdo e nº de perguntas
+        que chegam enquanto a geração está em andamento esperam a mesma chamada à API.
+        """
+        sim = _require_simulado(params.get("simulado"))
+        chapter = await self._run(_require_chapter, sim, params.get("capitulo"))
+        file_name = params.get("arquivo") or None
+        if file_name:
+            await self._run(_require_md_file, sim, chapter, file_name)
+        try:
+            num_questions = int(params.get("perguntas", 10))
+        except (TypeError, ValueError):
+            raise ServerRequestError(400, "'perguntas' deve ser um número")
+        if not 1 <= num_questions <= SERVER_MAX_QUESTIONS:
+            raise ServerRequestError(400, f"'perguntas' deve estar entre 1 e {SERVER_MAX_QUESTIONS}")
+
+        if file_name:
+            content = await self._run(get_md_content, sim, chapter, file_name)
+        else:
+            content = await self._run(get_all_md_content_from_chapter, sim, chapter)
+        if not content:
+            raise ServerRequestError(404, "conteúdo não encontrado")
+        if params.get("banco"):
+            questions = await self._run(sample_from_bank, sim, chapter, file_name, num_questions)
+            return {"perguntas": questions, "conteudo": content, "compartilhada": False}
+
+        key = (question_cache_key(content, num_questions), file_name is None)
+        flight = self.inflight.get(key)
+        shared = flight is not None
+        if shared:
+            self.stats["coalescidas"] += 1
+        else:
+            self.stats["geracoes"] += 1
+            generate = generate_questions_from_api if file_name else generate_questions_chunked
+            flight = self._run(generate, content, num_questions, bool(params.get("forcar")))
+            self.inflight[key] = flight
+            flight.add_done_callback(lambda f: self.inflight.pop(key) if self.inflight.get(key) is f else None)
+        import asyncio
+        # shield: um cliente que desiste não cancela a geração dos outros
+        questions = await asyncio.shield(flight)
+        return {"perguntas": questions, "conteudo": content, "compartilhada": shared}
+
+    async def _resultados(self, params):
+        """Grava o resultado de um teste na pasta do usuário (mesmo lote atômico da GUI)."""
+        sim = _require_simulado(params.get("simulado"))
+        user_dir = user_results_dir(sim, params.get("usuario"))
+        answers = params.get("respostas")
+        try:
+            acertos, erros, total = (int(params[k]) for k in ("acertos", "erros", "total"))
+        except (KeyError, TypeError, ValueError):
+            raise ServerRequestError(400, "'acertos', 'erros' e 'total' são obrigatórios")
+        if not isinstance(answers, list) or not all(isinstance(a, dict) and "question" in a for a in answers):
+            raise ServerRequestError(400, "'respostas' deve ser uma lista de respostas")
+        job = make_result_job(user_dir, str(params.get("arquivo_md") or ""), answers, acertos, erros, total,
+                              chapter=params.get("capitulo"))
+        await self.loop.run_in_executor(None, write_results_batch, user_dir, [job])
+        self.stats["resultados"] += 1
+        return {"relatorio": job["indiv_log"]}
+
+    async def _agregados(self, params):
+        sim = _require_simulado(params.get("simulado"))
+        user_dir = user_results_dir(sim, params.get("usuario"))
+
+        def load():
+            if not os.path.isdir(user_dir):
+                return ResultsStore._empty_aggregates()
+            return open_results_store(user_dir).aggregates()
+        return {"agregados": await self.loop.run_in_executor(None, load)}
+
+    routes = {
+        ("GET", "/api/status"): _status,
+        ("GET", "/api/simulados"): _simulados,
+        ("GET", "/api/capitulos"): _capitulos,
+        ("GET", "/api/arquivos"): _arquivos,
+        ("POST", "/api/gerar"): _gerar,
+        ("POST", "/api/resultados"): _resultados,
+        ("GET", "/api/agregados"): _agregados,
+    }
+
+class QuizServerError(RuntimeError):
+    pass
+
+class QuizServerClient:
+    """Cliente (urllib) do servidor local; a GUI o usa no lugar das funções locais."""
+    def __init__(self, base_url: str, user: str, timeout: float = SERVER_CLIENT_TIMEOUT_S,
+                 query_timeout: float = SERVER_CLIENT_QUERY_TIMEOUT_S):
+        self.base_url, self.user = base_url.rstrip("/"), user
+        self.timeout, self.query_timeout = timeout, query_timeout
+
+    def _request(self, method: str, path: str, params=None, body=None):
+        import urllib.request, urllib.parse, urllib.error
+        url = self.base_url + path + ("?" + urllib.parse.urlencode(params) if params else "")
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8") if body is not None else None
+        req = urllib.request.Request(url, data=data, method=method, headers={"Content-Type": "application/json"})
+        # só os POST (geração e envio de resultado) podem demorar; as consultas falham logo
+        timeout = self.timeout if method == "POST" else self.query_timeout
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as resp:
+                return json.load(resp)
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.load(e).get("erro")
+            except ValueError:
+                message = None
+            raise QuizServerError(message or f"HTTP {e.code}") from e
+        except (urllib.error.URLError, OSError) as e:
+            raise QuizServerError(f"servidor indisponível ({self.base_url}): {e}") from e
+
+    def list_simulados(self):
+        return self._request("GET", "/api/simulados")["simulados"]
+
+    def get_chapters(self, simulado_name):
+        return self._request("GET", "/api/capitulos", {"simulado": simulado_name})["capitulos"]
+
+    def get_md_files(self, simulado_name, chapter_name):
+        return self._request("GET", "/api/arquivos", {"simulado": simulado_name, "capitulo": chapter_name})["arquivos"]
+
+    def generate(self, simulado_name, chapter_name, file_name=None, num_questions=10, force_regenerate=False, use_bank=False):
+        """(conteúdo, perguntas); o conteúdo volta junto para a GUI montar as justificativas."""
+        data = self._request("POST", "/api/gerar", body={
+            "simulado": simulado_name, "capitulo": chapter_name, "arquivo": file_name,
+            "perguntas": num_questions, "forcar": force_regenerate, "banco": use_bank})
+        return data["conteudo"], data["perguntas"]
+
+    def submit_result(self, simulado_name, chapter_name, md_filename, answers, acertos, erros, total):
+        return self._request("POST", "/api/resultados", body={
+            "usuario": self.user, "simulado": simulado_name, "capitulo": chapter_name, "arquivo_md": md_filename,
+            "respostas": answers, "acertos": acertos, "erros": erros, "total": total})["relatorio"]
+
+    def aggregates(self, simulado_name):
+        return self._request("GET", "/api/agregados", {"simulado": simulado_name, "usuario": self.user})["agregados"]
+
+def quiz_server_client():
+    """Cliente do servidor configurado em SIMULADOMD_SERVER (None = modo local)."""
+    base_url = os.getenv("SIMULADOMD_SERVER")
+    if not base_url:
+        return None
+    import getpass
+    return QuizServerClient(base_url, os.getenv("SIMULADOMD_USER") or getpass.getuser())
 
 # -------------------------- MAIN --------------------------
+def run_cli(argv):
+    """Comandos sem interface gráfica (ex.: python main.py banco dp900)."""
+    parser = argparse.ArgumentParser(prog="main.py", description="SimuladoMD - comandos sem interface gráfica")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_bank = sub.add_parser("banco", help="gera/atualiza o banco de perguntas (só arquivos novos ou alterados)")
+    p_bank.add_argument("simulados", nargs="*", help="simulados (padrão: todos)")
+    p_bank.add_argument("--por-arquivo", type=int, default=BANK_QUESTIONS_PER_FILE, help="perguntas por arquivo .md")
+    p_bank.add_argument("--forcar", action="store_true", help="regenera todos os arquivos, ignorando banco e cache")
+    p_migrate = sub.add_parser("migrar", help="importa o results.csv antigo para o results_store e os relatórios de texto para o answers.db")
+    p_migrate.add_argument("simulados", nargs="*", help="simulados (padrão: todos)")
+    p_aggr = sub.add_parser("agregados", help="recalcula as tabelas do dashboard a partir dos resultados brutos")
+    p_aggr.add_argument("simulados", nargs="*", help="simulados (padrão: todos)")
+    p_missed = sub.add_parser("erradas", help="perguntas mais erradas (consulta indexada ao answers.db)")
+    p_missed.add_argument("simulados", nargs="*", help="simulados (padrão: todos)")
+    p_missed.add_argument("--capitulo", help="só deste capítulo (ex.: 2)")
+    p_missed.add_argument("--arquivo", help="só deste arquivo .md")
+    p_missed.add_argument("--top", type=int, default=10, help="quantas perguntas listar")
+    p_mastery = sub.add_parser("dominio", help="arquivos e perguntas com maior prioridade de revisão (modo adaptativo)")
+    p_mastery.add_argument("simulados", nargs="*", help="simulados (padrão: todos)")
+    p_mastery.add_argument("--top", type=int, default=10, help="quantos itens listar")
+    p_gen = sub.add_parser("gerar", help="gera testes em lote, sem GUI (JSON por teste + logs estruturados)")
+    p_gen.add_argument("simulados", nargs="*", help="simulados (padrão: todos)")
+    p_gen.add_argument("--capitulo", action="append", help="restringe a estes capítulos (repetível)")
+    p_gen.add_argument("--arquivo", action="append", help="restringe a estes arquivos .md (repetível)")
+    p_gen.add_argument("--capitulo-inteiro", action="store_true", help="um teste por capítulo, em vez de um por arquivo")
+    p_gen.add_argument("--perguntas", type=int, default=10, help="perguntas por teste")
+    p_gen.add_argument("--concorrencia", type=int, default=4, help="chamadas simultâneas à API")
+    p_gen.add_argument("--taxa", type=float, help="máximo de chamadas à API por segundo")
+    p_gen.add_argument("--tentativas", type=int, default=API_MAX_ATTEMPTS,
+                       help="tentativas por chamada à API em falhas temporárias (backoff exponencial)")
+    p_gen.add_argument("--forcar", action="store_true", help="ignora o cache de perguntas")
+    p_gen.add_argument("--saida", help="diretório para os JSON (padrão: uma linha JSON por teste no stdout)")
+    p_search = sub.add_parser("buscar", help="busca BM25 em todos os simulados (atualiza o índice antes)")
+    p_search.add_argument("consulta", help="termos da busca (sem diferença de acentos)")
+    p_search.add_argument("--simulado", help="só neste simulado")
+    p_search.add_argument("--top", type=int, default=10, help="quantos trechos listar")
+    p_search.add_argument("--reindexar", action="store_true", help="apaga e monta o índice do zero")
+    sub.add_parser("provedores", help="latência (p50/p95), erros e vitórias de cada provedor da API")
+    p_server = sub.add_parser("servidor", help="servidor local para vários usuários (cache e geração compartilhados)")
+    p_server.add_argument("--host", default="127.0.0.1", help="endereço (0.0.0.0 para a rede local)")
+    p_server.add_argument("--porta", type=int, default=SERVER_DEFAULT_PORT)
+    p_server.add_argument("--concorrencia", type=int, default=CHUNK_WORKERS, help="gerações simultâneas")
+    p_server.add_argument("--taxa", type=float, help="máximo de chamadas à API por segundo")
+    args = parser.parse_args(argv)
+
+    if args.command == "servidor":
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(JsonLogFormatter())
+        log.addHandler(handler)
+        log.setLevel(logging.INFO)
+        if not get_client():
+            log.warning("DEEPSEEK_API_KEY não encontrada: só cache e banco de perguntas estarão disponíveis")
+        configure_api_limits(args.concorrencia, args.taxa)
+        server = QuizServer(args.host, args.porta, args.concorrencia)
+        log.info("servidor iniciado", extra={"campos": {"url": server.base_url, "concorrencia": args.concorrencia}})
+        import asyncio
+        try:
+            asyncio.run(server.serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            log.info("servidor encerrado", extra={"campos": server.stats})
+        return 0
+
+    if args.command == "gerar":
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(JsonLogFormatter())
+        log.addHandler(handler)
+        log.setLevel(logging.INFO)
+        if not get_client():
+            log.error("DEEPSEEK_API_KEY não encontrada")
+            return 2
+        jobs = collect_generation_jobs(args.simulados or list_simulados(), args.capitulo, args.arquivo, args.capitulo_inteiro)
+        log.info("lote iniciado", extra={"campos": {"testes": len(jobs), "concorrencia": args.concorrencia}})
+        failures = run_generation_batch(jobs, args.perguntas, args.concorrencia, args.taxa, args.tentativas,
+                                        args.forcar, args.saida)
+        log.info("lote concluído", extra={"campos": {"testes": len(jobs), "falhas": failures}})
+        log.info("tempos por etapa", extra={"campos": {"etapas": TIMINGS.summary()}})
+        log.info("provedores", extra={"campos": {"provedores": provider_router().summary()}})
+        return 1 if failures else 0
+
+    if args.command == "provedores":
+        router = provider_router()
+        if router is None:
+            print("DEEPSEEK_API_KEY não encontrada. Crie um arquivo '.env' e adicione a chave.")
+            return 2
+        print(json.dumps({"ordem": [p.name for p in router.ordered()], "provedores": router.summary()},
+                         ensure_ascii=False, indent=2))
+        return 0
+
+    if args.command == "buscar":
+        idx = search_index()
+        if args.reindexar and os.path.exists(idx.path):
+            with idx.connect() as conn:
+                conn.execute("DELETE FROM postings")
+                conn.execute("DELETE FROM paragraphs")
+                conn.execute("DELETE FROM files")
+        t0 = time.perf_counter()
+        changed = idx.refresh(force=True)
+        t1 = time.perf_counter()
+        hits = idx.search(args.consulta, args.top, args.simulado)
+        print(json.dumps({"consulta": args.consulta, "simulado": args.simulado, "arquivos_reindexados": changed,
+                          "indexacao_ms": round((t1 - t0) * 1000, 2),
+                          "consulta_ms": round((time.perf_counter() - t1) * 1000, 2), "trechos": hits},
+                         ensure_ascii=False, indent=2))
+        return 0
+
+    if args.command == "erradas":
+        for sim in args.simulados or list_simulados():
+            answers = AnswerLog(os.path.join(ROOT_DIR, sim))
+            answers.import_text_logs()
+            t0 = time.perf_counter()
+            rows = answers.most_missed(args.capitulo, args.arquivo, args.top)
+            print(json.dumps({"simulado": sim, "capitulo": args.capitulo, "arquivo": args.arquivo,
+                              "consulta_ms": round((time.perf_counter() - t0) * 1000, 2), "perguntas": rows},
+                             ensure_ascii=False, indent=2))
+        return 0
+
+    if args.command == "dominio":
+        for sim in args.simulados or list_simulados():
+            idx = mastery_index(sim)
+            report = {table: [{"item": key, "peso": round(w, 3), "tentativas": n, "erros": e}
+                              for w, key, n, e in idx.weakest(table, args.top)]
+                      for table in ("files", "questions")}
+            texts = idx.answers.question_texts([r["item"] for r in report["questions"]])
+            for r in report["questions"]:
+                r["item"] = texts.get(r["item"], r["item"])
+            print(json.dumps({"simulado": sim, "arquivos": report["files"], "perguntas": report["questions"]},
+                             ensure_ascii=False, indent=2))
+        return 0
+
+    if args.command in ("migrar", "agregados"):
+        for sim in args.simulados or list_simulados():
+            sim_dir = os.path.join(ROOT_DIR, sim)
+            if not os.path.isdir(sim_dir):
+                continue
+            store = ResultsStore(sim_dir)
+            if args.command == "migrar":
+                print(f"[{sim}] {store.migrate_csv()} linhas importadas; "
+                      f"{AnswerLog(sim_dir).import_text_logs()} relatórios importados para {ANSWERS_DB_FILENAME}")
+            else:
+                print(f"[{sim}] {store.rebuild_aggregates()['records']} resultados agregados")
+        return 0
+
+    if not get_client():
+        print("DEEPSEEK_API_KEY não encontrada. Crie um arquivo '.env' e adicione a chave.")
+        return 2
+    failures = 0
+    for sim in args.simulados or list_simulados():
+        stats = build_question_bank(sim, args.por_arquivo, args.forcar, report=print)
+        failures += stats["falhas"]
+        print(f"[{sim}] {', '.join(f'{k}: {v}' for k, v in stats.items())} — {question_bank_path(sim)}")
+    return 1 if failures else 0
+
 if __name__ == "__main__":
-    if not os.getenv("DEEPSEEK_API_KEY"):
-        messagebox.showerror("Configuração Necessária", "DEEPSEEK_API_KEY não encontrada.\nCrie um arquivo '.env' e adicione a chave.")
+    if len(sys.argv) > 1:
+        sys.exit(run_cli(sys.argv[1:]))
+    import importlib.util
+    if importlib.util.find_spec("matplotlib") is None:  # só verifica; o import de fato fica para o dashboard
+        messagebox.showerror("Bibliotecas Faltando", "A biblioteca 'matplotlib' é necessária.\nInstale-a com: pip install matplotlib")
     else:
-        try:
-            import pandas as _p; import matplotlib.pyplot as _m
-        except ImportError:
-            messagebox.showerror("Bibliotecas Faltando", "As bibliotecas 'pandas' e 'matplotlib' são necessárias.\nInstale-as com: pip install pandas matplotlib")
-        else:
-            root = tk.Tk()
-            app = QuizApp(root)
-            root.mainloop()
+        root = tk.Tk()
+        app = QuizApp(root)
+        root.after(WARMUP_DELAY_MS, lambda: threading.Thread(target=warm_up_imports, name="warmup", daemon=True).start())
+        if not os.getenv("DEEPSEEK_API_KEY") and not app.server:
+            messagebox.showwarning("Modo Offline", "DEEPSEEK_API_KEY não encontrada.\nSó o banco de perguntas offline estará disponível.\n"
+                                                   "Para gerar perguntas, crie um arquivo '.env' e adicione a chave.")
+        root.mainloop()
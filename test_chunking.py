@@ -0,0 +1,21 @@
+# test_chunking.py
+"""Divisão de capítulos em partes: nenhuma chamada pede mais que MAX_QUESTIONS_PER_CALL perguntas."""
+import main
+
+def _long_section(title: str, lines: int) -> str:
+    body = "\n".join(f"Linha {i} do tópico {title} sobre dados, nuvem e segurança na plataforma." for i in range(lines))
+    return f"# {title}\n{body}"
+
+def test_poucas_secoes_longas_respeitam_o_limite_por_chamada():
+    # três seções de tamanhos bem diferentes e sem linhas em branco (como as transcrições)
+    content = "\n---\n".join([_long_section("A", 300), _long_section("B", 40), _long_section("C", 120)])
+    for num_questions in (12, 13, 25, 50):
+        chunks = main.split_content_into_chunks(content, num_questions)
+        counts = main.distribute_questions(num_questions, chunks)
+        assert sum(counts) == num_questions
+        assert max(counts) <= main.MAX_QUESTIONS_PER_CALL, (num_questions, counts)
+
+def test_excedente_vai_para_partes_com_folga():
+    chunks = ["x" * 40000, "y" * 400, "z" * 400]
+    counts = main.distribute_questions(30, chunks)
+    assert counts[0] == main.MAX_QUESTIONS_PER_CALL and sum(counts) == 30